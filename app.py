@@ -5,7 +5,11 @@ Industrial schematic diagram analysis using Gemini 3 API.
 """
 import os
 import sys
+import json
+import logging
+from pathlib import Path
 
+import click
 from flask import Flask
 
 from config import Config
@@ -44,6 +48,27 @@ def create_app() -> Flask:
     def internal_error(e):
         return {"error": "Internal server error", "details": str(e)}, 500
     
+    @app.cli.command("clear-cache")
+    def clear_cache():
+        """Delete cached Gemini extractions."""
+        from services.disk_cache import DiskCache
+        removed = DiskCache(Config.CACHE_DIR / "extractions").clear()
+        print(f"Removed {removed} cached extractions")
+    
+    @app.cli.command("preview-page")
+    @click.argument("pdf_path", type=click.Path(exists=True, dir_okay=False))
+    @click.argument("pdf_page", type=int)
+    def preview_page(pdf_path: str, pdf_page: int):
+        """Stream one page's extraction as JSON lines, without storing it (PDF_PAGE is 1-based)."""
+        from services import GeminiService
+        gemini = GeminiService()
+        # Only the page itself is uploaded; it is page 1 of that upload
+        page_file = gemini.upload_page_range(Path(pdf_path), [pdf_page - 1])
+        for key, item in gemini.stream_extract_page(
+            page_file, 0, include_paths=Config.GEMINI_EXTRACT_CONNECTION_PATHS
+        ):
+            print(json.dumps({key: item}, ensure_ascii=False), flush=True)
+    
     return app
 
 
@@ -56,6 +81,12 @@ def main():
     port = int(os.environ.get('FLASK_PORT', 5000))
     debug = Config.DEBUG
     
+    # Configure logging here rather than at service import time
+    logging.basicConfig(
+        level=logging.DEBUG if debug else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    
     print(f"""
 =================================================================
   Schematic Extraction MVP - Industrial Diagram Analysis
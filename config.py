@@ -12,6 +12,7 @@ load_dotenv()
 # Base directories
 BASE_DIR = Path(__file__).parent.absolute()
 UPLOADS_DIR = BASE_DIR / "uploads"
+CACHE_DIR = BASE_DIR / "cache"
 DATABASE_PATH = BASE_DIR / "schematic_analysis.db"
 
 # Ensure uploads directory exists
@@ -37,13 +38,26 @@ class Config:
     GEMINI_TEMPERATURE = float(os.getenv("GEMINI_TEMPERATURE", "0.1"))
     GEMINI_THINKING_LEVEL = os.getenv("GEMINI_THINKING_LEVEL", "medium")  # low/medium/high
     GEMINI_MEDIA_RESOLUTION = os.getenv("GEMINI_MEDIA_RESOLUTION", "high")  # low/medium/high
-    GEMINI_TIMEOUT = int(os.getenv("GEMINI_TIMEOUT", "120"))  # seconds
+    GEMINI_ADAPTIVE_MEDIA_RESOLUTION = os.getenv("GEMINI_ADAPTIVE_MEDIA_RESOLUTION", "false").lower() == "true"  # low res for sparse pages
+    GEMINI_SKIP_BLANK_PAGES = os.getenv("GEMINI_SKIP_BLANK_PAGES", "true").lower() == "true"  # don't send blank pages to Gemini
+    GEMINI_TIMEOUT = int(os.getenv("GEMINI_TIMEOUT", "120"))  # seconds per generation call
     GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+    GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "5"))  # max in-flight page extractions
+    GEMINI_TITLE_BLOCK_BATCH_SIZE = int(os.getenv("GEMINI_TITLE_BLOCK_BATCH_SIZE", "20"))  # pages per title block call
+    GEMINI_PAGES_PER_REQUEST = int(os.getenv("GEMINI_PAGES_PER_REQUEST", "1"))  # pages per extraction call
+    GEMINI_USE_RESPONSE_SCHEMA = os.getenv("GEMINI_USE_RESPONSE_SCHEMA", "false").lower() == "true"  # constrained decoding for extraction
+    GEMINI_EXTRACT_CONNECTION_PATHS = os.getenv("GEMINI_EXTRACT_CONNECTION_PATHS", "true").lower() == "true"  # trace wire routes
+    GEMINI_USE_BATCH_MODE = os.getenv("GEMINI_USE_BATCH_MODE", "false").lower() == "true"  # extract via Batch Mode jobs (cheaper, slower)
+    GEMINI_COMBINE_TITLE_BLOCKS = os.getenv("GEMINI_COMBINE_TITLE_BLOCKS", "false").lower() == "true"  # detect title blocks in the extraction call
     
     # File upload settings
     MAX_CONTENT_LENGTH = int(os.getenv("MAX_FILE_SIZE_MB", "100")) * 1024 * 1024  # 100MB default
     ALLOWED_EXTENSIONS = {"pdf"}
     UPLOADS_DIR = UPLOADS_DIR
+    CACHE_DIR = CACHE_DIR  # on-disk Gemini response cache
+    CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"  # false: always call Gemini, never reuse extractions
+    CACHE_MAX_AGE_DAYS = float(os.getenv("CACHE_MAX_AGE_DAYS", "30"))  # cached extractions expire after this
+    CACHE_MAX_SIZE_MB = int(os.getenv("CACHE_MAX_SIZE_MB", "1024"))  # oldest extractions evicted past this
     
     # Extraction settings (MVP - pages 7, 8, 9)
     MVP_PDF_PAGES = [6, 7, 8]  # 0-based indices for PDF pages 7, 8, 9
@@ -83,6 +97,15 @@ class Config:
         if cls.GEMINI_MEDIA_RESOLUTION not in ("low", "medium", "high"):
             errors.append(f"GEMINI_MEDIA_RESOLUTION must be low/medium/high, got: {cls.GEMINI_MEDIA_RESOLUTION}")
         
+        if cls.GEMINI_CONCURRENCY < 1:
+            errors.append(f"GEMINI_CONCURRENCY must be >= 1, got: {cls.GEMINI_CONCURRENCY}")
+        
+        if cls.GEMINI_TITLE_BLOCK_BATCH_SIZE < 1:
+            errors.append(f"GEMINI_TITLE_BLOCK_BATCH_SIZE must be >= 1, got: {cls.GEMINI_TITLE_BLOCK_BATCH_SIZE}")
+        
+        if cls.GEMINI_PAGES_PER_REQUEST < 1:
+            errors.append(f"GEMINI_PAGES_PER_REQUEST must be >= 1, got: {cls.GEMINI_PAGES_PER_REQUEST}")
+        
         if errors:
             raise ValueError("Configuration errors:\n" + "\n".join(f"  - {e}" for e in errors))
         
@@ -4,7 +4,8 @@ SQLAlchemy database models for Schematic Extraction MVP.
 """
 from datetime import datetime
 from typing import Optional, List
-import json
+
+import orjson
 
 from sqlalchemy import (
     create_engine, Column, Integer, String, Float, Boolean, Text, 
@@ -23,12 +24,12 @@ class JSONType(TypeDecorator):
     
     def process_bind_param(self, value, dialect):
         if value is not None:
-            return json.dumps(value)
+            return orjson.dumps(value).decode("utf-8")
         return None
     
     def process_result_value(self, value, dialect):
         if value is not None:
-            return json.loads(value)
+            return orjson.loads(value)
         return None
 
 
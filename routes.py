@@ -20,11 +20,8 @@ from models import (
     Machine, SchematicFile, SchematicPage, Component, 
     Connection, WireLabel, ExtractionStatus, SessionLocal, init_db
 )
-from services import (
-    GeminiService, PDFProcessor, ExtractionService, 
-    ValidationService, OverlayService
-)
-from services.extraction_service import ExtractionEvent
+# Services are imported inside the routes that use them, so PyMuPDF and
+# google-genai only load when a request needs them
 
 # Create blueprints
 api = Blueprint('api', __name__)
@@ -173,6 +170,10 @@ def replace_upload(schematic_file_id: int):
         
         db.commit()
         
+        # Bulk deletes don't fire ORM events, so drop cached overlays here
+        from services.overlay_cache import invalidate_overlays
+        invalidate_overlays(schematic_file_id)
+        
         return jsonify({
             "schematic_file_id": schematic_file_id,
             "message": "Ready for re-extraction"
@@ -253,6 +254,7 @@ def stream_extraction(schematic_file_id: int):
                 context_pages = Config.DEFAULT_CONTEXT_PAGES
             
             # Start extraction
+            from services import ExtractionService
             service = ExtractionService(db)
             
             for result in service.extract_schematic(
@@ -497,6 +499,7 @@ def get_pdf_with_overlay(component_id: int):
         if not pdf_path.exists():
             return jsonify({"error": "PDF file not found on disk"}), 404
         
+        from services import OverlayService
         overlay_service = OverlayService(db)
         pdf_bytes = overlay_service.create_component_overlay(
             pdf_path=pdf_path,
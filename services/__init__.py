@@ -1,11 +1,26 @@
 """
 Services package for Schematic Extraction MVP.
+
+Services are loaded on first access, so importing the package doesn't pull
+in PyMuPDF or google-genai until a service that needs them is used.
 """
-from .gemini_service import GeminiService
-from .pdf_processor import PDFProcessor
-from .extraction_service import ExtractionService
-from .validation_service import ValidationService
-from .overlay_service import OverlayService
+import importlib
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .gemini_service import GeminiService
+    from .pdf_processor import PDFProcessor
+    from .extraction_service import ExtractionService
+    from .validation_service import ValidationService
+    from .overlay_service import OverlayService
+
+_EXPORTS = {
+    "GeminiService": ".gemini_service",
+    "PDFProcessor": ".pdf_processor",
+    "ExtractionService": ".extraction_service",
+    "ValidationService": ".validation_service",
+    "OverlayService": ".overlay_service",
+}
 
 __all__ = [
     "GeminiService",
@@ -15,3 +30,13 @@ __all__ = [
     "OverlayService",
 ]
 
+
+def __getattr__(name: str) -> Any:
+    """Import a service module on first access to its class."""
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
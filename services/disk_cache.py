@@ -0,0 +1,162 @@
+"""
+On-disk cache for Gemini responses.
+Stores zstd-compressed JSON blobs, one file per key.
+"""
+import os
+import time
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+import orjson
+import zstandard
+
+logger = logging.getLogger(__name__)
+
+
+class DiskCache:
+    """
+    File-per-key cache under a directory.
+    
+    Values are serialized with orjson and compressed with zstd; extraction
+    JSON is highly repetitive, so entries end up several times smaller than
+    the raw response and are cheap to read back.
+    
+    Entries older than max_age are treated as misses and deleted, and once
+    the directory grows past max_bytes the oldest entries are evicted.
+    A disabled cache never reads or writes.
+    
+    Keys must be filesystem-safe (e.g. hex digests).
+    """
+    
+    COMPRESSION_LEVEL = 3
+    PRUNE_TARGET = 0.9  # evict down to this fraction of max_bytes, so pruning isn't repeated on every write
+    
+    def __init__(
+        self,
+        directory: Path,
+        max_age: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        enabled: bool = True
+    ):
+        """
+        Initialize cache directory.
+        
+        Args:
+            directory: Directory to store cache entries in
+            max_age: Seconds an entry stays valid (None: forever)
+            max_bytes: Total size above which the oldest entries are evicted (None: unbounded)
+            enabled: False bypasses the cache entirely
+        """
+        self.directory = Path(directory)
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._size: Optional[int] = None  # bytes on disk, scanned on first write
+        self._size_lock = threading.Lock()
+        if enabled:
+            self.directory.mkdir(parents=True, exist_ok=True)
+    
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json.zst"
+    
+    def _entries(self) -> List[Tuple[float, int, Path]]:
+        """List (mtime, size, path) of every entry on disk."""
+        entries = []
+        for path in self.directory.glob("*.json.zst"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue  # removed by another worker
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+    
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Read a cached value.
+        
+        Returns:
+            Cached value, or None on miss, expired or unreadable entry
+        """
+        if not self.enabled:
+            return None
+        
+        path = self._path(key)
+        try:
+            if self.max_age is not None and path.stat().st_mtime < time.time() - self.max_age:
+                path.unlink(missing_ok=True)
+                return None
+            return orjson.loads(zstandard.decompress(path.read_bytes()))
+        except FileNotFoundError:
+            return None
+        except (zstandard.ZstdError, orjson.JSONDecodeError) as e:
+            logger.warning("Discarding unreadable cache entry %s: %s", path.name, e)
+            path.unlink(missing_ok=True)
+            return None
+    
+    def set(self, key: str, value: Any) -> None:
+        """Write a value, replacing any existing entry atomically."""
+        if not self.enabled:
+            return
+        
+        data = zstandard.compress(orjson.dumps(value), self.COMPRESSION_LEVEL)
+        
+        # Write to a temp file and rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        
+        if self.max_bytes is not None:
+            with self._size_lock:
+                if self._size is None:
+                    self._size = sum(size for _, size, _ in self._entries())
+                else:
+                    self._size += len(data)
+                if self._size > self.max_bytes:
+                    self._size = self._prune()
+    
+    def delete(self, key: str) -> None:
+        """Remove an entry, if present."""
+        self._path(key).unlink(missing_ok=True)
+    
+    def _prune(self) -> int:
+        """
+        Evict expired entries, then the oldest ones until under the size target.
+        
+        Returns:
+            Bytes left on disk
+        """
+        entries = sorted(self._entries())
+        cutoff = time.time() - self.max_age if self.max_age is not None else None
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * self.PRUNE_TARGET
+        evicted = 0
+        for mtime, size, path in entries:
+            if total <= target and (cutoff is None or mtime >= cutoff):
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            evicted += 1
+        logger.info("Evicted %d entries from %s (%d bytes left)", evicted, self.directory, total)
+        return total
+    
+    def clear(self) -> int:
+        """
+        Delete every entry.
+        
+        Returns:
+            Number of entries deleted
+        """
+        entries = self._entries()
+        for _, _, path in entries:
+            path.unlink(missing_ok=True)
+        with self._size_lock:
+            self._size = 0
+        return len(entries)
@@ -0,0 +1,94 @@
+"""
+Typed payloads for Gemini extraction responses.
+Decoded with msgspec in one pass instead of json parsing plus dict walks.
+"""
+from typing import Any, Dict, List, Optional
+
+import msgspec
+
+
+class ComponentPayload(msgspec.Struct, omit_defaults=True):
+    """Component as returned by the model."""
+    mark: str
+    symbol: Optional[str] = None
+    name: Optional[str] = None
+    type: Optional[str] = None
+    x: Optional[float] = None
+    y: Optional[float] = None
+    width: Optional[float] = None
+    height: Optional[float] = None
+    description: Optional[str] = None
+
+
+class ConnectionPayload(msgspec.Struct, omit_defaults=True):
+    """Connection as returned by the model."""
+    from_component_mark: Optional[str] = None
+    to_component_mark: Optional[str] = None
+    wire_label: Optional[str] = None
+    terminal_from: Optional[str] = None
+    terminal_to: Optional[str] = None
+    is_external: Optional[bool] = None
+    path: Optional[List[List[float]]] = None
+
+
+class WireLabelPayload(msgspec.Struct, omit_defaults=True):
+    """Wire label as returned by the model."""
+    label: str
+    x: Optional[float] = None
+    y: Optional[float] = None
+
+
+class ContinuationPayload(msgspec.Struct, omit_defaults=True):
+    """Continuation marker as returned by the model."""
+    from_component_mark: Optional[str] = None
+    to_page_hint: Optional[str] = None
+    direction: Optional[str] = None
+
+
+class ExtractionPayload(msgspec.Struct, omit_defaults=True):
+    """Extraction result for one page."""
+    components: List[ComponentPayload] = []
+    connections: List[ConnectionPayload] = []
+    wire_labels: List[WireLabelPayload] = []
+    continuations: List[ContinuationPayload] = []
+    pdf_page: Optional[int] = None  # Only set in multi-page responses
+
+
+class MultiPageExtractionPayload(msgspec.Struct):
+    """Extraction result for several pages in one response."""
+    pages: List[ExtractionPayload]
+
+
+# Decoders are built once per type; strict=False accepts numbers sent as strings
+_decoders = {
+    False: msgspec.json.Decoder(ExtractionPayload, strict=False),
+    True: msgspec.json.Decoder(MultiPageExtractionPayload, strict=False),
+}
+
+
+def decode_extraction(raw: str, multi_page: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Decode an extraction response into plain dicts.
+
+    All four arrays are always present in each page. Unset optional fields
+    are omitted, matching what callers already read with .get().
+
+    Args:
+        raw: Response text
+        multi_page: Whether the response is a {"pages": [...]} object
+
+    Returns:
+        Result dictionary, or None if the text doesn't match the payload
+        types (callers then fall back to lenient parsing)
+    """
+    try:
+        payload = _decoders[multi_page].decode(raw)
+    except (msgspec.DecodeError, msgspec.ValidationError):
+        return None
+
+    result = msgspec.to_builtins(payload)
+    # omit_defaults also drops empty arrays; put them back
+    for page in result["pages"] if multi_page else [result]:
+        for key in ("components", "connections", "wire_labels", "continuations"):
+            page.setdefault(key, [])
+    return result
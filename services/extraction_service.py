@@ -1,15 +1,14 @@
 """
 Extraction Service for orchestrating schematic extraction workflow.
-Handles sequential page processing with streaming results.
+Handles concurrent page extraction with streaming results.
 """
-import json
 import logging
 from datetime import datetime
 from pathlib import Path
 from typing import Optional, Dict, Any, List, Generator, Tuple
 
-logger = logging.getLogger(__name__)
-
+import numpy as np
+import orjson
 from sqlalchemy.orm import Session
 
 from config import Config
@@ -20,6 +19,8 @@ from models import (
 from .gemini_service import GeminiService
 from .pdf_processor import PDFProcessor
 
+logger = logging.getLogger(__name__)
+
 
 class ExtractionEvent:
     """Event types for streaming extraction progress."""
@@ -61,7 +62,7 @@ class ExtractionResult:
     
     def to_sse(self) -> str:
         """Format as Server-Sent Event."""
-        return f"data: {json.dumps(self.to_dict())}\n\n"
+        return f"data: {orjson.dumps(self.to_dict()).decode('utf-8')}\n\n"
 
 
 class ExtractionService:
@@ -69,7 +70,7 @@ class ExtractionService:
     Service for orchestrating schematic extraction.
     
     Features:
-    - Sequential page processing (MVP)
+    - Concurrent page extraction (asyncio fan-out)
     - Context caching (single upload)
     - Streaming results
     - Per-page retry with backoff
@@ -140,22 +141,35 @@ class ExtractionService:
                     "message": "Uploading PDF to Gemini Files API..."
                 }, schematic_file.id)
                 
-                uploaded_file = self.gemini.upload_file(pdf_path, display_name=schematic_file.filename)
-                schematic_file.gemini_file_uri = uploaded_file.name
-                self.db.commit()
-                
-                # Step 2: Create cached content (for 90% cost savings on subsequent calls)
-                yield self._emit(ExtractionEvent.PROGRESS, {
-                    "status": "caching",
-                    "message": "Creating cached content..."
-                }, schematic_file.id)
-                
-                cached_content = self.gemini.create_cached_content(
-                    uploaded_file=uploaded_file,
-                    system_instruction="You are an expert at analyzing industrial electrical schematics.",
-                    use_flash=False,  # Use Pro for accuracy
-                    ttl="3600s"
-                )
+                # A single page is sliced out and sent with each request instead of
+                # uploading and caching the whole PDF
+                page_file = None
+                if (
+                    not Config.GEMINI_USE_BATCH_MODE
+                    and len(set(pdf_page_indices)) == 1
+                    and 0 <= pdf_page_indices[0] < processor.page_count
+                ):
+                    page_file = self.gemini.upload_page_range(
+                        pdf_path, pdf_page_indices, display_name=schematic_file.filename
+                    )
+                    cached_content = None
+                else:
+                    uploaded_file = self.gemini.upload_file(pdf_path, display_name=schematic_file.filename)
+                    schematic_file.gemini_file_uri = uploaded_file.name
+                    self.db.commit()
+                    
+                    # Step 2: Create cached content (for 90% cost savings on subsequent calls)
+                    yield self._emit(ExtractionEvent.PROGRESS, {
+                        "status": "caching",
+                        "message": "Creating cached content..."
+                    }, schematic_file.id)
+                    
+                    cached_content = self.gemini.create_cached_content(
+                        uploaded_file=uploaded_file,
+                        system_instruction="You are an expert at analyzing industrial electrical schematics.",
+                        use_flash=False,  # Use Pro for accuracy
+                        ttl="86400s" if Config.GEMINI_USE_BATCH_MODE else "3600s"  # Batch jobs can run for hours
+                    )
                 
                 # Step 3: Extract context text (instructions/legend)
                 context_text = processor.extract_context_pages_text(
@@ -163,131 +177,173 @@ class ExtractionService:
                     legend_page=context_page_indices[1] if len(context_page_indices) > 1 else 2
                 )
                 
-                # Step 4: Detect title blocks using cached content
+                # Blank pages are neither detected nor extracted. Pages outside the
+                # PDF stay in content_pages and fail on the per-page error path.
+                in_range = {idx for idx in pdf_page_indices if 0 <= idx < processor.page_count}
+                blank_pages = {idx for idx in in_range if self.gemini.is_blank_page(processor, idx)}
+                content_pages = [idx for idx in pdf_page_indices if idx not in blank_pages]
+                
+                media_resolutions = {
+                    idx: self.gemini.pick_media_resolution(processor, idx)
+                    for idx in content_pages
+                    if idx in in_range
+                }
+                
+                def _dimensions(pdf_idx: int) -> Tuple[Optional[float], Optional[float]]:
+                    return processor.get_page_dimensions(pdf_idx) if pdf_idx in in_range else (None, None)
+                
+                # Step 4: Detect title blocks. Online, each page's title block
+                # arrives with its extraction (step 6); Batch Mode detects them
+                # all up front so the mapping is shown while the job runs.
                 yield self._emit(ExtractionEvent.PROGRESS, {
                     "status": "detecting_title_blocks",
-                    "message": f"Detecting title blocks for {len(pdf_page_indices)} pages..."
+                    "message": f"Detecting title blocks for {len(content_pages)} pages..."
                 }, schematic_file.id)
                 
-                try:
-                    page_mapping = self.gemini.detect_title_blocks(cached_content, pdf_page_indices)
-                    logger.info(f"Title blocks detected: {page_mapping}")
-                except Exception as e:
-                    logger.error(f"Title block detection failed: {e}")
-                    # Fallback: empty mapping
-                    page_mapping = {
-                        idx: {
-                            "schematic_page_number": None,
-                            "schematic_total": None,
-                            "dwg_no": None,
-                            "drawing_title": None,
-                            "confidence": None,
-                            "raw_text": None
-                        } for idx in pdf_page_indices
-                    }
+                page_mapping: Dict[int, Dict[str, Any]] = {}
+                if Config.GEMINI_USE_BATCH_MODE and content_pages:
+                    try:
+                        detected = self.gemini.detect_title_blocks(cached_content, content_pages)
+                        logger.info(f"Title blocks detected: {detected}")
+                    except Exception as e:
+                        logger.error(f"Title block detection failed: {e}")
+                        detected = {}
+                    for idx in content_pages:
+                        page_mapping[idx] = detected.get(idx) or self._empty_page_meta()
+                    self._fill_undetected_page_numbers(processor, page_mapping, content_pages)
+                
+                # Blank pages still get page records
+                for idx in sorted(blank_pages):
+                    page_mapping[idx] = self._empty_page_meta()
                 
-                # Store page mappings
                 for pdf_idx, meta in page_mapping.items():
-                    schematic_num = meta.get("schematic_page_number") if meta else None
-                    width, height = processor.get_page_dimensions(pdf_idx)
-                    page = SchematicPage(
-                        schematic_file_id=schematic_file.id,
-                        pdf_page_index=pdf_idx,
-                        schematic_page_number=schematic_num,
-                        schematic_total=meta.get("schematic_total") if meta else None,
-                        dwg_no=meta.get("dwg_no") if meta else None,
-                        drawing_title=meta.get("drawing_title") if meta else None,
-                        width=width,
-                        height=height,
-                        detection_confidence=meta.get("confidence") if meta and meta.get("confidence") is not None else (1.0 if schematic_num else 0.5),
-                        is_processed=False
-                    )
-                    self.db.add(page)
+                    self._add_page_record(schematic_file.id, pdf_idx, meta, _dimensions(pdf_idx))
                 self.db.commit()
+                if page_mapping:
+                    yield self._emit(ExtractionEvent.PAGE_MAPPING, {
+                        "pages": self._mapping_payload(page_mapping)
+                    }, schematic_file.id)
                 
-                # Emit page mapping to frontend
-                mapping_payload = []
-                for pdf_idx, meta in page_mapping.items():
-                    mapping_payload.append({
-                        "pdf_page_index": pdf_idx,
-                        "schematic_page_number": meta.get("schematic_page_number") if meta else None,
-                        "schematic_total": meta.get("schematic_total") if meta else None,
-                        "dwg_no": meta.get("dwg_no") if meta else None,
-                        "drawing_title": meta.get("drawing_title") if meta else None,
-                        "confidence": meta.get("confidence") if meta else None,
-                        "raw_text": meta.get("raw_text") if meta else None
-                    })
+                # Step 5: Extract all pages concurrently
+                if self._cancelled:
+                    yield self._emit(ExtractionEvent.PROGRESS, {
+                        "status": "cancelled",
+                        "message": "Extraction cancelled by user"
+                    }, schematic_file.id)
+                    schematic_file.extraction_status = ExtractionStatus.CANCELLED
+                    self.db.commit()
+                    return
                 
-                yield self._emit(ExtractionEvent.PAGE_MAPPING, {
-                    "pages": mapping_payload
+                yield self._emit(ExtractionEvent.PROGRESS, {
+                    "status": "extracting",
+                    "message": f"Extracting {len(pdf_page_indices)} pages ({self.gemini.concurrency} at a time)...",
+                    "pages_total": len(pdf_page_indices),
+                    "pages_processed": 0,
+                    "percent": 0
                 }, schematic_file.id)
                 
-                # Step 4: Process each page sequentially
+                # Step 6: Store each page as soon as its extraction finishes
+                page_results = self._iter_page_results(
+                    cached_content=cached_content,
+                    page_file=page_file,
+                    content_pages=content_pages,
+                    blank_pages=blank_pages,
+                    context_text=context_text,
+                    page_mapping=page_mapping,
+                    media_resolutions=media_resolutions
+                )
                 pages_processed = 0
-                for pdf_idx in pdf_page_indices:
-                    if self._cancelled:
-                        yield self._emit(ExtractionEvent.PROGRESS, {
-                            "status": "cancelled",
-                            "message": "Extraction cancelled by user"
-                        }, schematic_file.id)
-                        schematic_file.extraction_status = ExtractionStatus.CANCELLED
-                        self.db.commit()
-                        return
-                    
-                    meta = page_mapping.get(pdf_idx) or {}
-                    schematic_num = meta.get("schematic_page_number")
-                    
-                    yield self._emit(ExtractionEvent.PROGRESS, {
-                        "status": "extracting",
-                        "message": f"Extracting page {pdf_idx + 1} (schematic page {schematic_num or '?'})...",
-                        "current_page": pdf_idx,
-                        "schematic_page": schematic_num,
-                        "pages_total": len(pdf_page_indices),
-                        "pages_processed": pages_processed,
-                        "percent": int((pages_processed / len(pdf_page_indices)) * 100)
-                    }, schematic_file.id)
-                    
-                    # Extract with retry
-                    try:
-                        for result in self._extract_page(
-                            schematic_file=schematic_file,
-                            cached_content=cached_content,
-                            pdf_page_index=pdf_idx,
-                            schematic_page_number=schematic_num,
-                            context_text=context_text,
-                            page_mapping=page_mapping
-                        ):
-                            yield result
+                try:
+                    for pdf_idx, title_block, extraction_data in page_results:
+                        if self._cancelled:
+                            # Closing page_results (below) cancels pages still in flight
+                            yield self._emit(ExtractionEvent.PROGRESS, {
+                                "status": "cancelled",
+                                "message": "Extraction cancelled by user"
+                            }, schematic_file.id)
+                            schematic_file.extraction_status = ExtractionStatus.CANCELLED
+                            self.db.commit()
+                            return
                         
-                        # Mark page as processed
-                        page_record = self.db.query(SchematicPage).filter_by(
-                            schematic_file_id=schematic_file.id,
-                            pdf_page_index=pdf_idx
-                        ).first()
-                        if page_record:
-                            page_record.is_processed = True
+                        if pdf_idx is None:
+                            # Heartbeat: nothing finished yet, keep the stream alive.
+                            # Batch Mode heartbeats carry the job state.
+                            job_state = f", batch job {extraction_data}" if extraction_data else ""
+                            yield self._emit(ExtractionEvent.PROGRESS, {
+                                "status": "extracting",
+                                "message": f"Waiting for Gemini ({pages_processed}/{len(pdf_page_indices)} pages done{job_state})...",
+                                "pages_total": len(pdf_page_indices),
+                                "pages_processed": pages_processed,
+                                "percent": int((pages_processed / len(pdf_page_indices)) * 100)
+                            }, schematic_file.id)
+                            continue
                         
-                        pages_processed += 1
-                        schematic_file.total_pages_processed = pages_processed
-                        self.db.commit()
+                        if pdf_idx not in page_mapping:
+                            # First sight of this page's title block
+                            page_mapping[pdf_idx] = title_block or self._empty_page_meta()
+                            self._fill_undetected_page_numbers(processor, page_mapping, [pdf_idx])
+                            self._add_page_record(schematic_file.id, pdf_idx, page_mapping[pdf_idx], _dimensions(pdf_idx))
+                            self.db.commit()
+                            yield self._emit(ExtractionEvent.PAGE_MAPPING, {
+                                "pages": self._mapping_payload(page_mapping)
+                            }, schematic_file.id)
                         
-                    except Exception as e:
-                        error = ExtractionError(
-                            schematic_file_id=schematic_file.id,
-                            pdf_page_index=pdf_idx,
-                            error_type="extraction_error",
-                            error_message=str(e),
-                            error_details={"page": pdf_idx}
-                        )
-                        self.db.add(error)
-                        self.db.commit()
+                        meta = page_mapping[pdf_idx]
+                        schematic_num = meta.get("schematic_page_number")
                         
-                        yield self._emit(ExtractionEvent.ERROR, {
-                            "page": pdf_idx,
-                            "error": str(e)
+                        yield self._emit(ExtractionEvent.PROGRESS, {
+                            "status": "extracting",
+                            "message": f"Processing page {pdf_idx + 1} (schematic page {schematic_num or '?'})...",
+                            "current_page": pdf_idx,
+                            "schematic_page": schematic_num,
+                            "pages_total": len(pdf_page_indices),
+                            "pages_processed": pages_processed,
+                            "percent": int((pages_processed / len(pdf_page_indices)) * 100)
                         }, schematic_file.id)
+                        
+                        try:
+                            if isinstance(extraction_data, BaseException):
+                                raise extraction_data
+                            
+                            for result in self._store_page_results(
+                                schematic_file=schematic_file,
+                                pdf_page_index=pdf_idx,
+                                schematic_page_number=schematic_num,
+                                extraction_data=extraction_data
+                            ):
+                                yield result
+                            
+                            # Mark page as processed
+                            page_record = self.db.query(SchematicPage).filter_by(
+                                schematic_file_id=schematic_file.id,
+                                pdf_page_index=pdf_idx
+                            ).first()
+                            if page_record:
+                                page_record.is_processed = True
+                            
+                            pages_processed += 1
+                            schematic_file.total_pages_processed = pages_processed
+                            self.db.commit()
+                            
+                        except Exception as e:
+                            error = ExtractionError(
+                                schematic_file_id=schematic_file.id,
+                                pdf_page_index=pdf_idx,
+                                error_type="extraction_error",
+                                error_message=str(e),
+                                error_details={"page": pdf_idx}
+                            )
+                            self.db.add(error)
+                            self.db.commit()
+                            
+                            yield self._emit(ExtractionEvent.ERROR, {
+                                "page": pdf_idx,
+                                "error": str(e)
+                            }, schematic_file.id)
+                finally:
+                    page_results.close()
                 
-                # Step 5: Complete
+                # Step 7: Complete
                 schematic_file.extraction_status = ExtractionStatus.COMPLETED
                 schematic_file.extraction_completed_at = datetime.utcnow()
                 self.db.commit()
@@ -321,28 +377,126 @@ class ExtractionService:
             }, schematic_file.id)
             raise
     
-    def _extract_page(
+    def _iter_page_results(
         self,
-        schematic_file: SchematicFile,
         cached_content: Any,
+        page_file: Any,
+        content_pages: List[int],
+        blank_pages: set,
+        context_text: Optional[str],
+        page_mapping: Dict[int, Dict[str, Any]],
+        media_resolutions: Dict[int, str]
+    ) -> Generator[Tuple[Optional[int], Optional[Dict[str, Any]], Any], None, None]:
+        """
+        Yield (pdf_page_index, title block, extracted data or exception) as pages finish.
+        
+        Blank pages come first, since they need no request. Online
+        extraction streams pages in completion order, each with its title
+        block; Batch Mode yields them when the job finishes, with title
+        blocks already in page_mapping. Both send (None, None, status)
+        heartbeats in between, and closing this generator cancels whatever
+        is still in flight. A single page uploaded on its own (page_file)
+        replaces cached_content.
+        """
+        for pdf_idx in sorted(blank_pages):
+            yield pdf_idx, None, self.gemini.empty_extraction()
+        
+        if not content_pages:
+            return
+        
+        include_paths = Config.GEMINI_EXTRACT_CONNECTION_PATHS
+        if page_file is not None:
+            # The page is page 1 of its own upload; one request gets both its
+            # title block and extraction
+            pdf_idx = content_pages[0]
+            for idx, title_block, result in self.gemini.iter_detect_and_extract(
+                cached_content=page_file,
+                pdf_page_indices=[0],
+                context_text=context_text,
+                media_resolutions={0: media_resolutions[pdf_idx]},
+                include_paths=include_paths
+            ):
+                yield (pdf_idx if idx is not None else None), title_block, result
+        elif Config.GEMINI_USE_BATCH_MODE:
+            for pdf_idx, result in self.gemini.iter_batch_extract_pages(
+                cached_content=cached_content,
+                pdf_page_indices=content_pages,
+                context_text=context_text,
+                page_mapping=page_mapping,
+                media_resolutions=media_resolutions,
+                include_paths=include_paths
+            ):
+                yield pdf_idx, None, result
+        elif Config.GEMINI_COMBINE_TITLE_BLOCKS:
+            # Title blocks come back with the extraction itself (one call per page group)
+            yield from self.gemini.iter_detect_and_extract(
+                cached_content=cached_content,
+                pdf_page_indices=content_pages,
+                context_text=context_text,
+                media_resolutions=media_resolutions,
+                include_paths=include_paths
+            )
+        else:
+            # Each page is extracted as soon as its title block is detected
+            yield from self.gemini.iter_detect_then_extract(
+                cached_content=cached_content,
+                pdf_page_indices=content_pages,
+                context_text=context_text,
+                media_resolutions=media_resolutions,
+                include_paths=include_paths
+            )
+    
+    def _add_page_record(
+        self,
+        schematic_file_id: int,
+        pdf_page_index: int,
+        meta: Dict[str, Any],
+        dimensions: Tuple[Optional[float], Optional[float]]
+    ) -> None:
+        """Add the SchematicPage record for a page (not committed)."""
+        schematic_num = meta.get("schematic_page_number")
+        width, height = dimensions
+        self.db.add(SchematicPage(
+            schematic_file_id=schematic_file_id,
+            pdf_page_index=pdf_page_index,
+            schematic_page_number=schematic_num,
+            schematic_total=meta.get("schematic_total"),
+            dwg_no=meta.get("dwg_no"),
+            drawing_title=meta.get("drawing_title"),
+            width=width,
+            height=height,
+            detection_confidence=meta.get("confidence") if meta.get("confidence") is not None else (1.0 if schematic_num else 0.5),
+            is_processed=False
+        ))
+    
+    @staticmethod
+    def _mapping_payload(page_mapping: Dict[int, Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Build the PAGE_MAPPING event payload for every page mapped so far."""
+        return [
+            {
+                "pdf_page_index": pdf_idx,
+                "schematic_page_number": meta.get("schematic_page_number"),
+                "schematic_total": meta.get("schematic_total"),
+                "dwg_no": meta.get("dwg_no"),
+                "drawing_title": meta.get("drawing_title"),
+                "confidence": meta.get("confidence"),
+                "raw_text": meta.get("raw_text")
+            }
+            for pdf_idx, meta in page_mapping.items()
+        ]
+    
+    def _store_page_results(
+        self,
+        schematic_file: SchematicFile,
         pdf_page_index: int,
         schematic_page_number: Optional[int],
-        context_text: str,
-        page_mapping: Dict[int, Dict[str, Any]]
+        extraction_data: Dict[str, Any]
     ) -> Generator[ExtractionResult, None, None]:
         """
-        Extract data from a single page using cached content.
+        Store extracted data for a single page.
         
         Yields extraction results for each component, connection, and wire label.
         """
-        # Call Gemini API with cached content
-        extraction_data = self.gemini.extract_page(
-            cached_content=cached_content,
-            pdf_page_index=pdf_page_index,
-            context_text=context_text,
-            page_mapping=page_mapping
-        )
-        
         # Process components
         for comp_data in extraction_data.get("components", []):
             component = Component(
@@ -378,7 +532,7 @@ class ExtractionService:
                 terminal_to=conn_data.get("terminal_to"),
                 pdf_page_index=pdf_page_index,
                 schematic_page_number=schematic_page_number,
-                path_coordinates=conn_data.get("path"),
+                path_coordinates=self._path_to_list(conn_data.get("path")),
                 is_external=conn_data.get("is_external", False)
             )
             self.db.add(connection)
@@ -430,6 +584,50 @@ class ExtractionService:
         
         self.db.commit()
     
+    @staticmethod
+    def _fill_undetected_page_numbers(
+        processor: PDFProcessor,
+        page_mapping: Dict[int, Dict[str, Any]],
+        pdf_page_indices: List[int]
+    ) -> None:
+        """
+        Fall back to the PDF text layer for pages whose title block detection failed.
+        
+        Only pages with no title block at all (empty meta, or the
+        zero-confidence placeholder a failed request leaves) are filled; a
+        page the model read but found unnumbered (e.g. a cover sheet) keeps
+        its None rather than picking up a stray "X/Y" from the drawing.
+        """
+        failed = [
+            idx for idx in pdf_page_indices
+            if page_mapping[idx].get("schematic_page_number") is None and not page_mapping[idx].get("confidence")
+        ]
+        if not failed:
+            return
+        for idx, page_number in processor.detect_all_page_numbers_parallel(failed).items():
+            if page_number is not None:
+                # Copy, since detected title blocks are shared with GeminiService's cache
+                page_mapping[idx] = {**page_mapping[idx], "schematic_page_number": page_number}
+    
+    @staticmethod
+    def _empty_page_meta() -> Dict[str, Any]:
+        """Page metadata used when no title block was detected."""
+        return {
+            "schematic_page_number": None,
+            "schematic_total": None,
+            "dwg_no": None,
+            "drawing_title": None,
+            "confidence": None,
+            "raw_text": None
+        }
+    
+    @staticmethod
+    def _path_to_list(path: Any) -> Optional[List[List[float]]]:
+        """Convert a float32 path array back to JSON-serializable [[x, y], ...]."""
+        if isinstance(path, np.ndarray):
+            return path.tolist()
+        return path
+    
     def _emit(
         self,
         event_type: str,
@@ -2,21 +2,176 @@
 Gemini 3 API Service using google.genai client with context caching.
 Handles file upload, caching, and structured extraction with JSON Schema.
 """
+import io
+import re
 import time
-import json
+import queue
+import random
+import hashlib
+import asyncio
 import logging
-from typing import Optional, Dict, Any, List
+import threading
+from concurrent.futures import CancelledError, Future
+from typing import TYPE_CHECKING, Optional, Dict, Any, List, Tuple, Generator, AsyncGenerator, Callable, Awaitable, Iterable
 from pathlib import Path
 
-from google import genai
-from google.genai import types
+import httpx
+import ijson
+import numpy as np
+import orjson
+from cachetools import LRUCache, TLRUCache
 
 from config import Config
+from .disk_cache import DiskCache
+from .extraction_payload import decode_extraction
+
+# google-genai and PyMuPDF are imported where they are used, so importing
+# this module (e.g. for ExtractionService) doesn't load them up front
+if TYPE_CHECKING:
+    from google import genai
+    from google.genai import errors, types
+    from .pdf_processor import PDFProcessor
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# Outermost JSON object/array, for responses wrapped in markdown fences or prose
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+_JSON_ARRAY_RE = re.compile(r"\[.*\]", re.DOTALL)
+
+# Shared event loop for async Gemini calls. Runs in a daemon thread so that
+# synchronous callers (Flask request handlers) can fan out requests without
+# spinning up a new loop per call.
+_event_loop: Optional[asyncio.AbstractEventLoop] = None
+_event_loop_lock = threading.Lock()
+
+
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+    """Get the shared background event loop, starting it on first use."""
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            _event_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_event_loop.run_forever,
+                name="gemini-event-loop",
+                daemon=True
+            ).start()
+        return _event_loop
+
+
+# In-memory copies of uploads and cached contents are dropped this long
+# before the server-side object expires (seconds)
+_SERVER_EXPIRY_MARGIN = 60
+_DEFAULT_SERVER_TTL = 3600
+
+
+def _server_expiry(_key: Any, value: Any, now: float) -> float:
+    """TLRUCache time-to-use: expire entries just before the Gemini object they hold."""
+    expires = getattr(value, "expire_time", None) or getattr(value, "expiration_time", None)
+    if expires is None:
+        return now + _DEFAULT_SERVER_TTL - _SERVER_EXPIRY_MARGIN
+    return expires.timestamp() - _SERVER_EXPIRY_MARGIN
+
+
+class FileProcessingError(RuntimeError):
+    """The Files API marked an upload FAILED; a fresh upload usually succeeds."""
+
+
+class _StreamedItemParser:
+    """
+    Incrementally parse a streamed JSON response.
+    
+    Text is fed chunk by chunk, from a sync or async stream alike, and each
+    feed() returns the objects that chunk completed. Like _loads_json(), it
+    tolerates output wrapped in a ```json fence or prose: text before the
+    first "{" or "[" and after the top-level value closes is ignored.
+    """
+    
+    def __init__(self, item_prefixes: Dict[str, str]):
+        """
+        Args:
+            item_prefixes: ijson prefix of the objects to yield -> label
+        """
+        self._item_prefixes = item_prefixes
+        self._events = ijson.sendable_list()
+        self._parser = ijson.parse_coro(self._events, use_float=True)
+        self._builder = None
+        self._item_prefix = None
+        self._started = False
+        self._finished = False
+    
+    def feed(self, text: Optional[str]) -> List[Tuple[str, Dict[str, Any]]]:
+        """Parse the next chunk, returning (label, object) tuples for each object it completed."""
+        if not text or self._finished:
+            return []
+        if not self._started:
+            starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+            if not starts:
+                return []
+            text = text[min(starts):]
+            self._started = True
+        
+        # A closing fence in the same chunk as the end of the value raises
+        # "trailing garbage" only after the value's events are emitted
+        error = None
+        try:
+            self._parser.send(text.encode("utf-8"))
+        except ijson.JSONError as e:
+            error = e
+        
+        items = []
+        for prefix, event, value in self._events:
+            if prefix == "" and event in ("end_map", "end_array"):
+                self._finished = True
+            if self._builder is None:
+                if event == "start_map" and prefix in self._item_prefixes:
+                    self._builder = ijson.ObjectBuilder()
+                    self._item_prefix = prefix
+                    self._builder.event(event, value)
+                continue
+            
+            self._builder.event(event, value)
+            if event == "end_map" and prefix == self._item_prefix:
+                items.append((self._item_prefixes[self._item_prefix], self._builder.value))
+                self._builder = None
+        del self._events[:]
+        if error is not None and not self._finished:
+            raise error
+        return items
+    
+    def close(self) -> None:
+        """Finish parsing; raises if the response was cut off or malformed."""
+        if not self._finished:
+            self._parser.close()
+
+
+# Shared Gemini client. Every GeminiService instance reuses the same client,
+# and so the same httpx connection pools; HTTP/2 lets concurrent requests
+# multiplex over one connection instead of each paying a TCP/TLS handshake.
+_client: Optional["genai.Client"] = None
+_client_lock = threading.Lock()
+
+
+def _get_client() -> "genai.Client":
+    """Get the shared Gemini client, creating it on first use."""
+    from google import genai
+    from google.genai import types
+    
+    global _client
+    with _client_lock:
+        if _client is None:
+            # Idle connections are kept for a minute so bursts between pages reuse them
+            limits = httpx.Limits(max_keepalive_connections=20, max_connections=50, keepalive_expiry=60)
+            _client = genai.Client(
+                api_key=Config.GEMINI_API_KEY,
+                http_options=types.HttpOptions(
+                    client_args={"http2": True, "limits": limits},
+                    async_client_args={"http2": True, "limits": limits}
+                )
+            )
+        return _client
+
 
 class GeminiService:
     """
@@ -25,10 +180,19 @@ class GeminiService:
     Features:
     - Context caching (90% cost savings)
     - File upload and reuse
+    - On-disk cache of extraction results (zstd-compressed)
     - Structured output with JSON Schema
+    - Concurrent page extraction (asyncio)
     - Retry with exponential backoff
     """
     
+    # Media resolution tiers, lowest first
+    MEDIA_RESOLUTIONS = {
+        "low": "MEDIA_RESOLUTION_LOW",
+        "medium": "MEDIA_RESOLUTION_MEDIUM",
+        "high": "MEDIA_RESOLUTION_HIGH",
+    }
+    
     # JSON Schema for title block detection
     TITLE_BLOCK_SCHEMA = {
         "type": "ARRAY",
@@ -47,6 +211,51 @@ class GeminiService:
         }
     }
     
+    # Title block fields callers can request, in response order. Each maps to
+    # its response key, prompt instruction, shape hint and example value.
+    TITLE_BLOCK_FIELDS = (
+        "schematic_page_number", "schematic_total", "dwg_no", "drawing_title", "confidence", "raw_text"
+    )
+    
+    TITLE_BLOCK_FIELD_SPECS = {
+        "schematic_page_number": {
+            "key": "schematic_page",
+            "instruction": '**Schematic page number**: Found in a diagonal box format "X/Y" (e.g., "1/207" means schematic page 1 of 207 total). The X is the schematic page number we need. May be in Japanese full-width numbers (１/２０７).',
+            "shape": "<X from X/Y or null>",
+            "example": 1
+        },
+        "schematic_total": {
+            "key": "schematic_total",
+            "instruction": None,
+            "shape": "<Y from X/Y or null>",
+            "example": 207
+        },
+        "dwg_no": {
+            "key": "dwg_no",
+            "instruction": '**DWG NO.**: Drawing number, explicitly labeled "DWG NO." on the schematic.',
+            "shape": "<drawing number or null>",
+            "example": "151-E8810-202-0"
+        },
+        "drawing_title": {
+            "key": "drawing_title",
+            "instruction": '**Drawing title**: The title of the drawing (e.g., "MAIN POWER POWER LAMP"). Infer from context in the title block - usually the largest or most prominent text.',
+            "shape": "<inferred title or null>",
+            "example": "MAIN POWER POWER LAMP"
+        },
+        "confidence": {
+            "key": "confidence",
+            "instruction": None,
+            "shape": "<0.0-1.0>",
+            "example": 0.95
+        },
+        "raw_text": {
+            "key": "raw_text",
+            "instruction": None,
+            "shape": "<optional: raw title block text for debugging>",
+            "example": "..."
+        }
+    }
+    
     # JSON Schema for component extraction
     EXTRACTION_SCHEMA = {
         "type": "OBJECT",
@@ -79,13 +288,6 @@ class GeminiService:
                         "wire_label": {"type": "STRING", "nullable": True},
                         "terminal_from": {"type": "STRING", "nullable": True},
                         "terminal_to": {"type": "STRING", "nullable": True},
-                        "path": {
-                            "type": "ARRAY",
-                            "items": {
-                                "type": "ARRAY",
-                                "items": {"type": "NUMBER"}
-                            }
-                        },
                         "is_external": {"type": "BOOLEAN"}
                     }
                 }
@@ -117,25 +319,170 @@ class GeminiService:
         "required": ["components", "connections", "wire_labels"]
     }
     
+    # Pages with less ink than this are extracted at low media resolution
+    SPARSE_PAGE_INK_RATIO = 0.02
+    
+    # Pages with less ink than this are treated as blank and not sent at all
+    BLANK_PAGE_INK_RATIO = 0.005
+    
+    # Streamed extraction yields a heartbeat this often while no page finishes (seconds)
+    STREAM_HEARTBEAT_INTERVAL = 5.0
+    
+    # Files API keeps uploads for 48 hours; only reuse ones with at least an hour left
+    FILES_API_TTL = 48 * 3600
+    UPLOAD_REUSE_MARGIN = 3600
+    
+    # Max uploaded files / cached contents held in memory
+    OBJECT_CACHE_SIZE = 256
+    
+    # Max generation configs, prompt starts and title blocks held in memory
+    CONFIG_CACHE_SIZE = 512
+    PROMPT_CACHE_SIZE = 64
+    TITLE_BLOCK_CACHE_SIZE = 8192
+    
+    # Persisted cached content is only reused with at least this long left (seconds)
+    CACHED_CONTENT_REUSE_MARGIN = 300
+    
+    # Uploads are named "<hash prefix>-<name>" so other workers can find them;
+    # the remote file listing is reused for this many seconds
+    UPLOAD_HASH_PREFIX_LENGTH = 16
+    FILES_LIST_TTL = 60
+    
+    # Files API processing poll (seconds)
+    FILE_POLL_INITIAL_DELAY = 0.1
+    FILE_POLL_MAX_DELAY = 2.0
+    FILE_POLL_JITTER = 0.05
+    FILE_POLL_TIMEOUT = 120.0
+    
+    # Batch Mode job poll (seconds); jobs are scheduled offline and may take hours
+    BATCH_POLL_INITIAL_DELAY = 10.0
+    BATCH_POLL_MAX_DELAY = 120.0
+    BATCH_TIMEOUT = 24 * 3600
+    BATCH_TERMINAL_STATES = (
+        "JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"
+    )
+    
+    # Wire routes are the bulk of a response, so they are only requested on demand
+    CONNECTION_PATH_SCHEMA = {
+        "type": "ARRAY",
+        "items": {
+            "type": "ARRAY",
+            "items": {"type": "NUMBER"}
+        }
+    }
+    
+    EXTRACTION_SCHEMA_WITH_PATHS = {
+        **EXTRACTION_SCHEMA,
+        "properties": {
+            **EXTRACTION_SCHEMA["properties"],
+            "connections": {
+                "type": "ARRAY",
+                "items": {
+                    "type": "OBJECT",
+                    "properties": {
+                        **EXTRACTION_SCHEMA["properties"]["connections"]["items"]["properties"],
+                        "path": CONNECTION_PATH_SCHEMA
+                    }
+                }
+            }
+        }
+    }
+    
+    # Title block schema variants as SDK Schema objects, shared by all instances
+    _compiled_title_block_schemas: Dict[Tuple[str, ...], "types.Schema"] = {}
+    
+    # Static start of title block prompts per field set, shared by all instances
+    _title_block_prompt_prefixes: Dict[Tuple[str, ...], str] = {}
+    
+    # Extraction schema variants as SDK Schema objects, shared by all instances
+    _compiled_schemas: Dict[Tuple[bool, bool, bool], "types.Schema"] = {}
+    
+    # Uploads, cached contents and everything derived from them, shared by all
+    # instances (ExtractionService builds a service per run). All bounded;
+    # uploads and cached contents drop out shortly before the server-side
+    # object expires, or as soon as Gemini reports them gone. Access through
+    # _cache_get() / _cache_put(), which hold _cache_lock.
+    _file_cache = TLRUCache(OBJECT_CACHE_SIZE, _server_expiry, timer=time.time)  # path -> uploaded file object
+    _files_by_name = TLRUCache(OBJECT_CACHE_SIZE, _server_expiry, timer=time.time)  # uploaded file name -> uploaded file object
+    _content_cache = TLRUCache(OBJECT_CACHE_SIZE, _server_expiry, timer=time.time)  # "<file name>_<model>" -> cached content object
+    _file_digests = LRUCache(OBJECT_CACHE_SIZE)  # uploaded file name -> SHA-256
+    _content_digests = LRUCache(OBJECT_CACHE_SIZE)  # cached content name -> SHA-256
+    _config_cache = LRUCache(CONFIG_CACHE_SIZE)  # request shape -> config
+    _extraction_prompt_cache = LRUCache(PROMPT_CACHE_SIZE)  # (context, paths) -> static prompt start
+    _title_block_cache = LRUCache(TITLE_BLOCK_CACHE_SIZE)  # (cached content name, page, fields) -> title block
+    _cache_lock = threading.Lock()
+    
+    # Remote file listing, shared by all instances
+    _remote_files: Optional[Tuple[float, Dict[str, Any]]] = None  # (listed at, hash prefix -> active file)
+    _remote_files_lock = threading.Lock()
+    
+    # In-flight extractions, so concurrent duplicate requests (sync or async,
+    # from any instance) share one call. Entries leave as their call settles.
+    _inflight: Dict[Tuple[str, int, str], Future] = {}
+    _inflight_lock = threading.Lock()
+    
+    EXTRACTION_PROMPT_HEADER = "You are analyzing an industrial electrical schematic diagram.\n\n"
+    
+    # Shape description sent in the prompt when EXTRACTION_SCHEMA is not enforced
+    EXTRACTION_SHAPE = """{
+  "components": [{"mark": str, "symbol": str|null, "name": str|null, "type": str|null, "x": number|null, "y": number|null, "width": number|null, "height": number|null, "description": str|null}],
+  "connections": [{"from_component_mark": str|null, "to_component_mark": str|null, "wire_label": str|null, "terminal_from": str|null, "terminal_to": str|null, "is_external": bool}],
+  "wire_labels": [{"label": str, "x": number|null, "y": number|null}],
+  "continuations": [{"from_component_mark": str|null, "to_page_hint": str|null, "direction": str|null}]
+}"""
+    
+    EXTRACTION_ARRAY_KEYS = ("components", "connections", "wire_labels", "continuations")
+    
+    EXTRACTION_REQUIREMENTS = """**Requirements**:
+1. **Components**: Every component with its mark (e.g., MCB10, SOL-1), symbol type, name, position (x, y), and dimensions if visible.
+2. **Connections**: Every wire connection between components, including wire labels and terminal designations.
+3. **Wire labels**: Every wire label visible on the page with its text and position.
+4. **Continuations**: Any continuation markers (e.g., "→5", "P.12") showing connections to other pages.
+
+Extract coordinates as accurately as possible for tracing and overlay purposes."""
+    
+    PATH_REQUIREMENT = (
+        'Also trace each connection\'s wire route and add it to the connection as '
+        '"path": [[x, y], ...], the list of points along the wire.'
+    )
+    
     def __init__(self):
         """Initialize Gemini service with API key validation."""
+        from google.genai import types
         if not Config.GEMINI_API_KEY:
             raise ValueError("GEMINI_API_KEY is required")
         
-        logger.info(f"Initializing Gemini service with models: {Config.GEMINI_MODEL}, {Config.GEMINI_FLASH_MODEL}")
+        logger.info("Initializing Gemini service with models: %s, %s", Config.GEMINI_MODEL, Config.GEMINI_FLASH_MODEL)
         
         # Initialize client
-        self.client = genai.Client(api_key=Config.GEMINI_API_KEY)
+        self.client = _get_client()
         
         self.model_name = Config.GEMINI_MODEL
         self.flash_model_name = Config.GEMINI_FLASH_MODEL
         self.temperature = Config.GEMINI_TEMPERATURE
+        self.media_resolution = Config.GEMINI_MEDIA_RESOLUTION
+        self.adaptive_media_resolution = Config.GEMINI_ADAPTIVE_MEDIA_RESOLUTION
+        self.skip_blank_pages = Config.GEMINI_SKIP_BLANK_PAGES
+        self.use_response_schema = Config.GEMINI_USE_RESPONSE_SCHEMA
         self.timeout = Config.GEMINI_TIMEOUT
+        # Deadline for generation calls only; uploads and cache creation scale
+        # with PDF size and run without one
+        self._request_options = types.HttpOptions(timeout=self.timeout * 1000)  # milliseconds
         self.max_retries = Config.GEMINI_MAX_RETRIES
+        self.concurrency = Config.GEMINI_CONCURRENCY
+        self.title_block_batch_size = Config.GEMINI_TITLE_BLOCK_BATCH_SIZE
+        self.pages_per_request = Config.GEMINI_PAGES_PER_REQUEST
         
-        # Cache storage
-        self._file_cache: Dict[str, Any] = {}  # path -> uploaded file object
-        self._content_cache: Dict[str, Any] = {}  # file_path -> cached content object
+        # Extraction results, cached by PDF content digest
+        self._result_cache = DiskCache(
+            Config.CACHE_DIR / "extractions",
+            max_age=Config.CACHE_MAX_AGE_DAYS * 86400,
+            max_bytes=Config.CACHE_MAX_SIZE_MB * 1024 * 1024,
+            enabled=Config.CACHE_ENABLED
+        )
+        # Server-side objects outlive neither of these, so older records are dead
+        self._upload_cache = DiskCache(Config.CACHE_DIR / "uploads", max_age=self.FILES_API_TTL)  # content hash -> file name, expiry
+        self._cached_content_store = DiskCache(Config.CACHE_DIR / "cached_contents", max_age=self.FILES_API_TTL)  # content/model/instruction hash -> name, expiry
     
     def upload_file(self, file_path: Path, display_name: Optional[str] = None) -> Any:
         """
@@ -148,40 +495,242 @@ class GeminiService:
         Returns:
             Uploaded file object
         """
+        from google.genai import types
+        from .pdf_processor import PDFProcessor
+        
         file_path = Path(file_path)
         if not file_path.exists():
             raise FileNotFoundError(f"File not found: {file_path}")
         
         # Check cache
         cache_key = str(file_path)
-        if cache_key in self._file_cache:
-            logger.info(f"Using cached file upload: {file_path.name}")
-            return self._file_cache[cache_key]
+        uploaded_file = self._cache_get(self._file_cache, cache_key)
+        if uploaded_file is not None:
+            logger.info("Using cached file upload: %s", file_path.name)
+            return uploaded_file
         
-        logger.info(f"Uploading file to Gemini: {file_path.name}")
+        # Reuse an upload from a previous process if it hasn't expired yet
+        digest = PDFProcessor(file_path).get_file_hash()  # memoized process-wide by mtime and size
+        uploaded_file = self._load_persisted_upload(digest)
+        if uploaded_file is not None:
+            logger.info("Reusing previous upload of %s: %s", file_path.name, uploaded_file.name)
+            self._remember_upload(cache_key, uploaded_file, digest)
+            return uploaded_file
         
-        # Upload with retry - using file path and config
-        for attempt in range(self.max_retries):
-            try:
-                uploaded_file = self.client.files.upload(
-                    file=str(file_path),
-                    config=types.UploadFileConfig(
-                        display_name=display_name or file_path.name,
-                        mime_type="application/pdf"
-                    )
+        # Reuse an upload made by another worker or machine
+        uploaded_file = self._find_remote_upload(digest)
+        if uploaded_file is not None:
+            logger.info("Reusing remote upload of %s: %s", file_path.name, uploaded_file.name)
+            self._remember_upload(cache_key, uploaded_file, digest)
+            self._persist_upload(digest, uploaded_file)
+            return uploaded_file
+        
+        logger.info("Uploading file to Gemini: %s", file_path.name)
+        
+        def _upload() -> Any:
+            uploaded_file = self.client.files.upload(
+                file=str(file_path),
+                config=types.UploadFileConfig(
+                    display_name=f"{digest[:self.UPLOAD_HASH_PREFIX_LENGTH]}-{display_name or file_path.name}",
+                    mime_type="application/pdf"
                 )
-                logger.info(f"File uploaded: {uploaded_file.name}")
-                
-                self._file_cache[cache_key] = uploaded_file
+            )
+            logger.info("File uploaded: %s", uploaded_file.name)
+            return self._wait_for_file_active(uploaded_file)
+        
+        uploaded_file = self._call_with_retry(_upload, description=f"Upload of {file_path.name}")
+        self._remember_upload(cache_key, uploaded_file, digest)
+        self._persist_upload(digest, uploaded_file)
+        return uploaded_file
+    
+    def upload_page_range(
+        self,
+        file_path: Path,
+        pdf_page_indices: List[int],
+        display_name: Optional[str] = None
+    ) -> Any:
+        """
+        Upload only the given pages of a PDF to Gemini Files API.
+        
+        For runs over a page or two, so the whole document doesn't have to
+        be uploaded and cached. The upload can be passed wherever cached
+        content is expected; it is sent inline with each request. Page i of
+        the upload is the i-th smallest of pdf_page_indices.
+        
+        Args:
+            file_path: Path to source PDF file
+            pdf_page_indices: 0-based page indices to include
+            display_name: Optional display name
+            
+        Returns:
+            Uploaded file object
+        """
+        from google.genai import types
+        from .pdf_processor import PDFProcessor
+        
+        file_path = Path(file_path)
+        if not file_path.exists():
+            raise FileNotFoundError(f"File not found: {file_path}")
+        
+        pdf_page_indices = sorted(set(pdf_page_indices))
+        processor = PDFProcessor(file_path)
+        try:
+            # Keyed by content, so a replaced file at the same path is sliced afresh
+            cache_key = f"{processor.get_file_hash()}#pages={','.join(map(str, pdf_page_indices))}"
+            uploaded_file = self._cache_get(self._file_cache, cache_key)
+            if uploaded_file is not None:
+                logger.info("Using cached page upload: %s %s", file_path.name, pdf_page_indices)
                 return uploaded_file
-                
-            except Exception as e:
-                logger.error(f"Upload attempt {attempt + 1} failed: {e}")
-                if attempt == self.max_retries - 1:
-                    raise
-                time.sleep(self._calculate_backoff(attempt))
+            data = processor.extract_pages_to_bytes(pdf_page_indices)
+        finally:
+            processor.close()
+        
+        logger.info("Uploading %d page(s) of %s (%d bytes)", len(pdf_page_indices), file_path.name, len(data))
+        
+        def _upload() -> Any:
+            uploaded_file = self.client.files.upload(
+                file=io.BytesIO(data),
+                config=types.UploadFileConfig(
+                    display_name=display_name or f"{file_path.stem}_p{pdf_page_indices[0] + 1}.pdf",
+                    mime_type="application/pdf"
+                )
+            )
+            logger.info("Page range uploaded: %s", uploaded_file.name)
+            return self._wait_for_file_active(uploaded_file)
+        
+        uploaded_file = self._call_with_retry(_upload, description=f"Page upload of {file_path.name}")
+        self._remember_upload(cache_key, uploaded_file, hashlib.sha256(data).hexdigest())
+        return uploaded_file
+    
+    def _remember_upload(self, cache_key: str, uploaded_file: Any, digest: str) -> None:
+        """Record an upload in the in-memory caches."""
+        self._cache_put(self._file_cache, cache_key, uploaded_file)
+        self._cache_put(self._files_by_name, uploaded_file.name, uploaded_file)
+        self._cache_put(self._file_digests, uploaded_file.name, digest)
+    
+    def _persist_upload(self, digest: str, uploaded_file: Any) -> None:
+        """Record an upload on disk, keyed by PDF content hash, for reuse after restarts."""
+        expiration_time = getattr(uploaded_file, "expiration_time", None)
+        expires_at = expiration_time.timestamp() if expiration_time else time.time() + self.FILES_API_TTL
+        self._upload_cache.set(digest, {"name": uploaded_file.name, "expires_at": expires_at})
+    
+    def _load_persisted_upload(self, digest: str) -> Optional[Any]:
+        """
+        Look up a previous upload of the same PDF content.
+        
+        Returns:
+            Active uploaded file object, or None if there is no upload with
+            enough lifetime left or it is no longer available
+        """
+        entry = self._upload_cache.get(digest)
+        if not entry or entry.get("expires_at", 0) - time.time() < self.UPLOAD_REUSE_MARGIN:
+            return None
+        
+        try:
+            uploaded_file = self.get_file(entry["name"])
+        except Exception as e:
+            logger.info("Previous upload %s is no longer available: %s", entry["name"], e)
+            if self._is_not_found_error(e):
+                # Deleted server-side; drop the record so the caller uploads afresh
+                self._upload_cache.delete(digest)
+            return None
+        
+        # Only ACTIVE uploads are persisted, so any other state is a dead record
+        if not uploaded_file.state or uploaded_file.state.name != "ACTIVE":
+            self._upload_cache.delete(digest)
+            return None
+        return uploaded_file
+    
+    def get_file(self, name: str) -> Any:
+        """
+        Resolve an uploaded file by name (e.g. "files/abc123").
+        
+        Files this process has uploaded or seen are returned from memory
+        until shortly before they expire server-side, or until Gemini
+        reports them gone; other names are fetched from the Files API once.
+        
+        Args:
+            name: Gemini file name, as stored in SchematicFile.gemini_file_uri
+            
+        Returns:
+            Uploaded file object
+        """
+        uploaded_file = self._cache_get(self._files_by_name, name)
+        if uploaded_file is not None:
+            return uploaded_file
+        
+        logger.info("Fetching file metadata from Gemini: %s", name)
+        uploaded_file = self.client.files.get(name=name)
+        # Files still processing (or failed) change state; only settled ones are kept
+        if uploaded_file.state and uploaded_file.state.name == "ACTIVE":
+            self._cache_put(self._files_by_name, name, uploaded_file)
+        return uploaded_file
+    
+    def _find_remote_upload(self, digest: str) -> Optional[Any]:
+        """
+        Look for an active upload of the same PDF content in the Files API.
+        
+        Uploads carry a content hash prefix in their display name, so a
+        worker that has never seen this PDF can still reuse another's upload.
+        The file listing is cached for FILES_LIST_TTL seconds so busy
+        accounts aren't scanned on every call.
+        
+        Returns:
+            Active uploaded file object, or None if there is none with
+            enough lifetime left
+        """
+        with self._remote_files_lock:
+            if self._remote_files is None or time.monotonic() - self._remote_files[0] > self.FILES_LIST_TTL:
+                try:
+                    files = {}
+                    for f in self.client.files.list():
+                        prefix, sep, _ = (f.display_name or "").partition("-")
+                        if sep and f.state and f.state.name == "ACTIVE":
+                            files[prefix] = f
+                except Exception as e:
+                    logger.info("Could not list remote uploads: %s", e)
+                    return None
+                GeminiService._remote_files = (time.monotonic(), files)
+            uploaded_file = self._remote_files[1].get(digest[:self.UPLOAD_HASH_PREFIX_LENGTH])
+        
+        if uploaded_file is None:
+            return None
+        expiration_time = getattr(uploaded_file, "expiration_time", None)
+        if expiration_time and expiration_time.timestamp() - time.time() < self.UPLOAD_REUSE_MARGIN:
+            return None
+        return uploaded_file
+    
+    def _wait_for_file_active(self, uploaded_file: Any) -> Any:
+        """
+        Poll an uploaded file until the Files API has finished processing it.
+        
+        Polls with jittered exponential backoff, starting short since most
+        PDFs are ready within a few hundred milliseconds. A FAILED file
+        raises FileProcessingError, which the upload retry loop treats as
+        transient and answers with a fresh upload.
+        
+        Args:
+            uploaded_file: File object returned by files.upload()
+            
+        Returns:
+            Refreshed file object in ACTIVE state
+        """
+        deadline = time.monotonic() + self.FILE_POLL_TIMEOUT
+        delay = self.FILE_POLL_INITIAL_DELAY
+        
+        while uploaded_file.state and uploaded_file.state.name == "PROCESSING":
+            if time.monotonic() >= deadline:
+                raise TimeoutError(
+                    f"File {uploaded_file.name} still processing after {self.FILE_POLL_TIMEOUT}s"
+                )
+            time.sleep(delay + random.uniform(0, self.FILE_POLL_JITTER))
+            delay = min(delay * 1.5, self.FILE_POLL_MAX_DELAY)
+            uploaded_file = self.client.files.get(name=uploaded_file.name)
         
-        raise RuntimeError("File upload failed after max retries")
+        if uploaded_file.state and uploaded_file.state.name == "FAILED":
+            raise FileProcessingError(f"File processing failed: {uploaded_file.name}")
+        
+        return uploaded_file
     
     def create_cached_content(
         self,
@@ -206,11 +755,25 @@ class GeminiService:
         
         # Check if already cached
         cache_key = f"{uploaded_file.name}_{model}"
-        if cache_key in self._content_cache:
-            logger.info(f"Using existing cached content: {cache_key}")
-            return self._content_cache[cache_key]
+        cached_content = self._cache_get(self._content_cache, cache_key)
+        if cached_content is not None:
+            logger.info("Using existing cached content: %s", cache_key)
+            return cached_content
         
-        logger.info(f"Creating cached content with model: {model}")
+        # Reuse cached content created by a previous process for the same PDF
+        digest = self._cache_get(self._file_digests, uploaded_file.name)
+        store_key = None
+        if digest:
+            instruction_hash = hashlib.sha256((system_instruction or "").encode("utf-8")).hexdigest()
+            store_key = hashlib.sha256(f"{digest}:{model}:{instruction_hash}".encode("utf-8")).hexdigest()
+            cached_content = self._load_persisted_cached_content(store_key, ttl)
+            if cached_content is not None:
+                logger.info("Reusing previous cached content: %s", cached_content.name)
+                self._cache_put(self._content_cache, cache_key, cached_content)
+                self._cache_put(self._content_digests, cached_content.name, digest)
+                return cached_content
+        
+        logger.info("Creating cached content with model: %s", model)
         
         config = {"contents": [uploaded_file]}
         if system_instruction:
@@ -222,172 +785,2066 @@ class GeminiService:
                 config=config,
                 ttl=ttl
             )
-            logger.info(f"Cached content created: {cached_content.name}")
+            logger.info("Cached content created: %s", cached_content.name)
             
-            self._content_cache[cache_key] = cached_content
+            self._cache_put(self._content_cache, cache_key, cached_content)
+            if digest:
+                self._cache_put(self._content_digests, cached_content.name, digest)
+            if store_key:
+                self._persist_cached_content(store_key, cached_content)
             return cached_content
             
         except Exception as e:
-            logger.error(f"Failed to create cached content: {e}")
+            if self._is_not_found_error(e):
+                # The upload was deleted server-side; upload the PDF again if we know where it is
+                file_path = self._forget_server_object(uploaded_file.name)
+                if file_path is not None:
+                    logger.warning("Uploaded file %s is gone, uploading %s again", uploaded_file.name, file_path)
+                    display_name = (uploaded_file.display_name or "").partition("-")[2] or None
+                    return self.create_cached_content(
+                        self.upload_file(Path(file_path), display_name=display_name),
+                        system_instruction=system_instruction,
+                        use_flash=use_flash,
+                        ttl=ttl
+                    )
+            logger.error("Failed to create cached content: %s", e)
             raise
     
+    def _persist_cached_content(self, store_key: str, cached_content: Any) -> None:
+        """Record cached content on disk for reuse after restarts."""
+        expire_time = getattr(cached_content, "expire_time", None)
+        if expire_time is None:
+            return
+        self._cached_content_store.set(store_key, {
+            "name": cached_content.name,
+            "expires_at": expire_time.timestamp()
+        })
+    
+    def _load_persisted_cached_content(self, store_key: str, ttl: str) -> Optional[Any]:
+        """
+        Look up cached content a previous process created for the same PDF.
+        
+        Reused caches have their TTL reset to the requested one, so callers
+        get the same lifetime as a freshly created cache.
+        
+        Returns:
+            Cached content object, or None if there is none with enough
+            lifetime left or it is no longer available
+        """
+        from google.genai import types
+        entry = self._cached_content_store.get(store_key)
+        if not entry or entry.get("expires_at", 0) - time.time() < self.CACHED_CONTENT_REUSE_MARGIN:
+            return None
+        
+        try:
+            cached_content = self.client.caches.update(
+                name=entry["name"],
+                config=types.UpdateCachedContentConfig(ttl=ttl)
+            )
+        except Exception as e:
+            logger.info("Previous cached content %s is no longer available: %s", entry["name"], e)
+            if self._is_not_found_error(e):
+                # Expired or deleted server-side; drop the record so the caller creates a new one
+                self._cached_content_store.delete(store_key)
+            return None
+        
+        self._persist_cached_content(store_key, cached_content)
+        return cached_content
+    
     def detect_title_blocks(
         self,
         cached_content: Any,
-        pdf_page_indices: List[int]
+        pdf_page_indices: List[int],
+        fields: Optional[Iterable[str]] = None
     ) -> Dict[int, Dict[str, Any]]:
         """
-        Detect title blocks for all pages in one call using cached PDF.
+        Detect title blocks for all pages using cached PDF.
+        
+        Small page lists are sent in one call. Larger lists are split into
+        batches of GEMINI_TITLE_BLOCK_BATCH_SIZE pages that run concurrently
+        on the async client, keeping each response well under the output
+        token limit.
+        
+        Detected title blocks are cached per cached content, so calling this
+        up front with the full page list makes later per-page lookups free.
         
         Args:
             cached_content: Cached content object
             pdf_page_indices: List of 0-based page indices
+            fields: Optional subset of TITLE_BLOCK_FIELDS to detect; the
+                prompt and schema only ask for these (default: all)
             
         Returns:
             Dict mapping pdf_page_index -> title block data
         """
-        page_list = ", ".join([str(idx + 1) for idx in pdf_page_indices])
+        fields = self._title_block_fields(fields)
+        mapping, missing = self._cached_title_blocks(cached_content, pdf_page_indices, fields)
+        if not missing:
+            return mapping
         
-        prompt = f"""You are analyzing an industrial schematic diagram PDF.
-
-For each of the following PDF pages: {page_list}
-
-Examine the title block (usually at the bottom-right corner of each page).
-
-Extract:
-1. **Schematic page number**: Found in a diagonal box format "X/Y" (e.g., "1/207" means schematic page 1 of 207 total). The X is the schematic page number we need. May be in Japanese full-width numbers (１/２０７).
-2. **DWG NO.**: Drawing number, explicitly labeled "DWG NO." on the schematic.
-3. **Drawing title**: The title of the drawing (e.g., "MAIN POWER POWER LAMP"). Infer from context in the title block - usually the largest or most prominent text.
-
-Return a JSON array with one object per PDF page:
-{{
-  "pdf_page": <1-based PDF page number>,
-  "schematic_page": <X from X/Y or null>,
-  "schematic_total": <Y from X/Y or null>,
-  "dwg_no": <drawing number or null>,
-  "drawing_title": <inferred title or null>,
-  "confidence": <0.0-1.0>,
-  "raw_text": <optional: raw title block text for debugging>
-}}
-
-Example:
-[
-  {{
-    "pdf_page": 7,
-    "schematic_page": 1,
-    "schematic_total": 207,
-    "dwg_no": "151-E8810-202-0",
-    "drawing_title": "MAIN POWER POWER LAMP",
-    "confidence": 0.95,
-    "raw_text": "..."
-  }}
-]
-
-Only return the JSON array, nothing else."""
+        if len(missing) <= self.title_block_batch_size:
+            mapping.update(self._detect_title_blocks_batch(cached_content, missing, fields))
+        else:
+            mapping.update(asyncio.run_coroutine_threadsafe(
+                self.detect_title_blocks_async(cached_content, missing, fields),
+                _get_event_loop()
+            ).result())
+        return mapping
+    
+    async def _iter_detect_title_blocks_async(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        fields: Optional[Iterable[str]] = None
+    ) -> AsyncGenerator[Tuple[int, Dict[str, Any]], None]:
+        """
+        Detect title blocks, yielding each page as soon as it is parsed.
         
-        try:
-            logger.info(f"Detecting title blocks for PDF pages: {page_list}")
+        Cached pages are yielded first. The rest are split into batches of
+        GEMINI_TITLE_BLOCK_BATCH_SIZE pages, streamed concurrently (bounded
+        by GEMINI_CONCURRENCY) and parsed incrementally, so callers can start
+        work on early pages before the model finishes the array. Work still
+        pending when the generator is closed or cancelled is cancelled with it.
+        
+        Args:
+            cached_content: Cached content object
+            pdf_page_indices: List of 0-based page indices
+            fields: Optional subset of TITLE_BLOCK_FIELDS to detect
             
-            response = self.client.models.generate_content(
+        Yields:
+            (pdf_page_index, title block data) tuples
+        """
+        fields = self._title_block_fields(fields)
+        mapping, missing = self._cached_title_blocks(cached_content, pdf_page_indices, fields)
+        for item in mapping.items():
+            yield item
+        if not missing:
+            return
+        
+        batch_size = self.title_block_batch_size
+        batches = [
+            missing[i:i + batch_size]
+            for i in range(0, len(missing), batch_size)
+        ]
+        semaphore = asyncio.Semaphore(self.concurrency)
+        detected: asyncio.Queue = asyncio.Queue()
+        
+        async def _stream(batch: List[int]) -> None:
+            try:
+                async with semaphore:
+                    async for item in self._stream_title_blocks_batch_async(cached_content, batch, fields):
+                        detected.put_nowait(item)
+            finally:
+                # Marks this batch done, even if it failed
+                detected.put_nowait(None)
+        
+        tasks = [asyncio.ensure_future(_stream(batch)) for batch in batches]
+        try:
+            remaining = len(tasks)
+            while remaining:
+                item = await detected.get()
+                if item is None:
+                    remaining -= 1
+                else:
+                    yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def _stream_title_blocks_batch_async(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        fields: Tuple[str, ...]
+    ) -> AsyncGenerator[Tuple[int, Dict[str, Any]], None]:
+        """
+        Detect title blocks for one batch with a streamed call.
+        
+        Pages the stream fails on or leaves out go through
+        _detect_title_blocks_batch_async() (with retries).
+        """
+        page_list = ", ".join([str(idx + 1) for idx in pdf_page_indices])
+        remaining = set(pdf_page_indices)
+        parser = _StreamedItemParser({"item": "title_block"})
+        config = self._title_block_config(cached_content, fields)
+        try:
+            logger.info("Streaming title block detection for PDF pages: %s", page_list)
+            stream = await self.client.aio.models.generate_content_stream(
                 model=self.flash_model_name,
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    cached_content=cached_content.name,
-                    temperature=0.1,
-                    response_mime_type="application/json",
-                    response_schema=self.TITLE_BLOCK_SCHEMA
-                )
+                contents=self._request_contents(cached_content, self._build_title_block_prompt(page_list, fields)),
+                config=config
             )
-            
-            result = json.loads(response.text)
-            logger.debug(f"Title block detection response: {result}")
-            
-            # Convert to dict keyed by 0-based pdf_page_index
-            mapping = {}
-            for item in result:
-                pdf_page = item.get("pdf_page")
-                if pdf_page:
-                    pdf_idx = pdf_page - 1  # Convert to 0-based
-                    mapping[pdf_idx] = {
-                        "schematic_page_number": item.get("schematic_page"),
-                        "schematic_total": item.get("schematic_total"),
-                        "dwg_no": item.get("dwg_no"),
-                        "drawing_title": item.get("drawing_title"),
-                        "confidence": item.get("confidence", 0.5),
-                        "raw_text": item.get("raw_text")
-                    }
-            
-            logger.info(f"Title blocks detected: {mapping}")
-            return mapping
-            
+            async for chunk in stream:
+                for _, item in parser.feed(chunk.text):
+                    for idx, info in self._title_blocks_from_items([item], fields).items():
+                        if idx in remaining:
+                            remaining.discard(idx)
+                            self._cache_put(self._title_block_cache, (cached_content.name, idx, fields), info)
+                            yield idx, info
+            parser.close()
         except Exception as e:
-            logger.error(f"Title block detection failed: {e}")
-            # Return empty mapping
-            return {idx: {
-                "schematic_page_number": None,
-                "schematic_total": None,
-                "dwg_no": None,
-                "drawing_title": None,
-                "confidence": 0.0,
-                "raw_text": None
-            } for idx in pdf_page_indices}
+            self._forget_if_gone(e, config)
+            logger.warning("Streamed title block detection failed for pages %s, falling back: %s", page_list, e)
+        
+        if remaining:
+            mapping = await self._detect_title_blocks_batch_async(
+                cached_content, [idx for idx in pdf_page_indices if idx in remaining], fields
+            )
+            for item in mapping.items():
+                yield item
     
-    def extract_page(
+    async def detect_title_blocks_async(
         self,
         cached_content: Any,
-        pdf_page_index: int,
-        context_text: Optional[str] = None,
-        page_mapping: Optional[Dict[int, Dict[str, Any]]] = None
-    ) -> Dict[str, Any]:
+        pdf_page_indices: List[int],
+        fields: Optional[Iterable[str]] = None
+    ) -> Dict[int, Dict[str, Any]]:
         """
-        Extract components, connections, and wire labels from a specific page.
+        Async version of detect_title_blocks().
+        
+        Batches are issued concurrently, bounded by GEMINI_CONCURRENCY.
         
         Args:
             cached_content: Cached content object
-            pdf_page_index: 0-based page index
-            context_text: Optional context (instructions, legend)
-            page_mapping: Optional title block mapping
+            pdf_page_indices: List of 0-based page indices
+            fields: Optional subset of TITLE_BLOCK_FIELDS to detect
             
         Returns:
-            Extracted data dictionary matching EXTRACTION_SCHEMA
+            Dict mapping pdf_page_index -> title block data
         """
-        prompt = self._build_extraction_prompt(pdf_page_index, context_text, page_mapping)
+        fields = self._title_block_fields(fields)
+        mapping, missing = self._cached_title_blocks(cached_content, pdf_page_indices, fields)
+        if not missing:
+            return mapping
         
-        try:
-            logger.info(f"Extracting page {pdf_page_index + 1} with model {self.model_name}")
-            
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    cached_content=cached_content.name,
-                    temperature=self.temperature,
-                    response_mime_type="application/json",
-                    response_schema=self.EXTRACTION_SCHEMA
-                )
-            )
-            
-            result = json.loads(response.text)
-            logger.debug(f"Extraction result: {len(result.get('components', []))} components, {len(result.get('connections', []))} connections")
-            
-            return result
-            
-        except Exception as e:
-            logger.error(f"Extraction failed for page {pdf_page_index}: {e}")
-            raise
+        batch_size = self.title_block_batch_size
+        batches = [
+            missing[i:i + batch_size]
+            for i in range(0, len(missing), batch_size)
+        ]
+        logger.info("Detecting title blocks in %d batches of up to %d pages", len(batches), batch_size)
+        
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def _guarded(batch: List[int]) -> Dict[int, Dict[str, Any]]:
+            async with semaphore:
+                return await self._detect_title_blocks_batch_async(cached_content, batch, fields)
+        
+        for batch_mapping in await asyncio.gather(*[_guarded(batch) for batch in batches]):
+            mapping.update(batch_mapping)
+        return mapping
     
-    def _build_extraction_prompt(
-        self,
-        pdf_page_index: int,
-        context_text: Optional[str],
-        page_mapping: Optional[Dict[int, Dict[str, Any]]]
-    ) -> str:
-        """Build extraction prompt with context."""
-        pdf_page_num = pdf_page_index + 1
+    def _title_block_fields(self, fields: Optional[Iterable[str]]) -> Tuple[str, ...]:
+        """Normalize requested title block fields to TITLE_BLOCK_FIELDS order."""
+        if fields is None:
+            return self.TITLE_BLOCK_FIELDS
         
-        prompt = f"""You are analyzing an industrial electrical schematic diagram.
-
-**Page to analyze**: PDF page {pdf_page_num}"""
+        requested = set(fields)
+        unknown = requested - set(self.TITLE_BLOCK_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown title block fields: {sorted(unknown)}")
+        
+        # Confidence is always reported
+        requested.add("confidence")
+        return tuple(field for field in self.TITLE_BLOCK_FIELDS if field in requested)
+    
+    def _cached_title_blocks(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        fields: Tuple[str, ...]
+    ) -> Tuple[Dict[int, Dict[str, Any]], List[int]]:
+        """
+        Split page indices into cached title blocks and pages still to detect.
+        
+        A full-field detection also satisfies requests for any subset.
+        """
+        mapping = {}
+        missing = []
+        for idx in pdf_page_indices:
+            cached = self._cache_get(self._title_block_cache, (cached_content.name, idx, fields))
+            if cached is None and fields != self.TITLE_BLOCK_FIELDS:
+                cached = self._cache_get(self._title_block_cache, (cached_content.name, idx, self.TITLE_BLOCK_FIELDS))
+            if cached is not None:
+                mapping[idx] = cached
+            else:
+                missing.append(idx)
+        return mapping, missing
+    
+    def _detect_title_blocks_batch(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        fields: Tuple[str, ...]
+    ) -> Dict[int, Dict[str, Any]]:
+        """Detect title blocks for one batch of pages in a single call."""
+        page_list = ", ".join([str(idx + 1) for idx in pdf_page_indices])
+        
+        try:
+            logger.info("Detecting title blocks for PDF pages: %s", page_list)
+            
+            response = self._call_with_retry(
+                self.client.models.generate_content,
+                model=self.flash_model_name,
+                contents=self._request_contents(cached_content, self._build_title_block_prompt(page_list, fields)),
+                config=self._title_block_config(cached_content, fields),
+                description=f"Title block detection for pages {page_list}"
+            )
+            mapping = self._parse_title_blocks(response, fields)
+            
+            # Only successful detections are cached; failures may be retried
+            for idx, info in mapping.items():
+                self._cache_put(self._title_block_cache, (cached_content.name, idx, fields), info)
+            return mapping
+            
+        except Exception as e:
+            logger.error("Title block detection failed: %s", e)
+            return self._empty_title_blocks(pdf_page_indices)
+    
+    async def _detect_title_blocks_batch_async(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        fields: Tuple[str, ...]
+    ) -> Dict[int, Dict[str, Any]]:
+        """Async version of _detect_title_blocks_batch()."""
+        page_list = ", ".join([str(idx + 1) for idx in pdf_page_indices])
+        
+        try:
+            logger.info("Detecting title blocks for PDF pages: %s", page_list)
+            
+            response = await self._acall_with_retry(
+                self.client.aio.models.generate_content,
+                model=self.flash_model_name,
+                contents=self._request_contents(cached_content, self._build_title_block_prompt(page_list, fields)),
+                config=self._title_block_config(cached_content, fields),
+                description=f"Title block detection for pages {page_list}"
+            )
+            mapping = self._parse_title_blocks(response, fields)
+            
+            # Only successful detections are cached; failures may be retried
+            for idx, info in mapping.items():
+                self._cache_put(self._title_block_cache, (cached_content.name, idx, fields), info)
+            return mapping
+            
+        except Exception as e:
+            logger.error("Title block detection failed: %s", e)
+            return self._empty_title_blocks(pdf_page_indices)
+    
+    def _title_block_prompt_parts(self, fields: Tuple[str, ...]) -> Tuple[str, str]:
+        """Build the numbered field instructions and per-page object shape for title block prompts."""
+        specs = [self.TITLE_BLOCK_FIELD_SPECS[field] for field in fields]
+        
+        instructions = "\n".join(
+            f"{i}. {text}"
+            for i, text in enumerate((spec["instruction"] for spec in specs if spec["instruction"]), 1)
+        )
+        shape = ",\n".join(
+            [f'  "pdf_page": <1-based PDF page number>']
+            + [f'  "{spec["key"]}": {spec["shape"]}' for spec in specs]
+        )
+        return instructions, shape
+    
+    def _build_title_block_prompt(self, page_list: str, fields: Tuple[str, ...]) -> str:
+        """
+        Build title block detection prompt asking only for the given fields.
+        
+        The instructions are identical for every call with the same fields
+        and come first, so Gemini's implicit prefix cache can reuse them; the
+        page list goes last.
+        """
+        prefix = self._title_block_prompt_prefixes.get(fields)
+        if prefix is None:
+            specs = [self.TITLE_BLOCK_FIELD_SPECS[field] for field in fields]
+            instructions, shape = self._title_block_prompt_parts(fields)
+            example = orjson.dumps(
+                [{"pdf_page": 7, **{spec["key"]: spec["example"] for spec in specs}}],
+                option=orjson.OPT_INDENT_2
+            ).decode("utf-8")
+            
+            prefix = f"""You are analyzing an industrial schematic diagram PDF.
+
+For each PDF page listed at the end of this prompt, examine the title block (usually at the bottom-right corner of the page).
+
+Extract:
+{instructions}
+
+Return a JSON array with one object per PDF page:
+{{
+{shape}
+}}
+
+Example:
+{example}
+
+Only return the JSON array, nothing else."""
+            GeminiService._title_block_prompt_prefixes[fields] = prefix
+        
+        return f"{prefix}\n\nPDF pages to analyze: {page_list}"
+    
+    def _title_block_config(
+        self,
+        source: Any,
+        fields: Tuple[str, ...]
+    ) -> "types.GenerateContentConfig":
+        """Get (cached) generation config for title block detection."""
+        from google.genai import types
+        cached_content_name = self._cached_content_name(source)
+        key = ("title_blocks", cached_content_name, fields)
+        config = self._cache_get(self._config_cache, key)
+        if config is None:
+            config = types.GenerateContentConfig(
+                cached_content=cached_content_name,
+                temperature=0.1,
+                # Title blocks are large print; low resolution is enough
+                media_resolution=self.MEDIA_RESOLUTIONS["low"],
+                response_mime_type="application/json",
+                response_schema=self._title_block_schema(fields),
+                http_options=self._request_options
+            )
+            self._cache_put(self._config_cache, key, config)
+        return config
+    
+    def _title_block_schema(self, fields: Tuple[str, ...]) -> "types.Schema":
+        """Get the title block response schema for a field set as an SDK Schema object."""
+        from google.genai import types
+        schema = self._compiled_title_block_schemas.get(fields)
+        if schema is None:
+            properties = self.TITLE_BLOCK_SCHEMA["items"]["properties"]
+            keys = ["pdf_page", *(self.TITLE_BLOCK_FIELD_SPECS[field]["key"] for field in fields)]
+            schema = types.Schema.model_validate({
+                **self.TITLE_BLOCK_SCHEMA,
+                "items": {
+                    **self.TITLE_BLOCK_SCHEMA["items"],
+                    "properties": {key: properties[key] for key in keys}
+                }
+            })
+            GeminiService._compiled_title_block_schemas[fields] = schema
+        return schema
+    
+    def _parse_title_blocks(
+        self,
+        response: Any,
+        fields: Tuple[str, ...]
+    ) -> Dict[int, Dict[str, Any]]:
+        """Parse a title block response into a dict keyed by 0-based pdf_page_index."""
+        raw = response.text
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Title block detection response: %s", raw[:500])
+        mapping = self._title_blocks_from_items(self._loads_json(raw, _JSON_ARRAY_RE), fields)
+        logger.info("Title blocks detected: %s", mapping)
+        return mapping
+    
+    def _title_blocks_from_items(
+        self,
+        items: List[Dict[str, Any]],
+        fields: Tuple[str, ...]
+    ) -> Dict[int, Dict[str, Any]]:
+        """Map parsed title block objects to a dict keyed by 0-based pdf_page_index."""
+        mapping = {}
+        for item in items:
+            pdf_page = item.get("pdf_page")
+            if pdf_page:
+                pdf_idx = pdf_page - 1  # Convert to 0-based
+                mapping[pdf_idx] = {
+                    field: item.get(self.TITLE_BLOCK_FIELD_SPECS[field]["key"])
+                    for field in fields
+                }
+                if mapping[pdf_idx].get("confidence") is None:
+                    mapping[pdf_idx]["confidence"] = 0.5
+        return mapping
+    
+    @staticmethod
+    def _empty_title_blocks(pdf_page_indices: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Build an empty title block mapping used when detection fails."""
+        return {idx: {
+            "schematic_page_number": None,
+            "schematic_total": None,
+            "dwg_no": None,
+            "drawing_title": None,
+            "confidence": 0.0,
+            "raw_text": None
+        } for idx in pdf_page_indices}
+    
+    def extract_page(
+        self,
+        cached_content: Any,
+        pdf_page_index: int,
+        context_text: Optional[str] = None,
+        page_mapping: Optional[Dict[int, Dict[str, Any]]] = None,
+        media_resolution: Optional[str] = None,
+        include_paths: bool = False,
+        to_numpy: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Extract components, connections, and wire labels from a specific page.
+        
+        Args:
+            cached_content: Cached content object
+            pdf_page_index: 0-based page index
+            context_text: Optional context (instructions, legend)
+            page_mapping: Optional title block mapping
+            media_resolution: Optional starting resolution (low/medium/high),
+                defaults to GEMINI_MEDIA_RESOLUTION
+            include_paths: Also trace connection wire paths (much larger
+                responses)
+            to_numpy: Return connection paths as float32 arrays of shape
+                (N, 2) instead of nested lists
+            
+        Returns:
+            Extracted data dictionary matching EXTRACTION_SCHEMA
+        """
+        prompt = self._build_extraction_prompt(
+            pdf_page_index, context_text, page_mapping, include_paths=include_paths
+        )
+        
+        # Coalesce concurrent duplicate requests onto a single API call
+        key = (cached_content.name, pdf_page_index, prompt)
+        while True:
+            future, is_owner = self._join_inflight(key)
+            if is_owner:
+                break
+            logger.info("Joining in-flight extraction for page %d", pdf_page_index + 1)
+            try:
+                result = self._copy_result(future.result())
+            except CancelledError:
+                continue  # The owning call was cancelled; make the request ourselves
+            return self._paths_to_numpy(result) if to_numpy else result
+        
+        try:
+            result = self._request_extraction(cached_content, pdf_page_index, prompt, media_resolution, include_paths)
+        except BaseException as e:
+            self._finish_inflight(key, future, error=e)
+            raise
+        self._finish_inflight(key, future, result)
+        return self._paths_to_numpy(result) if to_numpy else result
+    
+    def _request_extraction(
+        self,
+        source: Any,
+        pdf_page_index: int,
+        prompt: str,
+        media_resolution: Optional[str] = None,
+        include_paths: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Issue a single extraction request.
+        
+        Starts at the given (or configured) media resolution and drops one
+        tier on token-limit or timeout errors before giving up. Results are
+        cached under the tier that produced them.
+        """
+        media_resolution = media_resolution or self.media_resolution
+        while True:
+            cache_key, cached = self._cached_extraction(
+                source, pdf_page_index, prompt, media_resolution, include_paths
+            )
+            if cached is not None:
+                return cached
+            try:
+                response = self._call_with_retry(
+                    self.client.models.generate_content,
+                    **self._extraction_request(source, pdf_page_index, prompt, media_resolution, include_paths)
+                )
+                return self._store_extraction(cache_key, response)
+            except Exception as e:
+                media_resolution = self._step_down_media_resolution(e, pdf_page_index, media_resolution)
+                if media_resolution is None:
+                    raise
+    
+    async def extract_page_async(
+        self,
+        cached_content: Any,
+        pdf_page_index: int,
+        context_text: Optional[str] = None,
+        page_mapping: Optional[Dict[int, Dict[str, Any]]] = None,
+        media_resolution: Optional[str] = None,
+        include_paths: bool = False,
+        to_numpy: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Async variant of extract_page() using the client's aio surface.
+        
+        Args:
+            cached_content: Cached content object
+            pdf_page_index: 0-based page index
+            context_text: Optional context (instructions, legend)
+            page_mapping: Optional title block mapping
+            media_resolution: Optional starting resolution (low/medium/high),
+                defaults to GEMINI_MEDIA_RESOLUTION
+            include_paths: Also trace connection wire paths (much larger
+                responses)
+            to_numpy: Return connection paths as float32 arrays of shape
+                (N, 2) instead of nested lists
+            
+        Returns:
+            Extracted data dictionary matching EXTRACTION_SCHEMA
+        """
+        prompt = self._build_extraction_prompt(
+            pdf_page_index, context_text, page_mapping, include_paths=include_paths
+        )
+        
+        # Coalesce concurrent duplicate requests onto a single API call, shared
+        # with extract_page(). Joiners are shielded so that one cancelled
+        # waiter does not cancel the call for the others.
+        key = (cached_content.name, pdf_page_index, prompt)
+        while True:
+            future, is_owner = self._join_inflight(key)
+            if is_owner:
+                break
+            logger.info("Joining in-flight extraction for page %d", pdf_page_index + 1)
+            try:
+                result = self._copy_result(await asyncio.shield(asyncio.wrap_future(future)))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                continue  # The owning call was cancelled; make the request ourselves
+            return self._paths_to_numpy(result) if to_numpy else result
+        
+        try:
+            result = await self._request_extraction_async(
+                cached_content, pdf_page_index, prompt, media_resolution, include_paths
+            )
+        except BaseException as e:
+            self._finish_inflight(key, future, error=e)
+            raise
+        self._finish_inflight(key, future, result)
+        return self._paths_to_numpy(result) if to_numpy else result
+    
+    def stream_extract_page(
+        self,
+        cached_content: Any,
+        pdf_page_index: int,
+        context_text: Optional[str] = None,
+        page_mapping: Optional[Dict[int, Dict[str, Any]]] = None,
+        media_resolution: Optional[str] = None,
+        include_paths: bool = False
+    ) -> Generator[Tuple[str, Dict[str, Any]], None, None]:
+        """
+        Extract a page, yielding items as soon as each one is complete.
+        
+        The response is streamed and parsed incrementally, so callers can
+        start on components before the model finishes, and neither the full
+        response text nor the full result tree is held in memory. Results
+        are not cached, retried or deduplicated (see extract_page()).
+        
+        Args:
+            cached_content: Cached content object (or a page range upload)
+            pdf_page_index: 0-based PDF page index
+            context_text: Optional context (instructions, legend)
+            page_mapping: Optional title block mapping
+            media_resolution: Optional resolution (low/medium/high),
+                defaults to GEMINI_MEDIA_RESOLUTION
+            include_paths: Also trace connection wire paths
+            
+        Yields:
+            (key, item) tuples, where key is one of EXTRACTION_ARRAY_KEYS
+        """
+        media_resolution = media_resolution or self.media_resolution
+        prompt = self._build_extraction_prompt(
+            pdf_page_index, context_text, page_mapping, include_paths=include_paths
+        )
+        config = self._extraction_config(cached_content, media_resolution, include_paths=include_paths)
+        parser = _StreamedItemParser({f"{key}.item": key for key in self.EXTRACTION_ARRAY_KEYS})
+        
+        logger.info("Streaming extraction for page %d with model %s", pdf_page_index + 1, self.model_name)
+        try:
+            stream = self.client.models.generate_content_stream(
+                model=self.model_name,
+                contents=self._request_contents(cached_content, prompt),
+                config=config
+            )
+            for chunk in stream:
+                yield from parser.feed(chunk.text)
+            parser.close()
+        except Exception as e:
+            self._forget_if_gone(e, config)
+            raise
+    
+    def _cache_get(self, cache: Any, key: Any) -> Any:
+        """Read a shared in-memory cache under its lock."""
+        with self._cache_lock:
+            return cache.get(key)
+    
+    def _cache_put(self, cache: Any, key: Any, value: Any) -> None:
+        """Write a shared in-memory cache under its lock."""
+        with self._cache_lock:
+            cache[key] = value
+    
+    def _forget_server_object(self, name: str) -> Optional[str]:
+        """
+        Evict an uploaded file or cached content that Gemini reports as gone.
+        
+        Drops it, its digest and the configs and title blocks derived from
+        it, so the next call uploads or creates it afresh instead of hitting
+        the same 404 until the entry expires.
+        
+        Returns:
+            Local path the file was uploaded from, if it was an upload
+        """
+        file_path = None
+        with self._cache_lock:
+            for key, value in list(self._file_cache.items()):
+                if getattr(value, "name", None) == name:
+                    del self._file_cache[key]
+                    file_path = key
+            for key, value in list(self._content_cache.items()):
+                if getattr(value, "name", None) == name:
+                    del self._content_cache[key]
+            self._files_by_name.pop(name, None)
+            self._file_digests.pop(name, None)
+            self._content_digests.pop(name, None)
+            for cache in (self._config_cache, self._title_block_cache):
+                for key in [key for key in cache if name in key]:
+                    del cache[key]
+        with self._remote_files_lock:
+            if self._remote_files is not None:
+                listed_at, files = self._remote_files
+                GeminiService._remote_files = (listed_at, {
+                    prefix: f for prefix, f in files.items() if f.name != name
+                })
+        logger.info("Evicted %s from the in-memory caches", name)
+        return file_path
+    
+    def _forget_if_gone(self, error: Exception, config: Any) -> None:
+        """Evict the cached content a failed generation call used, if the error says it is gone."""
+        name = getattr(config, "cached_content", None)
+        if name and self._is_not_found_error(error):
+            self._forget_server_object(name)
+    
+    def _join_inflight(self, key: Tuple[str, int, str]) -> Tuple[Future, bool]:
+        """
+        Find the in-flight call for a request, or register one.
+        
+        Returns:
+            (future, is_owner); the owner makes the call and must settle the
+            future with _finish_inflight()
+        """
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            future = self._inflight[key] = Future()
+            return future, True
+    
+    def _finish_inflight(
+        self,
+        key: Tuple[str, int, str],
+        future: Future,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[BaseException] = None
+    ) -> None:
+        """Unregister an in-flight call and hand its outcome to any joiners."""
+        with self._inflight_lock:
+            self._inflight.pop(key, None)
+        if isinstance(error, asyncio.CancelledError):
+            future.cancel()  # Joiners retry the request themselves
+        elif error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    
+    @staticmethod
+    def _copy_result(result: Dict[str, Any]) -> Dict[str, Any]:
+        """Deep-copy a shared extraction result (a JSON round trip is faster than copy.deepcopy)."""
+        return orjson.loads(orjson.dumps(result))
+    
+    async def _request_extraction_async(
+        self,
+        source: Any,
+        pdf_page_index: int,
+        prompt: str,
+        media_resolution: Optional[str] = None,
+        include_paths: bool = False
+    ) -> Dict[str, Any]:
+        """Issue a single async extraction request (see _request_extraction)."""
+        media_resolution = media_resolution or self.media_resolution
+        while True:
+            cache_key, cached = self._cached_extraction(
+                source, pdf_page_index, prompt, media_resolution, include_paths
+            )
+            if cached is not None:
+                return cached
+            try:
+                response = await self._acall_with_retry(
+                    self.client.aio.models.generate_content,
+                    **self._extraction_request(source, pdf_page_index, prompt, media_resolution, include_paths)
+                )
+                return self._store_extraction(cache_key, response)
+            except Exception as e:
+                media_resolution = self._step_down_media_resolution(e, pdf_page_index, media_resolution)
+                if media_resolution is None:
+                    raise
+    
+    def _cached_extraction(
+        self,
+        source: Any,
+        pdf_page_index: int,
+        prompt: str,
+        media_resolution: str,
+        include_paths: bool
+    ) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """Look up a single-page extraction at one resolution tier; returns (cache key, cached result)."""
+        cache_key = self._result_cache_key(
+            source, pdf_page_index, prompt, media_resolution, include_paths=include_paths
+        )
+        cached = self._result_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            logger.info("Using cached extraction for page %d (%s resolution)", pdf_page_index + 1, media_resolution)
+        return cache_key, cached
+    
+    def _extraction_request(
+        self,
+        source: Any,
+        pdf_page_index: int,
+        prompt: str,
+        media_resolution: str,
+        include_paths: bool
+    ) -> Dict[str, Any]:
+        """Build the generate_content arguments for one single-page extraction attempt."""
+        logger.info(
+            "Extracting page %d with model %s (%s resolution)",
+            pdf_page_index + 1, self.model_name, media_resolution
+        )
+        lower = self._lower_media_resolution(media_resolution)
+        return {
+            "model": self.model_name,
+            "contents": self._request_contents(source, prompt),
+            "config": self._extraction_config(source, media_resolution, include_paths=include_paths),
+            "description": f"Extraction of page {pdf_page_index + 1}",
+            # Input-limit errors step down a tier below instead of retrying as-is
+            "retry_if": lambda e: not (lower and self._is_input_limit_error(e))
+        }
+    
+    def _store_extraction(self, cache_key: Optional[str], response: Any) -> Dict[str, Any]:
+        """Parse a single-page extraction response and cache the result."""
+        result = self._parse_extraction(response)
+        if cache_key:
+            self._result_cache.set(cache_key, result)
+        return result
+    
+    def _step_down_media_resolution(
+        self,
+        error: Exception,
+        pdf_page_index: int,
+        media_resolution: str
+    ) -> Optional[str]:
+        """
+        Decide how to continue after a failed extraction attempt.
+        
+        Returns:
+            The next lower tier to retry at if the error was an input limit,
+            otherwise None (the caller re-raises)
+        """
+        lower = self._lower_media_resolution(media_resolution)
+        if lower and self._is_input_limit_error(error):
+            logger.warning(
+                "Page %d hit input limits at %s resolution, retrying at %s: %s",
+                pdf_page_index + 1, media_resolution, lower, error
+            )
+            return lower
+        logger.error("Extraction failed for page %d: %s", pdf_page_index + 1, error)
+        return None
+    
+    async def extract_pages_async(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        context_text: Optional[str] = None,
+        page_mapping: Optional[Dict[int, Dict[str, Any]]] = None,
+        media_resolutions: Optional[Dict[int, str]] = None,
+        include_paths: bool = False,
+        to_numpy: bool = False,
+        max_concurrency: Optional[int] = None
+    ) -> Dict[int, Any]:
+        """
+        Extract multiple pages concurrently, bounded by GEMINI_CONCURRENCY.
+        
+        With GEMINI_PAGES_PER_REQUEST > 1, pages are grouped and each group
+        is extracted in a single call, saving the per-request overhead.
+        
+        Args:
+            cached_content: Cached content object
+            pdf_page_indices: List of 0-based page indices
+            context_text: Optional context (instructions, legend)
+            page_mapping: Optional title block mapping
+            media_resolutions: Optional per-page media resolution overrides
+                (see pick_media_resolution())
+            include_paths: Also trace connection wire paths
+            to_numpy: Return connection paths as float32 (N, 2) arrays
+            max_concurrency: Optional in-flight request limit for this call
+                (default: GEMINI_CONCURRENCY)
+            
+        Returns:
+            Dict mapping pdf_page_index -> extracted data, or the exception
+            raised while extracting that page
+        """
+        results = {}
+        async for pdf_page_index, result in self._iter_extract_pages_async(
+            cached_content, pdf_page_indices, context_text, page_mapping, media_resolutions,
+            include_paths, max_concurrency
+        ):
+            results[pdf_page_index] = result
+        results = {idx: results[idx] for idx in pdf_page_indices}
+        
+        if to_numpy:
+            results = {
+                idx: result if isinstance(result, BaseException) else self._paths_to_numpy(result)
+                for idx, result in results.items()
+            }
+        return results
+    
+    async def _iter_extract_pages_async(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        context_text: Optional[str],
+        page_mapping: Optional[Dict[int, Dict[str, Any]]],
+        media_resolutions: Optional[Dict[int, str]],
+        include_paths: bool,
+        max_concurrency: Optional[int]
+    ) -> AsyncGenerator[Tuple[int, Any], None]:
+        """
+        Fan out page extraction, yielding pages in the order they finish.
+        
+        Each page (or page group, with GEMINI_PAGES_PER_REQUEST > 1) runs as
+        its own task; work still pending when the generator is closed or
+        cancelled is cancelled with it.
+        
+        Yields:
+            (pdf_page_index, extracted data or the exception for that page)
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or self.concurrency)
+        media_resolutions = media_resolutions or {}
+        group_size = self._extraction_group_size()
+        groups = [
+            pdf_page_indices[i:i + group_size]
+            for i in range(0, len(pdf_page_indices), group_size)
+        ]
+        
+        async def _guarded(group: List[int]) -> Dict[int, Any]:
+            async with semaphore:
+                return await self._extract_group_async(
+                    cached_content, group, context_text, page_mapping, media_resolutions, include_paths
+                )
+        
+        tasks = [asyncio.ensure_future(_guarded(group)) for group in groups]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                for item in (await finished).items():
+                    yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    def _extraction_group_size(self) -> int:
+        """Pages per extraction request (GEMINI_PAGES_PER_REQUEST, at least 1)."""
+        return self.pages_per_request if self.pages_per_request > 1 else 1
+    
+    async def _extract_group_async(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        context_text: Optional[str],
+        page_mapping: Optional[Dict[int, Dict[str, Any]]],
+        media_resolutions: Dict[int, str],
+        include_paths: bool
+    ) -> Dict[int, Any]:
+        """
+        Extract one request's worth of pages (see _extraction_group_size()).
+        
+        Returns:
+            Dict mapping pdf_page_index -> extracted data or exception; if
+            the request fails outright, every page gets its exception
+        """
+        try:
+            if self.pages_per_request > 1:
+                return await self._extract_page_group_async(
+                    cached_content, pdf_page_indices, context_text, page_mapping, media_resolutions,
+                    include_paths
+                )
+            return {pdf_page_indices[0]: await self.extract_page_async(
+                cached_content, pdf_page_indices[0], context_text, page_mapping,
+                media_resolution=media_resolutions.get(pdf_page_indices[0]),
+                include_paths=include_paths
+            )}
+        except Exception as e:
+            return dict.fromkeys(pdf_page_indices, e)
+    
+    async def _extract_page_group_async(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        context_text: Optional[str],
+        page_mapping: Optional[Dict[int, Dict[str, Any]]],
+        media_resolutions: Dict[int, str],
+        include_paths: bool = False
+    ) -> Dict[int, Any]:
+        """
+        Extract a group of pages with one multi-page request.
+        
+        The group uses the highest media resolution any of its pages needs.
+        Pages missing from the response, or the whole group if the request
+        hits input limits or returns unparseable JSON, fall back to
+        individual extract_page_async() calls.
+        
+        Returns:
+            Dict mapping pdf_page_index -> extracted data or exception
+        """
+        page_list = ", ".join(str(idx + 1) for idx in pdf_page_indices)
+        tiers = list(self.MEDIA_RESOLUTIONS)
+        media_resolution = max(
+            (media_resolutions.get(idx) or self.media_resolution for idx in pdf_page_indices),
+            key=tiers.index
+        )
+        prompt = self._build_multi_page_extraction_prompt(
+            pdf_page_indices, context_text, page_mapping, include_paths=include_paths
+        )
+        
+        cache_key = self._result_cache_key(
+            cached_content, pdf_page_indices[0], prompt, media_resolution,
+            multi_page=True, include_paths=include_paths
+        )
+        pages = self._result_cache.get(cache_key) if cache_key else None
+        if pages is not None:
+            logger.info("Using cached extraction for pages %s", page_list)
+        else:
+            try:
+                logger.info("Extracting pages %s in one request with model %s", page_list, self.model_name)
+                # Input-limit errors fall back to single pages below instead of retrying
+                response = await self._acall_with_retry(
+                    self.client.aio.models.generate_content,
+                    model=self.model_name,
+                    contents=self._request_contents(cached_content, prompt),
+                    config=self._extraction_config(
+                        cached_content, media_resolution, multi_page=True, include_paths=include_paths
+                    ),
+                    description=f"Extraction of pages {page_list}",
+                    retry_if=lambda e: not self._is_input_limit_error(e)
+                )
+                pages = self._parse_extraction(response, multi_page=True)["pages"]
+                if cache_key:
+                    self._result_cache.set(cache_key, pages)
+            except Exception as e:
+                if not (self._is_input_limit_error(e) or isinstance(e, (ValueError, KeyError, TypeError))):
+                    raise
+                logger.warning("Multi-page extraction failed for pages %s, falling back to single pages: %s", page_list, e)
+                pages = []
+        
+        results = {}
+        for page in pages:
+            pdf_page_index = (page.pop("pdf_page", None) or 0) - 1
+            if pdf_page_index in pdf_page_indices:
+                results[pdf_page_index] = page
+        
+        missing = [idx for idx in pdf_page_indices if idx not in results]
+        if missing and pages:
+            logger.warning("Pages %s missing from multi-page response, extracting individually", missing)
+        for idx in missing:
+            try:
+                results[idx] = await self.extract_page_async(
+                    cached_content, idx, context_text, page_mapping,
+                    media_resolution=media_resolutions.get(idx),
+                    include_paths=include_paths,
+                    to_numpy=False
+                )
+            except Exception as e:
+                results[idx] = e
+        return results
+    
+    def extract_pages(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        context_text: Optional[str] = None,
+        page_mapping: Optional[Dict[int, Dict[str, Any]]] = None,
+        media_resolutions: Optional[Dict[int, str]] = None,
+        include_paths: bool = False,
+        to_numpy: bool = False,
+        max_concurrency: Optional[int] = None
+    ) -> Dict[int, Any]:
+        """
+        Synchronous entry point for extract_pages_async().
+        
+        Runs the fan-out on the shared background event loop and blocks
+        until every page has finished (or failed).
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self.extract_pages_async(
+                cached_content, pdf_page_indices, context_text, page_mapping, media_resolutions,
+                include_paths, to_numpy, max_concurrency
+            ),
+            _get_event_loop()
+        )
+        return future.result()
+    
+    def iter_extract_pages(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        context_text: Optional[str] = None,
+        page_mapping: Optional[Dict[int, Dict[str, Any]]] = None,
+        media_resolutions: Optional[Dict[int, str]] = None,
+        include_paths: bool = False,
+        to_numpy: bool = False,
+        max_concurrency: Optional[int] = None
+    ) -> Generator[Tuple[Optional[int], Any], None, None]:
+        """
+        Synchronous, streaming entry point for the extract_pages_async() fan-out.
+        
+        Pages are yielded as soon as each one finishes, so callers can store
+        and report them while the rest are still in flight. While nothing
+        finishes, a (None, None) heartbeat is yielded every
+        STREAM_HEARTBEAT_INTERVAL seconds so callers can keep a stream alive
+        and check for cancellation. Closing the generator cancels all pages
+        that have not finished.
+        
+        Args:
+            Same as extract_pages()
+            
+        Yields:
+            (pdf_page_index, extracted data or the exception for that page)
+            in completion order, or (None, None) heartbeats
+        """
+        stream = self._stream_from_event_loop(
+            self._iter_extract_pages_async(
+                cached_content, pdf_page_indices, context_text, page_mapping, media_resolutions,
+                include_paths, max_concurrency
+            ),
+            heartbeat=(None, None)
+        )
+        try:
+            for pdf_page_index, result in stream:
+                if to_numpy and pdf_page_index is not None and not isinstance(result, BaseException):
+                    result = self._paths_to_numpy(result)
+                yield pdf_page_index, result
+        finally:
+            stream.close()
+    
+    def _stream_from_event_loop(
+        self,
+        items: AsyncGenerator[Any, None],
+        heartbeat: Any
+    ) -> Generator[Any, None, None]:
+        """
+        Run an async generator on the shared event loop and yield its items here.
+        
+        While nothing arrives, heartbeat is yielded every
+        STREAM_HEARTBEAT_INTERVAL seconds so callers can keep a stream alive
+        and check for cancellation. Closing the generator closes the async
+        one, cancelling whatever it still has in flight.
+        """
+        finished: queue.Queue = queue.Queue()
+        
+        async def _produce() -> None:
+            try:
+                async for item in items:
+                    finished.put(item)
+            finally:
+                await items.aclose()
+        
+        future = asyncio.run_coroutine_threadsafe(_produce(), _get_event_loop())
+        future.add_done_callback(lambda _: finished.put(None))
+        try:
+            while True:
+                try:
+                    item = finished.get(timeout=self.STREAM_HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    yield heartbeat
+                    continue
+                if item is None:
+                    break
+                yield item
+            future.result()
+        finally:
+            future.cancel()
+    
+    def iter_detect_then_extract(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        context_text: Optional[str] = None,
+        media_resolutions: Optional[Dict[int, str]] = None,
+        include_paths: bool = False,
+        to_numpy: bool = False,
+        max_concurrency: Optional[int] = None
+    ) -> Generator[Tuple[Optional[int], Optional[Dict[str, Any]], Any], None, None]:
+        """
+        Detect title blocks and extract pages, starting each extraction as its title block arrives.
+        
+        Unlike iter_detect_and_extract(), the title block still feeds the
+        extraction prompt, but extraction doesn't wait for the whole
+        detection pass. While nothing finishes, a (None, None, None)
+        heartbeat is yielded every STREAM_HEARTBEAT_INTERVAL seconds.
+        Closing the generator cancels detection and all pages that have not
+        finished.
+        
+        Args:
+            Same as extract_pages(), without page_mapping
+            
+        Yields:
+            (pdf_page_index, title block data or None, extracted data or the
+            exception for that page) in completion order, or heartbeats
+        """
+        stream = self._stream_from_event_loop(
+            self._iter_detect_then_extract_async(
+                cached_content, pdf_page_indices, context_text, media_resolutions, include_paths,
+                max_concurrency
+            ),
+            heartbeat=(None, None, None)
+        )
+        try:
+            for pdf_page_index, title_block, result in stream:
+                if to_numpy and pdf_page_index is not None and not isinstance(result, BaseException):
+                    result = self._paths_to_numpy(result)
+                yield pdf_page_index, title_block, result
+        finally:
+            stream.close()
+    
+    async def _iter_detect_then_extract_async(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        context_text: Optional[str],
+        media_resolutions: Optional[Dict[int, str]],
+        include_paths: bool,
+        max_concurrency: Optional[int]
+    ) -> AsyncGenerator[Tuple[int, Optional[Dict[str, Any]], Any], None]:
+        """
+        Submit pages for extraction as their title blocks stream in.
+        
+        Detected pages are grouped by GEMINI_PAGES_PER_REQUEST in detection
+        order; pages detection never returns are extracted without a title
+        block once it ends. Each page is yielded exactly once, and work
+        still pending when the generator is closed or cancelled is cancelled
+        with it.
+        
+        Yields:
+            (pdf_page_index, title block data or None, extracted data or the
+            exception for that page) in completion order
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or self.concurrency)
+        media_resolutions = media_resolutions or {}
+        group_size = self._extraction_group_size()
+        pages = list(dict.fromkeys(pdf_page_indices))
+        page_mapping: Dict[int, Dict[str, Any]] = {}
+        finished: asyncio.Queue = asyncio.Queue()
+        tasks: List[asyncio.Future] = []
+        
+        async def _extract(group: List[int]) -> None:
+            async with semaphore:
+                results = await self._extract_group_async(
+                    cached_content, group, context_text, page_mapping, media_resolutions, include_paths
+                )
+            for idx in group:
+                finished.put_nowait((idx, page_mapping.get(idx), results[idx]))
+        
+        def _submit(group: List[int]) -> None:
+            for i in range(0, len(group), group_size):
+                tasks.append(asyncio.ensure_future(_extract(group[i:i + group_size])))
+        
+        async def _detect() -> None:
+            undetected = dict.fromkeys(pages)
+            group = []
+            try:
+                async for idx, info in self._iter_detect_title_blocks_async(cached_content, pages):
+                    if idx not in undetected:
+                        continue
+                    del undetected[idx]
+                    page_mapping[idx] = info
+                    group.append(idx)
+                    if len(group) == group_size:
+                        _submit(group)
+                        group = []
+            except Exception as e:
+                logger.warning("Title block detection failed, extracting remaining pages without: %s", e)
+            _submit(group + list(undetected))
+        
+        detection = asyncio.ensure_future(_detect())
+        try:
+            for _ in pages:
+                yield await finished.get()
+        finally:
+            detection.cancel()
+            for task in tasks:
+                task.cancel()
+    
+    def batch_extract_pages(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        context_text: Optional[str] = None,
+        page_mapping: Optional[Dict[int, Dict[str, Any]]] = None,
+        media_resolutions: Optional[Dict[int, str]] = None,
+        include_paths: bool = False,
+        to_numpy: bool = False
+    ) -> Dict[int, Any]:
+        """
+        Extract pages through a Gemini Batch Mode job.
+        
+        All page requests are submitted as one job, which is billed at about
+        half the online price and scheduled offline, then polled until it
+        finishes. Best suited to large documents where latency matters less
+        than cost. The cached content must outlive the job.
+        
+        Pages already in the result cache are not resubmitted. Unlike the
+        online path there is no per-page media resolution step-down; a page
+        that fails in the batch is returned as an exception. Blocks until
+        the job finishes; see iter_batch_extract_pages() to stream it.
+        
+        Args:
+            cached_content: Cached content object
+            pdf_page_indices: List of 0-based page indices
+            context_text: Optional context (instructions, legend)
+            page_mapping: Optional title block mapping
+            media_resolutions: Optional per-page media resolution overrides
+            include_paths: Also trace connection wire paths
+            to_numpy: Return connection paths as float32 (N, 2) arrays
+            
+        Returns:
+            Dict mapping pdf_page_index -> extracted data, or the exception
+            for that page
+        """
+        results = {
+            idx: result
+            for idx, result in self.iter_batch_extract_pages(
+                cached_content, pdf_page_indices, context_text, page_mapping, media_resolutions,
+                include_paths, to_numpy
+            )
+            if idx is not None
+        }
+        return {idx: results[idx] for idx in pdf_page_indices}
+    
+    def iter_batch_extract_pages(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        context_text: Optional[str] = None,
+        page_mapping: Optional[Dict[int, Dict[str, Any]]] = None,
+        media_resolutions: Optional[Dict[int, str]] = None,
+        include_paths: bool = False,
+        to_numpy: bool = False
+    ) -> Generator[Tuple[Optional[int], Any], None, None]:
+        """
+        Streaming variant of batch_extract_pages().
+        
+        Cached pages are yielded straight away. While the job runs, a
+        (None, job state name) heartbeat is yielded every
+        STREAM_HEARTBEAT_INTERVAL seconds so callers can report progress and
+        check for cancellation; closing the generator cancels the job. The
+        submitted pages are yielded once the job finishes.
+        
+        Args:
+            Same as batch_extract_pages()
+            
+        Yields:
+            (pdf_page_index, extracted data or the exception for that page),
+            or (None, job state name) heartbeats
+        """
+        from google.genai import types
+        
+        media_resolutions = media_resolutions or {}
+        pending: List[Tuple[int, Optional[str]]] = []
+        requests = []
+        
+        def _finish(idx: int, result: Any) -> Tuple[int, Any]:
+            if to_numpy and not isinstance(result, BaseException):
+                result = self._paths_to_numpy(result)
+            return idx, result
+        
+        for idx in pdf_page_indices:
+            prompt = self._build_extraction_prompt(
+                idx, context_text, page_mapping, include_paths=include_paths
+            )
+            media_resolution = media_resolutions.get(idx) or self.media_resolution
+            cache_key = self._result_cache_key(
+                cached_content, idx, prompt, media_resolution, include_paths=include_paths
+            )
+            cached = self._result_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                logger.info("Using cached extraction for page %d", idx + 1)
+                yield _finish(idx, cached)
+                continue
+            
+            pending.append((idx, cache_key))
+            requests.append(types.InlinedRequest(
+                model=self.model_name,
+                contents=self._request_contents(cached_content, prompt),
+                config=self._extraction_config(
+                    cached_content,
+                    media_resolution,
+                    include_paths=include_paths,
+                    batch=True
+                )
+            ))
+        
+        if not requests:
+            return
+        
+        logger.info("Submitting batch extraction job for %d pages", len(requests))
+        job = self._call_with_retry(
+            self.client.batches.create,
+            model=self.model_name,
+            src=requests,
+            description=f"Batch job creation for {len(requests)} pages"
+        )
+        job = yield from self._poll_batch_job(job)
+        
+        responses = job.dest.inlined_responses if job.dest else None
+        responses = responses or []
+        for (idx, cache_key), inlined in zip(pending, responses):
+            if inlined.error:
+                yield idx, RuntimeError(f"Batch extraction failed for page {idx + 1}: {inlined.error.message}")
+                continue
+            try:
+                result = self._parse_extraction(inlined.response)
+            except Exception as e:
+                logger.error("Extraction failed for page %d: %s", idx + 1, e)
+                yield idx, e
+                continue
+            if cache_key:
+                self._result_cache.set(cache_key, result)
+            yield _finish(idx, result)
+        
+        for idx, _ in pending[len(responses):]:
+            yield idx, RuntimeError(f"Batch job {job.name} returned no response for page {idx + 1}")
+    
+    def _poll_batch_job(self, job: Any) -> Generator[Tuple[None, str], None, Any]:
+        """
+        Poll a batch job until it reaches a terminal state.
+        
+        Batch jobs take minutes to hours, so polling backs off up to
+        BATCH_POLL_MAX_DELAY. Between polls a heartbeat carrying the current
+        state is yielded every STREAM_HEARTBEAT_INTERVAL seconds. The job is cancelled if it
+        is still running after BATCH_TIMEOUT, if polling fails, or if the
+        generator is closed before the job finishes.
+        
+        Yields:
+            (None, job state name) heartbeats, as in iter_batch_extract_pages()
+            
+        Returns:
+            Refreshed job in JOB_STATE_SUCCEEDED (the generator's return value)
+            
+        Raises:
+            RuntimeError: If the job failed, was cancelled or expired
+            TimeoutError: If the job did not finish within BATCH_TIMEOUT
+        """
+        deadline = time.monotonic() + self.BATCH_TIMEOUT
+        delay = self.BATCH_POLL_INITIAL_DELAY
+        
+        try:
+            while job.state.name not in self.BATCH_TERMINAL_STATES:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Batch job {job.name} still {job.state.name} after {self.BATCH_TIMEOUT}s")
+                
+                next_poll = time.monotonic() + delay
+                while True:
+                    remaining = next_poll - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    time.sleep(min(remaining, self.STREAM_HEARTBEAT_INTERVAL))
+                    yield None, job.state.name
+                
+                delay = min(delay * 2, self.BATCH_POLL_MAX_DELAY)
+                job = self._call_with_retry(
+                    self.client.batches.get,
+                    name=job.name,
+                    description=f"Batch job status for {job.name}"
+                )
+                logger.debug("Batch job %s state: %s", job.name, job.state.name)
+        finally:
+            if job.state.name not in self.BATCH_TERMINAL_STATES:
+                logger.info("Cancelling batch job %s", job.name)
+                try:
+                    self.client.batches.cancel(name=job.name)
+                except Exception as e:
+                    logger.warning("Failed to cancel batch job %s: %s", job.name, e)
+        
+        if job.state.name != "JOB_STATE_SUCCEEDED":
+            raise RuntimeError(f"Batch job {job.name} ended in {job.state.name}: {job.error}")
+        
+        logger.info("Batch job %s succeeded", job.name)
+        return job
+    
+    def detect_and_extract(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        context_text: Optional[str] = None,
+        media_resolutions: Optional[Dict[int, str]] = None,
+        include_paths: bool = False,
+        to_numpy: bool = False
+    ) -> Tuple[Dict[int, Dict[str, Any]], Dict[int, Any]]:
+        """
+        Synchronous entry point for detect_and_extract_async().
+        
+        Runs on the shared background event loop and blocks until every
+        page has finished (or failed).
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self.detect_and_extract_async(
+                cached_content, pdf_page_indices, context_text, media_resolutions, include_paths, to_numpy
+            ),
+            _get_event_loop()
+        )
+        return future.result()
+    
+    def iter_detect_and_extract(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        context_text: Optional[str] = None,
+        media_resolutions: Optional[Dict[int, str]] = None,
+        include_paths: bool = False,
+        to_numpy: bool = False
+    ) -> Generator[Tuple[Optional[int], Optional[Dict[str, Any]], Any], None, None]:
+        """
+        Synchronous, streaming entry point for detect_and_extract_async().
+        
+        Pages are yielded with their title block as soon as their group
+        finishes. While nothing finishes, a (None, None, None) heartbeat is
+        yielded every STREAM_HEARTBEAT_INTERVAL seconds. Closing the
+        generator cancels all groups that have not finished.
+        
+        Args:
+            Same as detect_and_extract()
+            
+        Yields:
+            (pdf_page_index, title block data or None, extracted data or the
+            exception for that page) in completion order, or heartbeats
+        """
+        stream = self._stream_from_event_loop(
+            self._iter_detect_and_extract_async(
+                cached_content, pdf_page_indices, context_text, media_resolutions, include_paths
+            ),
+            heartbeat=(None, None, None)
+        )
+        try:
+            for pdf_page_index, title_block, result in stream:
+                if to_numpy and pdf_page_index is not None and not isinstance(result, BaseException):
+                    result = self._paths_to_numpy(result)
+                yield pdf_page_index, title_block, result
+        finally:
+            stream.close()
+    
+    async def detect_and_extract_async(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        context_text: Optional[str] = None,
+        media_resolutions: Optional[Dict[int, str]] = None,
+        include_paths: bool = False,
+        to_numpy: bool = False
+    ) -> Tuple[Dict[int, Dict[str, Any]], Dict[int, Any]]:
+        """
+        Detect title blocks and extract pages with one request per page group.
+        
+        Saves the separate title block round trip when both are needed.
+        Pages are grouped by GEMINI_PAGES_PER_REQUEST and groups run
+        concurrently, bounded by GEMINI_CONCURRENCY. The extraction prompt
+        can't use title block info as context since it is detected in the
+        same call.
+        
+        Args:
+            cached_content: Cached content object
+            pdf_page_indices: List of 0-based page indices
+            context_text: Optional context (instructions, legend)
+            media_resolutions: Optional per-page media resolution overrides
+            include_paths: Also trace connection wire paths
+            to_numpy: Return connection paths as float32 (N, 2) arrays
+            
+        Returns:
+            Tuple of (pdf_page_index -> title block data, pdf_page_index ->
+            extracted data or the exception for that page). Pages of a group
+            that failed outright get its exception and no title block.
+        """
+        title_blocks = {}
+        results = {}
+        async for pdf_page_index, title_block, result in self._iter_detect_and_extract_async(
+            cached_content, pdf_page_indices, context_text, media_resolutions, include_paths
+        ):
+            if title_block is not None:
+                title_blocks[pdf_page_index] = title_block
+            results[pdf_page_index] = result
+        
+        results = {idx: results[idx] for idx in pdf_page_indices}
+        if to_numpy:
+            results = {
+                idx: result if isinstance(result, BaseException) else self._paths_to_numpy(result)
+                for idx, result in results.items()
+            }
+        return title_blocks, results
+    
+    async def _iter_detect_and_extract_async(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        context_text: Optional[str],
+        media_resolutions: Optional[Dict[int, str]],
+        include_paths: bool
+    ) -> AsyncGenerator[Tuple[int, Optional[Dict[str, Any]], Any], None]:
+        """
+        Fan out combined requests, yielding pages in the order their group finishes.
+        
+        Work still pending when the generator is closed or cancelled is
+        cancelled with it.
+        
+        Yields:
+            (pdf_page_index, title block data or None, extracted data or the
+            exception for that page)
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        media_resolutions = media_resolutions or {}
+        group_size = self.pages_per_request
+        groups = [
+            pdf_page_indices[i:i + group_size]
+            for i in range(0, len(pdf_page_indices), group_size)
+        ]
+        
+        async def _guarded(group: List[int]) -> List[Tuple[int, Optional[Dict[str, Any]], Any]]:
+            try:
+                async with semaphore:
+                    title_blocks, results = await self._detect_and_extract_group_async(
+                        cached_content, group, context_text, media_resolutions, include_paths
+                    )
+            except Exception as e:
+                return [(idx, None, e) for idx in group]
+            return [(idx, title_blocks.get(idx), results[idx]) for idx in group]
+        
+        tasks = [asyncio.ensure_future(_guarded(group)) for group in groups]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                for item in await finished:
+                    yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def _detect_and_extract_group_async(
+        self,
+        cached_content: Any,
+        pdf_page_indices: List[int],
+        context_text: Optional[str],
+        media_resolutions: Dict[int, str],
+        include_paths: bool = False
+    ) -> Tuple[Dict[int, Dict[str, Any]], Dict[int, Any]]:
+        """
+        Detect title blocks and extract a group of pages in one request.
+        
+        If the combined request fails, or pages are missing from its
+        response, those pages go through detect_title_blocks_async() and
+        extract_page_async() separately.
+        """
+        page_list = ", ".join(str(idx + 1) for idx in pdf_page_indices)
+        tiers = list(self.MEDIA_RESOLUTIONS)
+        media_resolution = max(
+            (media_resolutions.get(idx) or self.media_resolution for idx in pdf_page_indices),
+            key=tiers.index
+        )
+        prompt = self._build_multi_page_extraction_prompt(
+            pdf_page_indices, context_text, None, include_paths=include_paths, include_title_blocks=True
+        )
+        # The prompt asks for title blocks, so this never collides with a plain group extraction
+        cache_key = self._result_cache_key(
+            cached_content, pdf_page_indices[0], prompt, media_resolution,
+            multi_page=True, include_paths=include_paths
+        )
+        
+        title_blocks: Dict[int, Dict[str, Any]] = {}
+        results: Dict[int, Any] = {}
+        try:
+            result = self._result_cache.get(cache_key) if cache_key else None
+            if result is not None:
+                logger.info("Using cached title blocks and extraction for pages %s", page_list)
+            else:
+                logger.info("Detecting title blocks and extracting pages %s with model %s", page_list, self.model_name)
+                response = await self._acall_with_retry(
+                    self.client.aio.models.generate_content,
+                    model=self.model_name,
+                    contents=self._request_contents(cached_content, prompt),
+                    config=self._extraction_config(
+                        cached_content, media_resolution, multi_page=True, include_paths=include_paths,
+                        title_blocks=True
+                    ),
+                    description=f"Title blocks and extraction of pages {page_list}",
+                    retry_if=lambda e: not self._is_input_limit_error(e)
+                )
+                
+                result = self._loads_json(response.text, _JSON_OBJECT_RE)
+                if not isinstance(result, dict) or not isinstance(result.get("pages"), list):
+                    raise ValueError("Combined response has no 'pages' array")
+                if cache_key:
+                    self._result_cache.set(cache_key, result)
+            
+            for page in result["pages"]:
+                page = self._validate_extraction(page)
+                pdf_page_index = (page.pop("pdf_page", None) or 0) - 1
+                if pdf_page_index in pdf_page_indices:
+                    results[pdf_page_index] = page
+            
+            detected = self._title_blocks_from_items(result.get("title_blocks") or [], self.TITLE_BLOCK_FIELDS)
+            for idx, info in detected.items():
+                if idx in pdf_page_indices:
+                    title_blocks[idx] = info
+                    self._cache_put(self._title_block_cache, (cached_content.name, idx, self.TITLE_BLOCK_FIELDS), info)
+        except Exception as e:
+            if not (self._is_input_limit_error(e) or isinstance(e, (ValueError, KeyError, TypeError))):
+                raise
+            logger.warning("Combined request failed for pages %s, falling back to separate calls: %s", page_list, e)
+        
+        missing_title_blocks = [idx for idx in pdf_page_indices if idx not in title_blocks]
+        if missing_title_blocks:
+            title_blocks.update(await self.detect_title_blocks_async(cached_content, missing_title_blocks))
+        
+        for idx in pdf_page_indices:
+            if idx in results:
+                continue
+            try:
+                results[idx] = await self.extract_page_async(
+                    cached_content, idx, context_text, title_blocks,
+                    media_resolution=media_resolutions.get(idx),
+                    include_paths=include_paths,
+                    to_numpy=False
+                )
+            except Exception as e:
+                results[idx] = e
+        return title_blocks, results
+    
+    def pick_media_resolution(self, processor: "PDFProcessor", pdf_page_index: int) -> str:
+        """
+        Choose the media resolution for a page from its content density.
+        
+        Sparse pages (blank, cover or notes pages) are sent at low resolution,
+        which cuts their input tokens roughly 4x; everything else uses
+        GEMINI_MEDIA_RESOLUTION. Never picks a higher tier than configured.
+        
+        Args:
+            processor: Open PDFProcessor for the schematic
+            pdf_page_index: 0-based page index
+            
+        Returns:
+            Media resolution tier (low/medium/high)
+        """
+        if not self.adaptive_media_resolution:
+            return self.media_resolution
+        
+        try:
+            ink_ratio = processor.get_ink_ratio(pdf_page_index)
+        except Exception as e:
+            logger.warning("Could not render page %d to pick a resolution: %s", pdf_page_index + 1, e)
+            return self.media_resolution
+        if ink_ratio < self.SPARSE_PAGE_INK_RATIO:
+            logger.info("Page %d is sparse (%.1f%% ink), using low resolution", pdf_page_index + 1, ink_ratio * 100)
+            return "low"
+        return self.media_resolution
+    
+    def is_blank_page(self, processor: "PDFProcessor", pdf_page_index: int) -> bool:
+        """
+        Check whether a page has too little content to be worth extracting.
+        
+        Blank covers and separator pages are skipped entirely, saving the
+        Gemini call for a cheap thumbnail render.
+        
+        Args:
+            processor: Open PDFProcessor for the schematic
+            pdf_page_index: 0-based page index
+            
+        Returns:
+            True if the page should be skipped
+        """
+        if not self.skip_blank_pages:
+            return False
+        
+        try:
+            ink_ratio = processor.get_ink_ratio(pdf_page_index)
+        except Exception as e:
+            # Let the page go to Gemini; a render failure is not a blank page
+            logger.warning("Could not render page %d for the blank check: %s", pdf_page_index + 1, e)
+            return False
+        if ink_ratio < self.BLANK_PAGE_INK_RATIO:
+            logger.info("Page %d is blank (%.2f%% ink), skipping extraction", pdf_page_index + 1, ink_ratio * 100)
+            return True
+        return False
+    
+    @staticmethod
+    def empty_extraction() -> Dict[str, Any]:
+        """Build the extraction result used for pages that are not sent to Gemini."""
+        return {"components": [], "connections": [], "wire_labels": [], "continuations": []}
+    
+    @staticmethod
+    def _request_contents(source: Any, prompt: str) -> Any:
+        """
+        Build request contents for extraction or title block detection.
+        
+        Page range uploads (see upload_page_range()) are sent alongside the
+        prompt; cached content is referenced through the generation config
+        instead (see _cached_content_name()).
+        """
+        from google.genai import types
+        if isinstance(source, types.File):
+            return [source, prompt]
+        return prompt
+    
+    @staticmethod
+    def _cached_content_name(source: Any) -> Optional[str]:
+        """Name to put in a generation config's cached_content; None for page range uploads."""
+        from google.genai import types
+        return None if isinstance(source, types.File) else source.name
+    
+    def _extraction_config(
+        self,
+        source: Any,
+        media_resolution: str,
+        multi_page: bool = False,
+        include_paths: bool = False,
+        title_blocks: bool = False,
+        batch: bool = False
+    ) -> "types.GenerateContentConfig":
+        """
+        Get generation config for page extraction.
+        
+        Configs only vary by cached content (none for page range uploads),
+        resolution and schema, so they are built once and reused across
+        pages. Batch requests carry no
+        client-side timeout, since the job runs server-side.
+        """
+        from google.genai import types
+        cached_content_name = self._cached_content_name(source)
+        key = ("extraction", cached_content_name, media_resolution, multi_page, include_paths, title_blocks, batch)
+        config = self._cache_get(self._config_cache, key)
+        if config is None:
+            config = types.GenerateContentConfig(
+                cached_content=cached_content_name,
+                temperature=self.temperature,
+                media_resolution=self.MEDIA_RESOLUTIONS[media_resolution],
+                response_mime_type="application/json",
+                response_schema=self._extraction_schema(multi_page, include_paths, title_blocks),
+                http_options=None if batch else self._request_options
+            )
+            self._cache_put(self._config_cache, key, config)
+        return config
+    
+    def _extraction_schema(
+        self,
+        multi_page: bool,
+        include_paths: bool = False,
+        title_blocks: bool = False
+    ) -> Optional["types.Schema"]:
+        """
+        Get the response schema for extraction, if enforced.
+        
+        The extraction schema is deeply nested and constrained decoding on it
+        is slow, so by default only JSON output is requested and the result is
+        checked locally by _validate_extraction().
+        """
+        from google.genai import types
+        if not self.use_response_schema:
+            return None
+        
+        # Validated into the SDK's Schema model once per variant, rather than
+        # converting the nested dict on every request
+        key = (multi_page, include_paths, title_blocks)
+        schema = self._compiled_schemas.get(key)
+        if schema is None:
+            page_schema = self.EXTRACTION_SCHEMA_WITH_PATHS if include_paths else self.EXTRACTION_SCHEMA
+            schema = self._multi_page_schema(page_schema) if multi_page else page_schema
+            if title_blocks:
+                schema = {
+                    **schema,
+                    "properties": {**schema["properties"], "title_blocks": self.TITLE_BLOCK_SCHEMA},
+                    "required": [*schema["required"], "title_blocks"]
+                }
+            schema = types.Schema.model_validate(schema)
+            GeminiService._compiled_schemas[key] = schema
+        return schema
+    
+    @staticmethod
+    def _multi_page_schema(page_schema: Dict[str, Any]) -> Dict[str, Any]:
+        """Wrap a page schema as {"pages": [...]}, each page tagged with its pdf_page."""
+        return {
+            "type": "OBJECT",
+            "properties": {
+                "pages": {
+                    "type": "ARRAY",
+                    "items": {
+                        "type": "OBJECT",
+                        "properties": {
+                            "pdf_page": {"type": "INTEGER"},
+                            **page_schema["properties"]
+                        },
+                        "required": ["pdf_page", *page_schema["required"]]
+                    }
+                }
+            },
+            "required": ["pages"]
+        }
+    
+    def _result_cache_key(
+        self,
+        source: Any,
+        pdf_page_index: int,
+        prompt: str,
+        media_resolution: str,
+        multi_page: bool = False,
+        include_paths: bool = False
+    ) -> Optional[str]:
+        """
+        Build the result cache key for an extraction request.
+        
+        The key covers everything that shapes the response: model, prompt,
+        media resolution tier, temperature and response schema variant.
+        Returns None when the PDF content digest is unknown (e.g. cached
+        content created outside this service), which disables caching.
+        """
+        digest = (
+            self._cache_get(self._content_digests, source.name)
+            or self._cache_get(self._file_digests, source.name)
+        )
+        if not digest:
+            return None
+        schema = (self.use_response_schema, multi_page, include_paths)
+        request = f"{self.model_name}\n{media_resolution}\n{self.temperature}\n{schema}\n{prompt}"
+        prompt_hash = hashlib.sha256(request.encode("utf-8")).hexdigest()[:16]
+        return f"{digest}_{pdf_page_index}_{prompt_hash}"
+    
+    def _lower_media_resolution(self, media_resolution: str) -> Optional[str]:
+        """Get the next lower media resolution tier, or None if already lowest."""
+        tiers = list(self.MEDIA_RESOLUTIONS)
+        position = tiers.index(media_resolution)
+        return tiers[position - 1] if position > 0 else None
+    
+    @staticmethod
+    def _is_input_limit_error(error: Exception) -> bool:
+        """Check whether an error was caused by oversized input (token limit or timeout)."""
+        from google.genai import errors
+        if isinstance(error, (TimeoutError, httpx.TimeoutException)):
+            return True
+        if isinstance(error, errors.APIError):
+            if error.code == 504 or error.status == "DEADLINE_EXCEEDED":
+                return True
+            return error.code == 400 and "token" in str(error.message or "").lower()
+        return False
+    
+    def _parse_extraction(self, response: Any, multi_page: bool = False) -> Dict[str, Any]:
+        """Parse and validate an extraction response into a result dictionary."""
+        # response.text re-joins all parts on every access; read it once
+        raw = response.text
+        
+        # Typed decode covers well-formed responses in one pass
+        result = decode_extraction(raw, multi_page)
+        if result is None:
+            # Fenced or loosely-typed output: parse leniently and coerce
+            result = self._loads_json(raw, _JSON_OBJECT_RE)
+            if multi_page:
+                if not isinstance(result, dict) or not isinstance(result.get("pages"), list):
+                    raise ValueError("Multi-page extraction response has no 'pages' array")
+                result["pages"] = [self._validate_extraction(page) for page in result["pages"]]
+            else:
+                result = self._validate_extraction(result)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Extraction response: %s", raw[:500])
+            logger.debug(
+                "Extraction result: %d components, %d connections",
+                len(result.get('components', [])), len(result.get('connections', []))
+            )
+        return result
+    
+    @staticmethod
+    def _loads_json(raw: str, fallback_pattern: re.Pattern) -> Any:
+        """
+        Parse JSON response text.
+        
+        If the text isn't valid JSON as a whole (e.g. wrapped in a ```json
+        fence), parse the span matched by fallback_pattern instead.
+        """
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            match = fallback_pattern.search(raw or "")
+            if not match:
+                raise
+            return orjson.loads(match.group(0))
+    
+    @staticmethod
+    def _paths_to_numpy(result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Convert connection paths to float32 arrays of shape (N, 2).
+        
+        Returns a new result dict (connections are copied) so cached and
+        shared in-flight results keep their plain JSON form. Paths that
+        aren't a list of [x, y] pairs become None.
+        """
+        connections = []
+        for conn in result.get("connections", []):
+            path = conn.get("path")
+            if path is not None and not isinstance(path, np.ndarray):
+                try:
+                    path = np.asarray(path, dtype=np.float32).reshape(-1, 2)
+                except (ValueError, TypeError):
+                    path = None
+                conn = {**conn, "path": path}
+            connections.append(conn)
+        return {**result, "connections": connections}
+    
+    def _validate_extraction(self, result: Any) -> Dict[str, Any]:
+        """
+        Check an extraction result has the expected top-level arrays.
+        
+        Missing or null arrays are coerced to [] and non-object items are
+        dropped; anything else is left for the persistence layer to read
+        with .get().
+        
+        Raises:
+            ValueError: If the result is not a JSON object or an array key
+                holds a non-array value
+        """
+        if not isinstance(result, dict):
+            raise ValueError(f"Extraction result must be a JSON object, got {type(result).__name__}")
+        
+        for key in self.EXTRACTION_ARRAY_KEYS:
+            items = result.get(key)
+            if items is None:
+                result[key] = []
+            elif not isinstance(items, list):
+                raise ValueError(f"Extraction result '{key}' must be an array, got {type(items).__name__}")
+            else:
+                result[key] = [item for item in items if isinstance(item, dict)]
+        
+        return result
+    
+    def _build_extraction_prompt(
+        self,
+        pdf_page_index: int,
+        context_text: Optional[str],
+        page_mapping: Optional[Dict[int, Dict[str, Any]]],
+        include_paths: bool = False
+    ) -> str:
+        """
+        Build extraction prompt with context.
+        
+        Everything that is the same for every page of a run comes first and
+        the page-specific part comes last, so consecutive requests share a
+        byte-identical prefix for Gemini's implicit prompt caching.
+        """
+        key = (context_text, include_paths)
+        static = self._cache_get(self._extraction_prompt_cache, key)
+        if static is None:
+            if self.use_response_schema:
+                output_format = "Return a JSON object matching the schema provided."
+            else:
+                output_format = "Return only a JSON object with this shape:\n" + self.EXTRACTION_SHAPE
+            
+            static = (
+                self._extraction_prompt_prefix(context_text)
+                + "**Task**: Extract ALL electrical components, connections, wire labels, and continuations "
+                + "from the page identified at the end of this prompt with 100% accuracy.\n\n"
+                + self._extraction_requirements(include_paths) + "\n\n"
+                + output_format + "\n\n"
+            )
+            self._cache_put(self._extraction_prompt_cache, key, static)
+        
+        prompt = static + f"**Page to analyze**: PDF page {pdf_page_index + 1}"
         
         if page_mapping and pdf_page_index in page_mapping:
             info = page_mapping[pdf_page_index]
@@ -397,32 +2854,208 @@ Only return the JSON array, nothing else."""
 - Drawing No.: {info.get('dwg_no', 'N/A')}
 - Title: {info.get('drawing_title', 'N/A')}"""
         
-        if context_text:
-            prompt += f"""
-
-**Reading instructions and legend**:
-{context_text[:2000]}  
-"""
+        return prompt
+    
+    def _build_multi_page_extraction_prompt(
+        self,
+        pdf_page_indices: List[int],
+        context_text: Optional[str],
+        page_mapping: Optional[Dict[int, Dict[str, Any]]],
+        include_paths: bool = False,
+        include_title_blocks: bool = False
+    ) -> str:
+        """Build extraction prompt covering several pages in one request (page list last)."""
+        page_list = ", ".join(str(idx + 1) for idx in pdf_page_indices)
         
-        prompt += """
-
-**Task**: Extract ALL electrical components, connections, wire labels, and continuations from this page with 100% accuracy.
-
-**Requirements**:
-1. **Components**: Every component with its mark (e.g., MCB10, SOL-1), symbol type, name, position (x, y), and dimensions if visible.
-2. **Connections**: Every wire connection between components, including wire labels, terminal designations, and path coordinates.
-3. **Wire labels**: Every wire label visible on the page with its text and position.
-4. **Continuations**: Any continuation markers (e.g., "→5", "P.12") showing connections to other pages.
-
-Extract coordinates as accurately as possible for tracing and overlay purposes.
-
-Return a JSON object matching the schema provided."""
+        output_format = (
+            'Return a JSON object with a "pages" array containing one object per listed page. '
+            'Each object has "pdf_page" (the 1-based PDF page number) plus that page\'s '
+            "components, connections, wire_labels, and continuations."
+        )
+        if not self.use_response_schema:
+            output_format += "\n\nEach page object has this shape (plus \"pdf_page\"):\n" + self.EXTRACTION_SHAPE
+        if include_title_blocks:
+            instructions, shape = self._title_block_prompt_parts(self.TITLE_BLOCK_FIELDS)
+            output_format += (
+                "\n\n**Title blocks**: Also examine the title block of each listed page (usually at the "
+                "bottom-right corner) and extract:\n" + instructions + "\n\n"
+                'Add a "title_blocks" array to the same JSON object with one object per listed page:\n'
+                "{\n" + shape + "\n}"
+            )
+        
+        prompt = (
+            self._extraction_prompt_prefix(context_text)
+            + "**Task**: For EACH page listed at the end of this prompt, extract ALL electrical components, "
+            + "connections, wire labels, and continuations with 100% accuracy. Keep each page's results "
+            + "separate; never merge items across pages.\n\n"
+            + self._extraction_requirements(include_paths) + "\n\n"
+            + output_format + "\n\n"
+            + f"**Pages to analyze**: PDF pages {page_list}"
+        )
+        
+        if page_mapping:
+            info_lines = []
+            for idx in pdf_page_indices:
+                if idx in page_mapping:
+                    info = page_mapping[idx]
+                    info_lines.append(
+                        f"- PDF page {idx + 1}: schematic page {info.get('schematic_page_number', '?')}, "
+                        f"Drawing No. {info.get('dwg_no', 'N/A')}, Title: {info.get('drawing_title', 'N/A')}"
+                    )
+            if info_lines:
+                prompt += "\n**Page info from title blocks**:\n" + "\n".join(info_lines)
         
         return prompt
     
+    def _extraction_requirements(self, include_paths: bool) -> str:
+        """Get the requirements section of extraction prompts."""
+        if include_paths:
+            return self.EXTRACTION_REQUIREMENTS + "\n" + self.PATH_REQUIREMENT
+        return self.EXTRACTION_REQUIREMENTS
+    
+    def _extraction_prompt_prefix(self, context_text: Optional[str]) -> str:
+        """Build the static start of extraction prompts, shared by every page of a run."""
+        prefix = self.EXTRACTION_PROMPT_HEADER
+        if context_text:
+            prefix += f"**Reading instructions and legend**:\n{context_text[:2000]}\n\n"
+        return prefix
+    
+    def _call_with_retry(
+        self,
+        fn: Callable[..., Any],
+        *args: Any,
+        description: str = "Gemini request",
+        retry_if: Optional[Callable[[Exception], bool]] = None,
+        **kwargs: Any
+    ) -> Any:
+        """
+        Call fn, retrying transient failures with backoff.
+        
+        Args:
+            fn: Function to call with *args and **kwargs
+            description: What is being attempted, for log messages
+            retry_if: Optional extra predicate; errors it rejects are raised
+                immediately even if otherwise retryable
+            
+        Returns:
+            Result of fn
+        """
+        for attempt in range(self.max_retries):
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_wait(e, attempt, description, retry_if)
+                if delay is None:
+                    self._forget_if_gone(e, kwargs.get("config"))
+                    raise
+                time.sleep(delay)
+        raise RuntimeError(f"{description} failed after {self.max_retries} attempts")
+    
+    async def _acall_with_retry(
+        self,
+        fn: Callable[..., Awaitable[Any]],
+        *args: Any,
+        description: str = "Gemini request",
+        retry_if: Optional[Callable[[Exception], bool]] = None,
+        **kwargs: Any
+    ) -> Any:
+        """Async version of _call_with_retry(); backoff waits don't block the event loop."""
+        for attempt in range(self.max_retries):
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_wait(e, attempt, description, retry_if)
+                if delay is None:
+                    self._forget_if_gone(e, kwargs.get("config"))
+                    raise
+                await asyncio.sleep(delay)
+        raise RuntimeError(f"{description} failed after {self.max_retries} attempts")
+    
+    def _retry_wait(
+        self,
+        error: Exception,
+        attempt: int,
+        description: str,
+        retry_if: Optional[Callable[[Exception], bool]]
+    ) -> Optional[float]:
+        """
+        Decide whether a failed attempt is retried, shared by the sync and async loops.
+        
+        Returns:
+            Seconds to wait before the next attempt, or None if the error
+            should be raised
+        """
+        if attempt >= self.max_retries - 1 or not self._is_retryable_error(error):
+            return None
+        if retry_if is not None and not retry_if(error):
+            return None
+        delay = self._retry_delay(error, attempt)
+        logger.warning(
+            "%s failed (attempt %d/%d), retrying in %.1fs: %s",
+            description, attempt + 1, self.max_retries, delay, error
+        )
+        return delay
+    
+    @staticmethod
+    def _is_retryable_error(error: Exception) -> bool:
+        """Check whether an error is transient (rate limit, server error, network, failed upload)."""
+        from google.genai import errors
+        if isinstance(error, errors.APIError):
+            return error.code in (408, 429, 500, 502, 503, 504)
+        return isinstance(error, (httpx.TransportError, TimeoutError, ConnectionError, FileProcessingError))
+    
+    @staticmethod
+    def _is_not_found_error(error: Exception) -> bool:
+        """Check whether an error means the uploaded file or cached content no longer exists."""
+        from google.genai import errors
+        # The Files API answers 403 rather than 404 for files that were deleted
+        return isinstance(error, errors.APIError) and error.code in (403, 404)
+    
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        """
+        Get the wait before the next attempt.
+        
+        Rate limit errors use the server's hint when there is one: the
+        Retry-After header, or the RetryInfo retryDelay in the error body.
+        Everything else uses jittered backoff.
+        """
+        from google.genai import errors
+        if isinstance(error, errors.APIError) and error.code == 429:
+            hint = self._server_retry_delay(error)
+            if hint is not None:
+                return min(hint, Config.RETRY_MAX_DELAY)
+        return self._calculate_backoff(attempt)
+    
+    @staticmethod
+    def _server_retry_delay(error: "errors.APIError") -> Optional[float]:
+        """Read the server-suggested retry delay (seconds) from a rate limit error, if any."""
+        headers = getattr(error.response, "headers", None) or {}
+        retry_after = headers.get("retry-after") or headers.get("Retry-After")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        
+        # google.rpc.RetryInfo, e.g. {"@type": ".../google.rpc.RetryInfo", "retryDelay": "37s"}
+        body = error.details if isinstance(error.details, dict) else {}
+        body = body.get("error", body)
+        for detail in body.get("details") or []:
+            if isinstance(detail, dict) and str(detail.get("@type", "")).endswith("RetryInfo"):
+                try:
+                    return float(str(detail.get("retryDelay", "")).rstrip("s"))
+                except ValueError:
+                    pass
+        return None
+    
     def _calculate_backoff(self, attempt: int) -> float:
-        """Calculate exponential backoff delay."""
+        """
+        Calculate exponential backoff delay with full jitter.
+        
+        The delay is drawn uniformly from [0, base * 2^attempt], capped at
+        RETRY_MAX_DELAY, so concurrent workers that failed together don't
+        retry in lockstep.
+        """
         base_delay = Config.RETRY_BASE_DELAY
         max_delay = Config.RETRY_MAX_DELAY
-        delay = min(base_delay * (2 ** attempt), max_delay)
-        return delay
+        return random.uniform(0, min(base_delay * (2 ** attempt), max_delay))
@@ -0,0 +1,78 @@
+"""
+Cache of rendered component overlays.
+Kept apart from OverlayService so that invalidating it doesn't load PyMuPDF.
+"""
+import threading
+from itertools import chain
+from typing import Any, Hashable, Optional
+
+from cachetools import LRUCache
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import Component, Connection, WireLabel
+
+# Rendered overlays, shared by all OverlayService instances (routes create one
+# per request). Keys start with the schematic file id. Per process: with
+# several workers, each keeps (and invalidates) its own copy.
+OVERLAY_CACHE_SIZE = 64
+_overlay_cache: LRUCache = LRUCache(maxsize=OVERLAY_CACHE_SIZE)
+_overlay_cache_lock = threading.Lock()
+
+# session.info key for file ids whose extracted rows changed in the open transaction
+_PENDING_KEY = "overlay_invalidations"
+
+
+def get_overlay(key: Hashable) -> Optional[bytes]:
+    """Get a cached overlay PDF, or None."""
+    with _overlay_cache_lock:
+        return _overlay_cache.get(key)
+
+
+def put_overlay(key: Hashable, pdf_bytes: bytes) -> None:
+    """Cache a rendered overlay PDF."""
+    with _overlay_cache_lock:
+        _overlay_cache[key] = pdf_bytes
+
+
+def invalidate_overlays(schematic_file_id: int) -> None:
+    """
+    Drop cached overlays for a schematic file after its extracted data changes.
+    
+    Called automatically when a session that inserted, updated or deleted
+    extracted rows commits. Bulk Query.delete()/update() bypass those events, so callers
+    using them must invalidate explicitly. Only this process's cache is
+    cleared.
+    """
+    with _overlay_cache_lock:
+        for key in [key for key in _overlay_cache if key[0] == schematic_file_id]:
+            _overlay_cache.pop(key, None)
+
+
+def _collect_changed_files(session: Session, flush_context: Any) -> None:
+    """
+    SQLAlchemy hook: note files whose extracted rows this flush wrote.
+    
+    Overlays are only dropped once the transaction commits; invalidating at
+    flush would let a concurrent request re-cache the old data before
+    commit, and would drop overlays for changes that are rolled back.
+    """
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, (Component, Connection, WireLabel)):
+            session.info.setdefault(_PENDING_KEY, set()).add(obj.schematic_file_id)
+
+
+def _invalidate_committed(session: Session) -> None:
+    """SQLAlchemy hook: the changes noted at flush are now visible to other sessions."""
+    for schematic_file_id in session.info.pop(_PENDING_KEY, ()):
+        invalidate_overlays(schematic_file_id)
+
+
+def _discard_rolled_back(session: Session) -> None:
+    """SQLAlchemy hook: the changes noted at flush never happened."""
+    session.info.pop(_PENDING_KEY, None)
+
+
+event.listen(Session, "after_flush", _collect_changed_files)
+event.listen(Session, "after_commit", _invalidate_committed)
+event.listen(Session, "after_rollback", _discard_rolled_back)
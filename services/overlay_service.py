@@ -2,15 +2,22 @@
 Overlay Service for PDF highlighting.
 Generates PDF overlays for component/connection visualization.
 """
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
 from typing import Optional, List, Tuple
-import io
+import threading
 
 import fitz  # PyMuPDF
+import numpy as np
 
-from sqlalchemy.orm import Session
+from cachetools import LRUCache
+from sqlalchemy.orm import Session, joinedload
 
 from models import Component, Connection, WireLabel, SchematicPage
+from .overlay_cache import get_overlay, put_overlay, invalidate_overlays
 
 
 class OverlayColors:
@@ -40,6 +47,19 @@ class OverlayService:
     # Padding around highlighted elements (in points)
     PADDING = 2.0
     
+    # Raw bytes of recently used PDFs, bounded by total size
+    PDF_BYTES_CACHE_SIZE = 256 * 1024 * 1024
+    _pdf_bytes_cache: LRUCache = LRUCache(maxsize=PDF_BYTES_CACHE_SIZE, getsizeof=len)
+    _pdf_bytes_cache_lock = threading.Lock()
+    
+    # Multi-page renders smaller than this stay in-process. Starting a
+    # worker takes close to a second; a page renders in a fraction of that.
+    PARALLEL_RENDER_MIN_PAGES = 16
+    
+    # Wire label text widths in points, shared by all instances
+    _label_widths: LRUCache = LRUCache(maxsize=4096)
+    _label_widths_lock = threading.Lock()
+    
     def __init__(self, db: Session):
         """Initialize overlay service."""
         self.db = db
@@ -64,7 +84,42 @@ class OverlayService:
             PDF bytes with overlay
         """
         pdf_path = Path(pdf_path)
-        doc = fitz.open(pdf_path)
+        
+        # Keyed by file identity so a replaced PDF is never served stale
+        stat = pdf_path.stat()
+        cache_key = (
+            component.schematic_file_id, str(pdf_path.resolve()), stat.st_mtime_ns, stat.st_size,
+            component.id, include_connections, include_wire_labels
+        )
+        cached = get_overlay(cache_key)
+        if cached is not None:
+            return cached
+        
+        pdf_bytes = self._render_component_overlay(
+            pdf_path, component, include_connections, include_wire_labels
+        )
+        put_overlay(cache_key, pdf_bytes)
+        return pdf_bytes
+    
+    @staticmethod
+    def invalidate(schematic_file_id: int) -> None:
+        """
+        Drop cached overlays for a schematic file after its extracted data changes.
+        
+        See overlay_cache.invalidate_overlays(), which callers that don't
+        otherwise need PyMuPDF should use directly.
+        """
+        invalidate_overlays(schematic_file_id)
+    
+    def _render_component_overlay(
+        self,
+        pdf_path: Path,
+        component: Component,
+        include_connections: bool,
+        include_wire_labels: bool
+    ) -> bytes:
+        """Draw a component overlay (see create_component_overlay())."""
+        doc = self._open(pdf_path)
         
         try:
             page = doc[component.pdf_page_index]
@@ -81,36 +136,36 @@ class OverlayService:
                 )
             
             if include_connections:
-                # Find and highlight connected components
-                connections = self._get_component_connections(component)
-                connected_components = set()
+                # Find and highlight connected components; only wires drawn on this page matter
+                connections = self._get_component_connections(
+                    component, same_page_only=True, load_components=True
+                )
+                connected_components = {}
+                paths = []
                 
                 for conn in connections:
-                    if conn.from_component_id and conn.from_component_id != component.id:
-                        connected_components.add(conn.from_component_id)
-                    if conn.to_component_id and conn.to_component_id != component.id:
-                        connected_components.add(conn.to_component_id)
+                    for other in (conn.from_component, conn.to_component):
+                        if other is not None and other.id != component.id:
+                            connected_components[other.id] = other
                     
-                    # Draw connection path
-                    if conn.path_coordinates and conn.pdf_page_index == component.pdf_page_index:
-                        self._draw_connection_path(
+                    if conn.path_coordinates:
+                        paths.append(conn.path_coordinates)
+                
+                # Draw connection paths
+                self._draw_connection_paths(page=page, paths=paths, page_height=page_height)
+                
+                # Highlight connected components on the same page
+                for connected in connected_components.values():
+                    if connected.pdf_page_index != component.pdf_page_index:
+                        continue
+                    if connected.x is not None and connected.y is not None:
+                        self._draw_component_highlight(
                             page=page,
-                            path=conn.path_coordinates,
-                            page_height=page_height
+                            component=connected,
+                            page_height=page_height,
+                            color=OverlayColors.CONNECTED_COMPONENT,
+                            fill_color=OverlayColors.CONNECTED_FILL
                         )
-                
-                # Highlight connected components
-                for comp_id in connected_components:
-                    connected = self.db.query(Component).get(comp_id)
-                    if connected and connected.pdf_page_index == component.pdf_page_index:
-                        if connected.x is not None and connected.y is not None:
-                            self._draw_component_highlight(
-                                page=page,
-                                component=connected,
-                                page_height=page_height,
-                                color=OverlayColors.CONNECTED_COMPONENT,
-                                fill_color=OverlayColors.CONNECTED_FILL
-                            )
             
             if include_wire_labels:
                 # Find related wire labels
@@ -123,10 +178,9 @@ class OverlayService:
                             page_height=page_height
                         )
             
-            # Save to bytes
-            output = io.BytesIO()
-            doc.save(output)
-            return output.getvalue()
+            # Save to bytes; only the new overlay streams need compressing, and
+            # skipping garbage collection leaves the original objects untouched
+            return doc.tobytes(garbage=0, deflate=True)
             
         finally:
             doc.close()
@@ -151,18 +205,23 @@ class OverlayService:
             PDF bytes with overlay
         """
         pdf_path = Path(pdf_path)
-        doc = fitz.open(pdf_path)
+        doc = self._open(pdf_path)
         
         try:
             page = doc[pdf_page_index]
             page_height = page.rect.height
             
             if highlight_all:
-                # Get all components on this page
-                components = self.db.query(Component).filter_by(
-                    schematic_file_id=schematic_file_id,
-                    pdf_page_index=pdf_page_index
-                ).all()
+                # Read-only: fetch components and wire labels without autoflushing the session
+                with self.db.no_autoflush:
+                    components = self.db.query(Component).filter_by(
+                        schematic_file_id=schematic_file_id,
+                        pdf_page_index=pdf_page_index
+                    ).all()
+                    wire_labels = self.db.query(WireLabel).filter_by(
+                        schematic_file_id=schematic_file_id,
+                        pdf_page_index=pdf_page_index
+                    ).all()
                 
                 for comp in components:
                     if comp.x is not None and comp.y is not None:
@@ -174,12 +233,6 @@ class OverlayService:
                             fill_color=OverlayColors.SELECTED_FILL
                         )
                 
-                # Get all wire labels
-                wire_labels = self.db.query(WireLabel).filter_by(
-                    schematic_file_id=schematic_file_id,
-                    pdf_page_index=pdf_page_index
-                ).all()
-                
                 for wl in wire_labels:
                     self._draw_wire_label_highlight(
                         page=page,
@@ -187,13 +240,35 @@ class OverlayService:
                         page_height=page_height
                     )
             
-            output = io.BytesIO()
-            doc.save(output)
-            return output.getvalue()
+            return doc.tobytes(garbage=0, deflate=True)
             
         finally:
             doc.close()
     
+    def _open(self, pdf_path: Path) -> fitz.Document:
+        """
+        Open a PDF from the in-memory bytes cache.
+        
+        Hot PDFs are parsed from memory instead of being re-read from disk on
+        every request. Entries are keyed by file identity, so a replaced file
+        is read afresh.
+        """
+        return fitz.open(stream=self._read_pdf_bytes(pdf_path), filetype="pdf")
+    
+    def _read_pdf_bytes(self, pdf_path: Path) -> bytes:
+        """Get a PDF's bytes, from the in-memory cache when its file is unchanged."""
+        pdf_path = Path(pdf_path)
+        stat = pdf_path.stat()
+        key = (str(pdf_path.resolve()), stat.st_mtime_ns, stat.st_size)
+        with self._pdf_bytes_cache_lock:
+            data = self._pdf_bytes_cache.get(key)
+        if data is None:
+            data = pdf_path.read_bytes()
+            if len(data) <= self.PDF_BYTES_CACHE_SIZE:
+                with self._pdf_bytes_cache_lock:
+                    self._pdf_bytes_cache[key] = data
+        return data
+    
     def _draw_component_highlight(
         self,
         page: fitz.Page,
@@ -244,8 +319,8 @@ class OverlayService:
         if wire_label.x is None or wire_label.y is None:
             return
         
-        # Approximate label size
-        label_width = len(wire_label.label) * 6 + 4  # Rough estimate
+        # Label size from the text width in Helvetica 10pt, plus padding
+        label_width = self._label_width(wire_label.label) + 4
         label_height = 12
         
         rect = fitz.Rect(
@@ -257,35 +332,64 @@ class OverlayService:
         
         page.draw_rect(rect, color=OverlayColors.WIRE_LABEL, width=1.0)
     
-    def _draw_connection_path(
+    @classmethod
+    def _label_width(cls, label: str) -> float:
+        """Get the rendered width of a wire label, measured once per distinct label."""
+        # LRUCache reorders entries on every read, so reads need the lock too
+        with cls._label_widths_lock:
+            width = cls._label_widths.get(label)
+        if width is None:
+            width = fitz.get_text_length(label, fontname="helv", fontsize=10)
+            with cls._label_widths_lock:
+                cls._label_widths[label] = width
+        return width
+    
+    def _draw_connection_paths(
         self,
         page: fitz.Page,
-        path: List[List[float]],
+        paths: List[List[List[float]]],
         page_height: float
     ):
-        """Draw a connection path (wire)."""
-        if not path or len(path) < 2:
-            return
-        
-        # Convert path points
-        points = []
-        for point in path:
-            if len(point) >= 2:
-                x, y = point[0], point[1]
-                points.append(fitz.Point(x, y))
-        
-        if len(points) < 2:
-            return
+        """Draw connection paths (wires) as one shape, committed once."""
+        shape = None
+        for path in paths:
+            if not path or len(path) < 2:
+                continue
+            
+            # Convert path points; malformed points are dropped
+            try:
+                pts = np.asarray(path, dtype=np.float64)
+            except (ValueError, TypeError):
+                pts = np.asarray([point[:2] for point in path if len(point) >= 2], dtype=np.float64)
+            if pts.ndim != 2 or pts.shape[1] < 2 or len(pts) < 2:
+                continue
+            
+            if shape is None:
+                shape = page.new_shape()
+            shape.draw_polyline([fitz.Point(x, y) for x, y in pts[:, :2].tolist()])
+            shape.finish(color=OverlayColors.CONNECTION_PATH, width=2.0)
         
-        # Draw polyline
-        shape = page.new_shape()
-        shape.draw_polyline(points)
-        shape.finish(color=OverlayColors.CONNECTION_PATH, width=2.0)
-        shape.commit()
+        if shape is not None:
+            shape.commit()
     
-    def _get_component_connections(self, component: Component) -> List[Connection]:
-        """Get all connections involving a component."""
-        connections = self.db.query(Connection).filter(
+    def _get_component_connections(
+        self,
+        component: Component,
+        same_page_only: bool = False,
+        load_components: bool = False
+    ) -> List[Connection]:
+        """
+        Get all connections involving a component.
+        
+        Args:
+            component: Component to find connections for
+            same_page_only: Only return connections on the component's page
+            load_components: Load both endpoint components in the same query
+            
+        Returns:
+            Matching connections
+        """
+        query = self.db.query(Connection).filter(
             (Connection.schematic_file_id == component.schematic_file_id) &
             (
                 (Connection.from_component_id == component.id) |
@@ -293,13 +397,20 @@ class OverlayService:
                 (Connection.from_component_mark == component.mark) |
                 (Connection.to_component_mark == component.mark)
             )
-        ).all()
+        )
+        if same_page_only:
+            query = query.filter(Connection.pdf_page_index == component.pdf_page_index)
+        if load_components:
+            query = query.options(
+                joinedload(Connection.from_component),
+                joinedload(Connection.to_component)
+            )
         
-        return connections
+        return query.all()
     
     def _get_related_wire_labels(self, component: Component) -> List[WireLabel]:
         """Get wire labels connected to a component."""
-        # Get connections for this component
+        # Get connections for this component (any page: labels can name cross-page wires)
         connections = self._get_component_connections(component)
         
         # Get wire label texts
@@ -336,12 +447,67 @@ class OverlayService:
         Returns:
             PNG image bytes
         """
-        doc = fitz.open(pdf_path)
+        doc = self._open(pdf_path)
         try:
-            page = doc[pdf_page_index]
-            mat = fitz.Matrix(zoom, zoom)
-            pix = page.get_pixmap(matrix=mat)
-            return pix.tobytes("png")
+            return _render_pngs(doc, [pdf_page_index], zoom)[0]
         finally:
             doc.close()
+    
+    def render_page_images(
+        self,
+        pdf_path: Path,
+        pdf_page_indices: List[int],
+        zoom: float = 2.0
+    ) -> List[bytes]:
+        """
+        Render several pages as PNG images, in worker processes for larger requests.
+        
+        A PyMuPDF document can't be shared across threads, so pages are
+        split into contiguous shards rendered by spawned worker processes,
+        each opening its own copy of the file. Spawned rather than forked,
+        since the web server runs other threads.
+        
+        Args:
+            pdf_path: Path to PDF
+            pdf_page_indices: Pages to render
+            zoom: Zoom factor
+            
+        Returns:
+            PNG image bytes per page, in the order given
+        """
+        workers = min(os.cpu_count() or 1, len(pdf_page_indices))
+        if len(pdf_page_indices) < self.PARALLEL_RENDER_MIN_PAGES or workers < 2:
+            doc = self._open(pdf_path)
+            try:
+                return _render_pngs(doc, pdf_page_indices, zoom)
+            finally:
+                doc.close()
+        
+        shard_size = -(-len(pdf_page_indices) // workers)
+        shards = [
+            pdf_page_indices[i:i + shard_size]
+            for i in range(0, len(pdf_page_indices), shard_size)
+        ]
+        with ProcessPoolExecutor(max_workers=len(shards), mp_context=multiprocessing.get_context("spawn")) as pool:
+            results = pool.map(_render_shard, repeat(str(pdf_path)), shards, repeat(zoom))
+            return [png for shard_pngs in results for png in shard_pngs]
+
+
+def _render_pngs(doc: fitz.Document, pdf_page_indices: List[int], zoom: float) -> List[bytes]:
+    """Render pages of an open document as PNGs."""
+    mat = fitz.Matrix(zoom, zoom)
+    # Opaque RGB: no alpha channel to allocate or PNG-encode
+    return [
+        doc[idx].get_pixmap(matrix=mat, alpha=False, colorspace=fitz.csRGB).tobytes("png")
+        for idx in pdf_page_indices
+    ]
+
+
+def _render_shard(pdf_path: str, pdf_page_indices: List[int], zoom: float) -> List[bytes]:
+    """Render one shard of pages (module-level so worker processes can run it)."""
+    doc = fitz.open(pdf_path)
+    try:
+        return _render_pngs(doc, pdf_page_indices, zoom)
+    finally:
+        doc.close()
 
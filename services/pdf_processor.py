@@ -3,12 +3,23 @@ PDF Processor Service for schematic extraction.
 Handles PDF manipulation, page extraction, and coordinate conversion.
 """
 import re
+import os
+import mmap
 import hashlib
+import logging
+import weakref
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Optional, Dict, List, Tuple, Any
 
 import fitz  # PyMuPDF
+import numpy as np
 import pdfplumber
+from cachetools import LRUCache
+
+logger = logging.getLogger(__name__)
 
 
 class PDFProcessor:
@@ -26,14 +37,59 @@ class PDFProcessor:
     # Also matches full-width Japanese numerals (１/２０７)
     PAGE_NUMBER_PATTERN = re.compile(r'([0-9０-９]+)\s*[/／]\s*([0-9０-９]+)')
     
+    # Digits the pattern accepts, for the single-slash fast path
+    PAGE_NUMBER_DIGITS = frozenset('0123456789０１２３４５６７８９')
+    
+    # Files at least this large are hashed through mmap instead of reads
+    MMAP_HASH_MIN_SIZE = 16 << 20
+    
+    # Digests shared by every processor in the process, so a fresh
+    # processor for an unchanged file doesn't re-read it
+    _hash_cache: LRUCache = LRUCache(maxsize=256)  # (path, mtime_ns, size) -> SHA-256
+    _hash_cache_lock = threading.Lock()
+    
+    # Page number detection over fewer pages than this stays in-process.
+    # Spawning a worker (and importing PyMuPDF in it) takes close to a
+    # second, while PyMuPDF reads a title block in a few milliseconds.
+    PARALLEL_DETECT_MIN_PAGES = 256
+    
     # Full-width to half-width digit mapping
     FULLWIDTH_DIGITS = str.maketrans('０１２３４５６７８９', '0123456789')
     
     @classmethod
     def _fullwidth_to_int(cls, s: str) -> int:
         """Convert a string with full-width digits to an integer."""
+        if s.isascii():  # Common case, nothing to translate
+            return int(s)
         return int(s.translate(cls.FULLWIDTH_DIGITS))
     
+    @classmethod
+    def _last_page_number_match(cls, text: str) -> Optional[Tuple[str, str]]:
+        """
+        Find the last "X/Y" page number in text.
+        
+        Title blocks usually hold a single ASCII slash with digits on both
+        sides; that case is scanned directly. Anything else (full-width
+        slash, spaces, several slashes) goes through PAGE_NUMBER_PATTERN.
+        
+        Returns:
+            Tuple of (page, total) digit strings, or None if not found
+        """
+        if "／" not in text and text.count("/") == 1:
+            slash = text.index("/")
+            digits = cls.PAGE_NUMBER_DIGITS
+            start = slash
+            while start > 0 and text[start - 1] in digits:
+                start -= 1
+            end = slash + 1
+            while end < len(text) and text[end] in digits:
+                end += 1
+            if start < slash and end > slash + 1:
+                return text[start:slash], text[slash + 1:end]
+        
+        matches = cls.PAGE_NUMBER_PATTERN.findall(text)
+        return matches[-1] if matches else None
+    
     def __init__(self, pdf_path: Path):
         """
         Initialize PDF processor with a PDF file.
@@ -46,7 +102,10 @@ class PDFProcessor:
             raise FileNotFoundError(f"PDF not found: {self.pdf_path}")
         
         self._doc: Optional[fitz.Document] = None
+        self._lazy_doc: Optional[fitz.Document] = None  # Opened on first use outside the context manager
         self._plumber: Optional[pdfplumber.PDF] = None
+        self._ink_ratios: Dict[Tuple[int, int, int], float] = {}  # (page, dpi, threshold) -> ink ratio
+        self._dim_cache: Dict[int, Tuple[float, float]] = {}  # page -> (width, height)
     
     def __enter__(self):
         """Context manager entry."""
@@ -60,20 +119,67 @@ class PDFProcessor:
             self._doc.close()
         if self._plumber:
             self._plumber.close()
+        self.close()
+    
+    @property
+    def _document(self) -> fitz.Document:
+        """
+        Open PyMuPDF document.
+        
+        Inside the context manager this is its document; otherwise one is
+        opened on first use and kept, so repeated calls don't reparse the
+        xref. The kept document is closed by close() or when the
+        processor is garbage collected.
+        """
+        if self._doc:
+            return self._doc
+        if self._lazy_doc is None:
+            self._lazy_doc = fitz.open(self.pdf_path)
+            self._lazy_doc_finalizer = weakref.finalize(self, self._lazy_doc.close)
+        return self._lazy_doc
+    
+    def close(self) -> None:
+        """Close the lazily opened document, if any."""
+        if self._lazy_doc is not None:
+            self._lazy_doc_finalizer()  # Runs at most once, so GC won't close it again
+            self._lazy_doc = None
     
     @property
     def page_count(self) -> int:
         """Get total number of pages in PDF."""
-        if self._doc:
-            return len(self._doc)
-        with fitz.open(self.pdf_path) as doc:
-            return len(doc)
+        return len(self._document)
     
     def get_file_hash(self) -> str:
-        """Calculate SHA-256 hash of the PDF file."""
-        sha256 = hashlib.sha256()
-        with open(self.pdf_path, "rb") as f:
-            for chunk in iter(lambda: f.read(8192), b""):
+        """
+        Calculate SHA-256 hash of the PDF file.
+        
+        Digests are memoized process-wide by path, modification time and
+        size, so only a changed file is hashed again.
+        """
+        stat = self.pdf_path.stat()
+        key = (str(self.pdf_path.resolve()), stat.st_mtime_ns, stat.st_size)
+        with self._hash_cache_lock:
+            digest = self._hash_cache.get(key)
+        if digest is None:
+            digest = self._compute_file_hash()
+            with self._hash_cache_lock:
+                self._hash_cache[key] = digest
+        return digest
+    
+    def _compute_file_hash(self) -> str:
+        """Hash the PDF file contents."""
+        # Unbuffered: reads go straight into the hash buffer with no extra copy
+        with open(self.pdf_path, "rb", buffering=0) as f:
+            # Large files: hash the mapped pages directly, no userland copy
+            if os.fstat(f.fileno()).st_size >= self.MMAP_HASH_MIN_SIZE:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    if hasattr(mmap, "MADV_SEQUENTIAL"):  # Not on Windows
+                        mm.madvise(mmap.MADV_SEQUENTIAL)
+                    return hashlib.sha256(mm).hexdigest()
+            if hasattr(hashlib, "file_digest"):  # Python 3.11+
+                return hashlib.file_digest(f, "sha256").hexdigest()
+            sha256 = hashlib.sha256()
+            for chunk in iter(lambda: f.read(1 << 20), b""):
                 sha256.update(chunk)
         return sha256.hexdigest()
     
@@ -87,15 +193,11 @@ class PDFProcessor:
         Returns:
             Tuple of (width, height) in points
         """
-        if self._doc:
-            page = self._doc[page_index]
-            rect = page.rect
-            return (rect.width, rect.height)
-        
-        with fitz.open(self.pdf_path) as doc:
-            page = doc[page_index]
-            rect = page.rect
-            return (rect.width, rect.height)
+        dims = self._dim_cache.get(page_index)
+        if dims is None:
+            rect = self._document[page_index].rect
+            dims = self._dim_cache[page_index] = (rect.width, rect.height)
+        return dims
     
     def extract_pages(
         self,
@@ -115,20 +217,49 @@ class PDFProcessor:
         output_path = Path(output_path)
         output_path.parent.mkdir(parents=True, exist_ok=True)
         
-        with fitz.open(self.pdf_path) as src_doc:
-            new_doc = fitz.open()
-            
-            for idx in page_indices:
-                if 0 <= idx < len(src_doc):
-                    new_doc.insert_pdf(src_doc, from_page=idx, to_page=idx)
-                else:
-                    raise IndexError(f"Page index {idx} out of range (0-{len(src_doc)-1})")
-            
+        with self._build_subset(page_indices) as new_doc:
             new_doc.save(str(output_path))
-            new_doc.close()
         
         return output_path
     
+    def extract_pages_to_bytes(self, page_indices: List[int]) -> bytes:
+        """
+        Extract specific pages to an in-memory PDF.
+        
+        Args:
+            page_indices: List of 0-based page indices to extract
+            
+        Returns:
+            PDF file contents
+        """
+        with self._build_subset(page_indices) as new_doc:
+            return new_doc.tobytes(garbage=3, deflate=True)
+    
+    def _build_subset(self, page_indices: List[int]) -> fitz.Document:
+        """Build a new document containing only the given pages."""
+        src_doc = self._document
+        for idx in page_indices:
+            if not 0 <= idx < len(src_doc):
+                raise IndexError(f"Page index {idx} out of range (0-{len(src_doc)-1})")
+        
+        # Coalesce ascending runs so each insert_pdf copies a whole range;
+        # caller order is kept
+        runs: List[List[int]] = []
+        for idx in page_indices:
+            if runs and idx == runs[-1][1] + 1:
+                runs[-1][1] = idx
+            else:
+                runs.append([idx, idx])
+        
+        new_doc = fitz.open()
+        try:
+            for first, last in runs:
+                new_doc.insert_pdf(src_doc, from_page=first, to_page=last)
+        except Exception:
+            new_doc.close()
+            raise
+        return new_doc
+    
     def detect_schematic_page_number(self, page_index: int) -> Optional[int]:
         """
         Detect schematic page number from title block.
@@ -141,49 +272,34 @@ class PDFProcessor:
         Returns:
             Schematic page number or None if not detected
         """
-        if self._plumber:
-            page = self._plumber.pages[page_index]
-        else:
-            with pdfplumber.open(self.pdf_path) as pdf:
-                page = pdf.pages[page_index]
-                return self._detect_page_number_from_page(page)
-        
-        return self._detect_page_number_from_page(page)
+        return self._detect_page_number_from_page(self._document[page_index])
     
-    def _detect_page_number_from_page(self, page) -> Optional[int]:
-        """Extract page number from a pdfplumber page object."""
-        import logging
-        logger = logging.getLogger(__name__)
-        
-        # Get page dimensions
-        width = page.width
-        height = page.height
+    def _detect_page_number_from_page(self, page: fitz.Page) -> Optional[int]:
+        """Extract page number from a PyMuPDF page object."""
+        rect = page.rect
         
         # Focus on bottom-right quadrant (title block area)
         # Expand area to be more forgiving - last 50% width, last 25% height
-        crop_box = (
-            width * 0.5,   # left
-            height * 0.75,  # top
-            width,          # right
-            height          # bottom
+        # PyMuPDF's origin is top-left, same as pdfplumber's
+        clip = fitz.Rect(
+            rect.x0 + rect.width * 0.5,    # left
+            rect.y0 + rect.height * 0.75,  # top
+            rect.x1,                       # right
+            rect.y1                        # bottom
         )
         
-        try:
-            cropped = page.within_bbox(crop_box)
-            text = cropped.extract_text() or ""
+        text = page.get_text("text", clip=clip)
+        if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f"Title block text extracted: {text[:200] if text else 'None'}")
-        except Exception as e:
-            logger.warning(f"Crop failed: {e}, using full page")
-            # Fallback to full page
-            text = page.extract_text() or ""
         
         # Find page number pattern (e.g., "1/207", "25/207")
-        matches = self.PAGE_NUMBER_PATTERN.findall(text)
-        logger.debug(f"Page number matches: {matches}")
+        # The last match is most likely to be the page number
+        match = self._last_page_number_match(text)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Page number match: {match}")
         
-        if matches:
-            # Take the last match (most likely to be the page number)
-            page_num, total = matches[-1]
+        if match:
+            page_num, total = match
             # Convert full-width numbers to regular integers
             page_num_int = self._fullwidth_to_int(page_num)
             total_int = self._fullwidth_to_int(total)
@@ -191,11 +307,11 @@ class PDFProcessor:
             return page_num_int
         
         # Also try looking in full page if not found
-        if not matches:
-            full_text = page.extract_text() or ""
-            all_matches = self.PAGE_NUMBER_PATTERN.findall(full_text)
-            if all_matches:
-                page_num, total = all_matches[-1]
+        if not match:
+            full_text = page.get_text("text")
+            full_match = self._last_page_number_match(full_text)
+            if full_match:
+                page_num, total = full_match
                 page_num_int = self._fullwidth_to_int(page_num)
                 total_int = self._fullwidth_to_int(total)
                 logger.info(f"Detected schematic page from full text: {page_num_int}/{total_int}")
@@ -220,22 +336,51 @@ class PDFProcessor:
         if page_indices is None:
             page_indices = list(range(self.page_count))
         
-        result = {}
+        doc = self._document
+        return {
+            idx: self._detect_page_number_from_page(doc[idx]) if 0 <= idx < len(doc) else None
+            for idx in page_indices
+        }
+    
+    def detect_all_page_numbers_parallel(
+        self,
+        page_indices: Optional[List[int]] = None,
+        workers: Optional[int] = None
+    ) -> Dict[int, Optional[int]]:
+        """
+        Detect schematic page numbers for multiple pages across worker processes.
         
-        if self._plumber:
-            for idx in page_indices:
-                if 0 <= idx < len(self._plumber.pages):
-                    result[idx] = self._detect_page_number_from_page(self._plumber.pages[idx])
-                else:
-                    result[idx] = None
-        else:
-            with pdfplumber.open(self.pdf_path) as pdf:
-                for idx in page_indices:
-                    if 0 <= idx < len(pdf.pages):
-                        result[idx] = self._detect_page_number_from_page(pdf.pages[idx])
-                    else:
-                        result[idx] = None
+        Text extraction holds the GIL, so pages are split into contiguous
+        shards, each handled by a worker process that opens its own copy of
+        the PDF. Workers are spawned rather than forked: callers run in a
+        threaded web server, and forking while other threads hold locks can
+        deadlock the child. Short page lists, or a single worker, stay
+        in-process.
         
+        Args:
+            page_indices: List of pages to check. None = all pages.
+            workers: Number of worker processes (defaults to CPU count)
+            
+        Returns:
+            Dict mapping pdf_page_index -> schematic_page_number (or None)
+        """
+        if page_indices is None:
+            page_indices = list(range(self.page_count))
+        
+        workers = min(workers or os.cpu_count() or 1, len(page_indices))
+        if len(page_indices) < self.PARALLEL_DETECT_MIN_PAGES or workers < 2:
+            return self.detect_all_page_numbers(page_indices)
+        
+        shard_size = -(-len(page_indices) // workers)
+        shards = [
+            page_indices[i:i + shard_size]
+            for i in range(0, len(page_indices), shard_size)
+        ]
+        
+        result = {}
+        with ProcessPoolExecutor(max_workers=len(shards), mp_context=multiprocessing.get_context("spawn")) as pool:
+            for shard_result in pool.map(_detect_shard, [str(self.pdf_path)] * len(shards), shards):
+                result.update(shard_result)
         return result
     
     def extract_text_from_page(self, page_index: int) -> str:
@@ -250,11 +395,14 @@ class PDFProcessor:
         """
         if self._plumber:
             page = self._plumber.pages[page_index]
-            return page.extract_text() or ""
+            text = page.extract_text() or ""
+            # The shared pages list keeps every page; drop this one's parsed layout
+            page.flush_cache()
+            return text
         
-        with pdfplumber.open(self.pdf_path) as pdf:
-            page = pdf.pages[page_index]
-            return page.extract_text() or ""
+        # Parse only the requested page (pdfplumber page numbers are 1-based)
+        with pdfplumber.open(self.pdf_path, pages=[page_index + 1]) as pdf:
+            return pdf.pages[0].extract_text() or ""
     
     def extract_context_pages_text(
         self,
@@ -333,29 +481,65 @@ class PDFProcessor:
     def render_page_as_image(
         self,
         page_index: int,
-        zoom: float = 2.0
+        zoom: float = 2.0,
+        colorspace: fitz.Colorspace = fitz.csRGB,
+        fmt: str = "png",
+        dpi: Optional[int] = None
     ) -> bytes:
         """
-        Render a page as PNG image bytes.
+        Render a page as image bytes.
         
         Args:
             page_index: 0-based page index
             zoom: Zoom factor for resolution
+            colorspace: Pixmap colorspace; fitz.csGRAY stores a third of
+                the bytes of RGB and suits monochrome line art
+            fmt: Output format, "png" or "jpg"
+            dpi: Resolution in dots per inch, used instead of zoom if given
             
         Returns:
-            PNG image as bytes
+            Encoded image as bytes
         """
-        if self._doc:
-            page = self._doc[page_index]
+        page = self._document[page_index]
+        
+        # Opaque: no alpha channel to allocate or encode
+        if dpi is not None:
+            pix = page.get_pixmap(dpi=dpi, alpha=False, colorspace=colorspace)
         else:
-            doc = fitz.open(self.pdf_path)
-            page = doc[page_index]
+            mat = fitz.Matrix(zoom, zoom)
+            pix = page.get_pixmap(matrix=mat, alpha=False, colorspace=colorspace)
         
-        mat = fitz.Matrix(zoom, zoom)
-        pix = page.get_pixmap(matrix=mat)
+        return pix.tobytes(fmt)
+    
+    def get_ink_ratio(self, page_index: int, dpi: int = 100, threshold: int = 240) -> float:
+        """
+        Estimate how much of a page is covered by content.
         
-        if not self._doc:
-            doc.close()
+        Renders a grayscale thumbnail and counts non-white pixels.
         
-        return pix.tobytes("png")
+        Args:
+            page_index: 0-based page index
+            dpi: Thumbnail resolution
+            threshold: Gray level below which a pixel counts as ink
+            
+        Returns:
+            Fraction of pixels that are ink (0.0-1.0)
+        """
+        key = (page_index, dpi, threshold)
+        if key in self._ink_ratios:
+            return self._ink_ratios[key]
+        
+        pix = self._document[page_index].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+        
+        pixels = np.frombuffer(pix.samples, dtype=np.uint8)
+        self._ink_ratios[key] = float(np.mean(pixels < threshold))
+        return self._ink_ratios[key]
+
 
+def _detect_shard(pdf_path: str, page_indices: List[int]) -> Dict[int, Optional[int]]:
+    """Detect page numbers for one shard of pages (module-level so worker processes can run it)."""
+    processor = PDFProcessor(pdf_path)
+    try:
+        return processor.detect_all_page_numbers(page_indices)
+    finally:
+        processor.close()
@@ -5,11 +5,13 @@ Verifies extracted data mirrors schematic exactly.
 from datetime import datetime
 from typing import Optional, Dict, Any, List, Tuple
 
+import numpy as np
+from sqlalchemy import Row, Select, and_, case, exists, func, select
 from sqlalchemy.orm import Session
 
 from config import Config
 from models import (
-    SchematicFile, Component, Connection, WireLabel,
+    SchematicFile, SchematicPage, Component, Connection, WireLabel,
     ValidationResult, ValidationStatus, ValidationType
 )
 
@@ -23,6 +25,11 @@ class ValidationService:
     - Coordinate bounds validation
     - Data integrity checks
     - Configurable thresholds
+    
+    Queries filter on (schematic_file_id, pdf_page_index), which the
+    idx_*_file_page composite indexes in models.py cover for every table
+    read here. Mark lookups use the uq_component_mark_page constraint's
+    (schematic_file_id, mark) prefix.
     """
     
     def __init__(self, db: Session):
@@ -38,12 +45,117 @@ class ValidationService:
         self.wire_label_warning = Config.VALIDATION_WIRE_LABEL_WARNING
         self.coord_error_pass = Config.VALIDATION_COORD_ERROR_PASS
         self.coord_error_warning = Config.VALIDATION_COORD_ERROR_WARNING
+        
+        # Per-page counts preloaded by validate_all_pages: (file id, {page: counts})
+        self._counts: Optional[Tuple[int, Dict[int, Dict[str, int]]]] = None
+    
+    def _query_counts(
+        self,
+        schematic_file_id: int,
+        pdf_page_index: Optional[int] = None
+    ) -> Dict[int, Dict[str, int]]:
+        """
+        Count extracted elements per page with one grouped query per table.
+        
+        Missing marks and empty labels are summed in the same queries.
+        
+        Args:
+            schematic_file_id: File to count
+            pdf_page_index: Restrict to one page (None for all pages)
+            
+        Returns:
+            Dictionary mapping page index to counts
+        """
+        missing_mark = case(
+            ((Component.mark == None) | (Component.mark == "") | (Component.mark == "UNKNOWN"), 1),
+            else_=0
+        )
+        missing_label = case(
+            ((WireLabel.label == None) | (WireLabel.label == ""), 1),
+            else_=0
+        )
+        
+        queries = (
+            (Component, ("components", "missing_marks"), (func.count(), func.sum(missing_mark))),
+            (Connection, ("connections",), (func.count(),)),
+            (WireLabel, ("wire_labels", "missing_labels"), (func.count(), func.sum(missing_label))),
+        )
+        
+        counts: Dict[int, Dict[str, int]] = {}
+        for model, keys, aggregates in queries:
+            query = self.db.query(model.pdf_page_index, *aggregates).filter(
+                model.schematic_file_id == schematic_file_id
+            )
+            if pdf_page_index is not None:
+                query = query.filter(model.pdf_page_index == pdf_page_index)
+            
+            for page_index, *values in query.group_by(model.pdf_page_index):
+                page_counts = counts.setdefault(page_index, {})
+                for key, value in zip(keys, values):
+                    page_counts[key] = int(value or 0)
+        
+        return counts
+    
+    def _preload_counts(self, schematic_file_id: int) -> None:
+        """Count elements for every page of a file up front."""
+        self._counts = (schematic_file_id, self._query_counts(schematic_file_id))
+    
+    def _page_counts(self, schematic_file_id: int, pdf_page_index: int) -> Dict[str, int]:
+        """Get element counts for a page, from the preload when available."""
+        if self._counts is not None and self._counts[0] == schematic_file_id:
+            by_page = self._counts[1]
+        else:
+            by_page = self._query_counts(schematic_file_id, pdf_page_index)
+        
+        page_counts = by_page.get(pdf_page_index, {})
+        return {
+            key: page_counts.get(key, 0)
+            for key in ("components", "missing_marks", "connections", "wire_labels", "missing_labels")
+        }
+    
+    def validate_all_pages(
+        self,
+        schematic_file: SchematicFile,
+        pdf_page_indices: Optional[List[int]] = None,
+        autocommit: bool = False
+    ) -> List[ValidationResult]:
+        """
+        Validate every page of a file.
+        
+        Counts for all pages are fetched once instead of per page, and
+        results are committed together rather than page by page.
+        
+        Args:
+            schematic_file: SchematicFile record
+            pdf_page_indices: Pages to validate (defaults to all detected pages)
+            autocommit: Commit once after all pages (otherwise the caller commits)
+            
+        Returns:
+            ValidationResult records in page order
+        """
+        if pdf_page_indices is None:
+            pdf_page_indices = [
+                row.pdf_page_index for row in self.db.query(SchematicPage.pdf_page_index).filter_by(
+                    schematic_file_id=schematic_file.id
+                ).order_by(SchematicPage.pdf_page_index)
+            ]
+        
+        self._preload_counts(schematic_file.id)
+        try:
+            results = [self.validate_page(schematic_file, idx) for idx in pdf_page_indices]
+        finally:
+            self._counts = None
+        
+        if autocommit:
+            self.db.commit()
+        return results
     
     def validate_page(
         self,
         schematic_file: SchematicFile,
         pdf_page_index: int,
-        expected_counts: Optional[Dict[str, int]] = None
+        expected_counts: Optional[Dict[str, int]] = None,
+        autocommit: bool = False
     ) -> ValidationResult:
         """
         Validate extraction results for a single page.
@@ -52,6 +164,8 @@ class ValidationService:
             schematic_file: SchematicFile record
             pdf_page_index: Page to validate
             expected_counts: Optional expected counts for completeness check
+            autocommit: Commit the result (otherwise it is only flushed and
+                the caller commits)
             
         Returns:
             ValidationResult record
@@ -60,20 +174,9 @@ class ValidationService:
         scores = []
         
         # Count extracted elements
-        component_count = self.db.query(Component).filter_by(
-            schematic_file_id=schematic_file.id,
-            pdf_page_index=pdf_page_index
-        ).count()
-        
-        connection_count = self.db.query(Connection).filter_by(
-            schematic_file_id=schematic_file.id,
-            pdf_page_index=pdf_page_index
-        ).count()
-        
-        wire_label_count = self.db.query(WireLabel).filter_by(
-            schematic_file_id=schematic_file.id,
-            pdf_page_index=pdf_page_index
-        ).count()
+        counts = self._page_counts(schematic_file.id, pdf_page_index)
+        component_count = counts["components"]
+        connection_count = counts["connections"]
         
         # Basic sanity checks
         if component_count == 0:
@@ -88,7 +191,7 @@ class ValidationService:
         discrepancies.extend(coord_issues)
         
         # Data integrity checks
-        integrity_issues = self._validate_data_integrity(schematic_file.id, pdf_page_index)
+        integrity_issues = self._validate_data_integrity(counts)
         discrepancies.extend(integrity_issues)
         
         # Calculate completeness score (if expected counts provided)
@@ -120,37 +223,34 @@ class ValidationService:
         )
         
         self.db.add(result)
-        self.db.commit()
+        if autocommit:
+            self.db.commit()
+        else:
+            self.db.flush()
         
         return result
     
     def validate_full_file(
         self,
-        schematic_file: SchematicFile
+        schematic_file: SchematicFile,
+        autocommit: bool = False
     ) -> ValidationResult:
         """
         Validate entire schematic file after extraction.
         
         Args:
             schematic_file: SchematicFile record
+            autocommit: Commit the result (otherwise it is only flushed and
+                the caller commits)
             
         Returns:
             ValidationResult record
         """
         discrepancies = []
         
-        # Get total counts
-        total_components = self.db.query(Component).filter_by(
-            schematic_file_id=schematic_file.id
-        ).count()
-        
-        total_connections = self.db.query(Connection).filter_by(
-            schematic_file_id=schematic_file.id
-        ).count()
-        
-        total_wire_labels = self.db.query(WireLabel).filter_by(
-            schematic_file_id=schematic_file.id
-        ).count()
+        # Get total counts, orphans and duplicate groups in one round trip
+        totals = self._file_totals(schematic_file.id)
+        total_components = totals.components
         
         # Check for empty extraction
         if total_components == 0:
@@ -161,7 +261,7 @@ class ValidationService:
             })
         
         # Check for orphaned connections
-        orphan_count = self._count_orphaned_connections(schematic_file.id)
+        orphan_count = totals.orphans
         if orphan_count > 0:
             discrepancies.append({
                 "type": "orphaned_connections",
@@ -170,14 +270,15 @@ class ValidationService:
                 "count": orphan_count
             })
         
-        # Check for duplicate component marks
-        duplicates = self._find_duplicate_marks(schematic_file.id)
-        if duplicates:
+        # Check for duplicate component marks (only a sample is listed)
+        if totals.duplicate_groups:
+            duplicates = self._find_duplicate_marks_sample(schematic_file.id)
             discrepancies.append({
                 "type": "duplicate_marks",
-                "message": f"Found duplicate component marks: {', '.join(duplicates[:5])}",
+                "message": f"Found duplicate component marks: {', '.join(duplicates)}",
                 "severity": "warning",
-                "marks": duplicates
+                "marks": duplicates,
+                "count": totals.duplicate_groups
             })
         
         # Calculate overall score
@@ -207,7 +308,10 @@ class ValidationService:
         )
         
         self.db.add(result)
-        self.db.commit()
+        if autocommit:
+            self.db.commit()
+        else:
+            self.db.flush()
         
         return result
     
@@ -219,56 +323,58 @@ class ValidationService:
         """Check coordinate bounds for components."""
         issues = []
         
-        # Get page dimensions
-        from models import SchematicPage
-        page = self.db.query(SchematicPage).filter_by(
-            schematic_file_id=schematic_file_id,
-            pdf_page_index=pdf_page_index
+        # Get page dimensions (just the two columns, not the page entity)
+        page = self.db.execute(
+            select(SchematicPage.width, SchematicPage.height).where(
+                SchematicPage.schematic_file_id == schematic_file_id,
+                SchematicPage.pdf_page_index == pdf_page_index
+            ).limit(1)
         ).first()
         
         if not page or not page.width or not page.height:
             return issues  # Can't validate without dimensions
         
-        # Check components
-        components = self.db.query(Component).filter_by(
-            schematic_file_id=schematic_file_id,
-            pdf_page_index=pdf_page_index
+        # Check positioned components, comparing all coordinates at once
+        rows = self.db.execute(
+            select(Component.id, Component.mark, Component.x, Component.y).where(
+                Component.schematic_file_id == schematic_file_id,
+                Component.pdf_page_index == pdf_page_index,
+                Component.x.isnot(None),
+                Component.y.isnot(None)
+            )
         ).all()
         
-        for comp in components:
-            if comp.x is not None and comp.y is not None:
-                if comp.x < 0 or comp.x > page.width:
-                    issues.append({
-                        "type": "coord_out_of_bounds",
-                        "message": f"Component {comp.mark} has x={comp.x} outside page width {page.width}",
-                        "severity": "warning",
-                        "component_id": comp.id
-                    })
-                if comp.y < 0 or comp.y > page.height:
-                    issues.append({
-                        "type": "coord_out_of_bounds",
-                        "message": f"Component {comp.mark} has y={comp.y} outside page height {page.height}",
-                        "severity": "warning",
-                        "component_id": comp.id
-                    })
+        xs = np.fromiter((r.x for r in rows), dtype=np.float64, count=len(rows))
+        ys = np.fromiter((r.y for r in rows), dtype=np.float64, count=len(rows))
+        x_bad = (xs < 0) | (xs > page.width)
+        y_bad = (ys < 0) | (ys > page.height)
+        
+        # Format messages only for offending components
+        for i in np.flatnonzero(x_bad | y_bad):
+            comp_id, mark, x, y = rows[i]
+            if x_bad[i]:
+                issues.append({
+                    "type": "coord_out_of_bounds",
+                    "message": f"Component {mark} has x={x} outside page width {page.width}",
+                    "severity": "warning",
+                    "component_id": comp_id
+                })
+            if y_bad[i]:
+                issues.append({
+                    "type": "coord_out_of_bounds",
+                    "message": f"Component {mark} has y={y} outside page height {page.height}",
+                    "severity": "warning",
+                    "component_id": comp_id
+                })
         
         return issues
     
-    def _validate_data_integrity(
-        self,
-        schematic_file_id: int,
-        pdf_page_index: int
-    ) -> List[Dict[str, Any]]:
-        """Check data integrity for extracted elements."""
+    def _validate_data_integrity(self, counts: Dict[str, int]) -> List[Dict[str, Any]]:
+        """Check data integrity for extracted elements using page counts."""
         issues = []
         
         # Check for components without marks
-        no_mark = self.db.query(Component).filter_by(
-            schematic_file_id=schematic_file_id,
-            pdf_page_index=pdf_page_index
-        ).filter(
-            (Component.mark == None) | (Component.mark == "") | (Component.mark == "UNKNOWN")
-        ).count()
+        no_mark = counts["missing_marks"]
         
         if no_mark > 0:
             issues.append({
@@ -279,12 +385,7 @@ class ValidationService:
             })
         
         # Check for wire labels without labels
-        no_label = self.db.query(WireLabel).filter_by(
-            schematic_file_id=schematic_file_id,
-            pdf_page_index=pdf_page_index
-        ).filter(
-            (WireLabel.label == None) | (WireLabel.label == "")
-        ).count()
+        no_label = counts["missing_labels"]
         
         if no_label > 0:
             issues.append({
@@ -296,70 +397,137 @@ class ValidationService:
         
         return issues
     
-    def _count_orphaned_connections(self, schematic_file_id: int) -> int:
-        """Count connections that reference non-existent components."""
-        # Get all component marks
-        components = self.db.query(Component.mark).filter_by(
-            schematic_file_id=schematic_file_id
-        ).all()
-        marks = {c.mark for c in components}
-        
-        # Check connections
-        connections = self.db.query(Connection).filter_by(
-            schematic_file_id=schematic_file_id
-        ).all()
-        
-        orphan_count = 0
-        for conn in connections:
-            if conn.from_component_mark and conn.from_component_mark not in marks:
-                if not conn.is_external:
-                    orphan_count += 1
-            if conn.to_component_mark and conn.to_component_mark not in marks:
-                if not conn.is_external:
-                    orphan_count += 1
+    @staticmethod
+    def _orphaned_connections_select(schematic_file_id: int) -> Select:
+        """
+        Build the orphaned connection count as a single anti-join query.
         
-        return orphan_count
+        Each non-external connection end whose mark matches no component in
+        the file counts once, so a connection can contribute up to two.
+        """
+        def orphaned(mark_column):
+            return case(
+                (
+                    and_(
+                        mark_column != "",
+                        ~exists().where(
+                            Component.schematic_file_id == schematic_file_id,
+                            Component.mark == mark_column
+                        )
+                    ),
+                    1
+                ),
+                else_=0
+            )
+        
+        return select(
+            func.coalesce(
+                func.sum(orphaned(Connection.from_component_mark) + orphaned(Connection.to_component_mark)),
+                0
+            )
+        ).where(
+            Connection.schematic_file_id == schematic_file_id,
+            Connection.is_external.isnot(True)
+        )
     
-    def _find_duplicate_marks(self, schematic_file_id: int) -> List[str]:
-        """Find component marks that appear multiple times on same page."""
-        from sqlalchemy import func
+    def _file_totals(self, schematic_file_id: int) -> Row:
+        """
+        Fetch file-wide aggregates with a single query.
         
-        duplicates = self.db.query(
-            Component.mark,
-            Component.pdf_page_index,
-            func.count(Component.id).label("count")
-        ).filter_by(
-            schematic_file_id=schematic_file_id
+        Returns:
+            Row with components, connections, wire_labels, orphans and
+            duplicate_groups counts
+        """
+        def total(model):
+            return select(func.count()).select_from(model).where(
+                model.schematic_file_id == schematic_file_id
+            ).scalar_subquery()
+        
+        duplicate_groups = select(func.count()).select_from(
+            self._duplicate_marks_select(schematic_file_id).subquery()
+        ).scalar_subquery()
+        
+        return self.db.execute(select(
+            total(Component).label("components"),
+            total(Connection).label("connections"),
+            total(WireLabel).label("wire_labels"),
+            self._orphaned_connections_select(schematic_file_id).scalar_subquery().label("orphans"),
+            duplicate_groups.label("duplicate_groups")
+        )).one()
+    
+    def _find_duplicate_marks_sample(self, schematic_file_id: int, limit: int = 5) -> List[str]:
+        """Find up to `limit` component marks that appear multiple times on same page."""
+        return list(self.db.scalars(
+            self._duplicate_marks_select(schematic_file_id).order_by(Component.mark).limit(limit)
+        ))
+    
+    @staticmethod
+    def _duplicate_marks_select(schematic_file_id: int) -> Select:
+        """Build the query for marks repeated on a page, one row per (mark, page)."""
+        return select(Component.mark).where(
+            Component.schematic_file_id == schematic_file_id
         ).group_by(
             Component.mark,
             Component.pdf_page_index
         ).having(
             func.count(Component.id) > 1
-        ).all()
-        
-        return [d.mark for d in duplicates]
+        )
     
     def get_validation_summary(
         self,
-        schematic_file_id: int
+        schematic_file_id: int,
+        include_discrepancies: bool = True
     ) -> Dict[str, Any]:
-        """Get summary of all validation results for a file."""
-        results = self.db.query(ValidationResult).filter_by(
-            schematic_file_id=schematic_file_id
+        """
+        Get summary of all validation results for a file.
+        
+        Counts and average confidence are aggregated in SQL; the
+        discrepancies JSON is only read when requested.
+        
+        Args:
+            schematic_file_id: File to summarize
+            include_discrepancies: Add the combined discrepancy list
+            
+        Returns:
+            Summary dictionary
+        """
+        rows = self.db.execute(
+            select(
+                ValidationResult.status,
+                func.count(),
+                func.sum(func.coalesce(ValidationResult.confidence_score, 0))
+            ).where(
+                ValidationResult.schematic_file_id == schematic_file_id
+            ).group_by(ValidationResult.status)
         ).all()
         
+        counts = {status: count for status, count, _ in rows}
+        total = sum(counts.values())
+        confidence_total = sum(confidence or 0 for _, _, confidence in rows)
+        
         summary = {
-            "total_validations": len(results),
-            "passed": sum(1 for r in results if r.status == ValidationStatus.PASS),
-            "warnings": sum(1 for r in results if r.status == ValidationStatus.WARNING),
-            "failed": sum(1 for r in results if r.status == ValidationStatus.FAIL),
-            "avg_confidence": sum(r.confidence_score or 0 for r in results) / len(results) if results else 0,
+            "total_validations": total,
+            "passed": counts.get(ValidationStatus.PASS, 0),
+            "warnings": counts.get(ValidationStatus.WARNING, 0),
+            "failed": counts.get(ValidationStatus.FAIL, 0),
+            "avg_confidence": confidence_total / total if total else 0,
             "all_discrepancies": []
         }
         
-        for result in results:
-            if result.discrepancies:
-                summary["all_discrepancies"].extend(result.discrepancies)
+        if include_discrepancies and total:
+            summary["all_discrepancies"] = self.get_all_discrepancies(schematic_file_id)
         
         return summary
-
+    
+    def get_all_discrepancies(self, schematic_file_id: int) -> List[Dict[str, Any]]:
+        """Collect discrepancies from all validation results for a file."""
+        discrepancies = []
+        rows = self.db.execute(
+            select(ValidationResult.discrepancies).where(
+                ValidationResult.schematic_file_id == schematic_file_id
+            ).execution_options(yield_per=100)
+        ).scalars()
+        for result_discrepancies in rows:
+            if result_discrepancies:
+                discrepancies.extend(result_discrepancies)
+        return discrepancies
@@ -0,0 +1,52 @@
+"""
+Shared fixtures.
+
+Tests run against an in-memory SQLite database and never call Gemini; the
+API key is only set so Config and GeminiService can be constructed.
+"""
+import os
+
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from config import Config
+from models import Base, Machine, SchematicFile
+
+
+@pytest.fixture(autouse=True)
+def _isolated_cache_dir(tmp_path, monkeypatch):
+    """Keep the on-disk Gemini response cache out of the repo."""
+    monkeypatch.setattr(Config, "CACHE_DIR", tmp_path / "cache")
+
+
+@pytest.fixture
+def db():
+    """Session on a fresh in-memory database."""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
+
+
+@pytest.fixture
+def schematic_file(db, tmp_path):
+    """SchematicFile record for a PDF path under tmp_path (the PDF itself is not created)."""
+    machine = Machine(name="Test machine")
+    db.add(machine)
+    db.flush()
+    schematic_file = SchematicFile(
+        machine_id=machine.id,
+        filename="schematic.pdf",
+        filepath=str(tmp_path / "schematic.pdf"),
+        file_hash="0" * 64
+    )
+    db.add(schematic_file)
+    db.commit()
+    return schematic_file
@@ -0,0 +1,97 @@
+"""Tests for ExtractionService page handling."""
+from pathlib import Path
+
+import fitz
+import pytest
+
+from models import ExtractionError, ExtractionStatus, SchematicPage
+from services import extraction_service
+from services.extraction_service import ExtractionEvent, ExtractionService
+from services.gemini_service import GeminiService
+
+
+class FakeGeminiService(GeminiService):
+    """GeminiService that answers from memory; pages outside the PDF fail like a bad request."""
+    
+    page_count = 0
+    
+    def upload_file(self, file_path, display_name=None):
+        return type("File", (), {"name": "files/test"})()
+    
+    def create_cached_content(self, **kwargs):
+        return type("CachedContent", (), {"name": "cachedContents/test"})()
+    
+    def iter_detect_then_extract(self, cached_content, pdf_page_indices, **kwargs):
+        for idx in pdf_page_indices:
+            yield None, None, None
+            if idx >= self.page_count:
+                yield idx, None, ValueError(f"page {idx + 1} is not in the document")
+            else:
+                yield idx, {"schematic_page_number": idx + 1, "confidence": 0.9}, {
+                    "components": [{"mark": f"K{idx}", "x": 10, "y": 10}],
+                    "connections": [],
+                    "wire_labels": []
+                }
+
+
+def _write_pdf(path: Path, blank_pages: set, page_count: int) -> None:
+    doc = fitz.open()
+    for idx in range(page_count):
+        page = doc.new_page()
+        if idx not in blank_pages:
+            page.insert_text((72, 72), "RELAY K1 " * 20, fontsize=24)
+    doc.save(path)
+    doc.close()
+
+
+@pytest.fixture
+def service(db, monkeypatch):
+    monkeypatch.setattr(extraction_service, "GeminiService", FakeGeminiService)
+    monkeypatch.setattr(extraction_service.Config, "GEMINI_USE_BATCH_MODE", False)
+    monkeypatch.setattr(extraction_service.Config, "GEMINI_COMBINE_TITLE_BLOCKS", False)
+    monkeypatch.setattr(extraction_service.Config, "GEMINI_SKIP_BLANK_PAGES", True)
+    return ExtractionService(db)
+
+
+def test_blank_and_out_of_range_pages(db, schematic_file, service):
+    """Blank pages skip Gemini, and pages past the end fail alone instead of aborting the run."""
+    _write_pdf(Path(schematic_file.filepath), blank_pages={1}, page_count=3)
+    FakeGeminiService.page_count = 3
+    
+    events = list(service.extract_schematic(
+        schematic_file,
+        pdf_page_indices=[0, 1, 2, 7],
+        context_page_indices=[0, 1]
+    ))
+    
+    assert events[-1].type == ExtractionEvent.COMPLETE
+    assert schematic_file.extraction_status == ExtractionStatus.COMPLETED
+    
+    pages = {
+        page.pdf_page_index: page
+        for page in db.query(SchematicPage).filter_by(schematic_file_id=schematic_file.id)
+    }
+    assert sorted(pages) == [0, 1, 2, 7]
+    assert pages[1].is_processed and pages[1].schematic_page_number is None
+    assert pages[0].is_processed and pages[2].is_processed
+    assert not pages[7].is_processed
+    assert pages[7].width is None and pages[7].height is None
+    
+    errors = db.query(ExtractionError).filter_by(schematic_file_id=schematic_file.id).all()
+    assert [error.pdf_page_index for error in errors] == [7]
+
+
+def test_only_out_of_range_pages(db, schematic_file, service):
+    """A run whose pages are all past the end still completes, recording an error per page."""
+    _write_pdf(Path(schematic_file.filepath), blank_pages=set(), page_count=2)
+    FakeGeminiService.page_count = 2
+    
+    events = list(service.extract_schematic(
+        schematic_file,
+        pdf_page_indices=[5],
+        context_page_indices=[0, 1]
+    ))
+    
+    assert events[-1].type == ExtractionEvent.COMPLETE
+    errors = db.query(ExtractionError).filter_by(schematic_file_id=schematic_file.id).all()
+    assert [error.pdf_page_index for error in errors] == [5]
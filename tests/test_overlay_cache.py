@@ -0,0 +1,88 @@
+"""Tests for overlay cache invalidation on extracted data changes."""
+import pytest
+
+from models import Component, Machine, SchematicFile
+from services import overlay_cache
+from services.overlay_service import OverlayService
+
+
+@pytest.fixture(autouse=True)
+def _empty_cache():
+    overlay_cache._overlay_cache.clear()
+    yield
+    overlay_cache._overlay_cache.clear()
+
+
+def _key(schematic_file_id, component_id):
+    """Cache key shaped like OverlayService.create_component_overlay's."""
+    return (schematic_file_id, "/tmp/schematic.pdf", 0, 1024, component_id, True, True)
+
+
+@pytest.fixture
+def component(db, schematic_file):
+    component = Component(schematic_file_id=schematic_file.id, mark="K1", pdf_page_index=0)
+    db.add(component)
+    db.commit()
+    return component
+
+
+def test_update_invalidates_on_commit(db, component):
+    key = _key(component.schematic_file_id, component.id)
+    overlay_cache.put_overlay(key, b"%PDF")
+    
+    component.mark = "K2"
+    db.flush()
+    # Other sessions can't see the change yet
+    assert overlay_cache.get_overlay(key) == b"%PDF"
+    
+    db.commit()
+    assert overlay_cache.get_overlay(key) is None
+
+
+def test_rollback_keeps_cache(db, component):
+    key = _key(component.schematic_file_id, component.id)
+    overlay_cache.put_overlay(key, b"%PDF")
+    
+    component.mark = "K2"
+    db.flush()
+    db.rollback()
+    
+    assert overlay_cache.get_overlay(key) == b"%PDF"
+    
+    # A later unrelated commit doesn't replay the rolled back invalidation
+    db.add(Machine(name="Other machine"))
+    db.commit()
+    assert overlay_cache.get_overlay(key) == b"%PDF"
+
+
+def test_insert_and_delete_invalidate(db, component):
+    key = _key(component.schematic_file_id, component.id)
+    
+    overlay_cache.put_overlay(key, b"%PDF")
+    db.add(Component(schematic_file_id=component.schematic_file_id, mark="K3", pdf_page_index=0))
+    db.commit()
+    assert overlay_cache.get_overlay(key) is None
+    
+    overlay_cache.put_overlay(key, b"%PDF")
+    db.delete(component)
+    db.commit()
+    assert overlay_cache.get_overlay(key) is None
+
+
+def test_invalidate_is_per_file(db, schematic_file, component):
+    other = SchematicFile(
+        machine_id=schematic_file.machine_id,
+        filename="other.pdf",
+        filepath="other.pdf",
+        file_hash="1" * 64
+    )
+    db.add(other)
+    db.commit()
+    
+    overlay_cache.put_overlay(_key(schematic_file.id, component.id), b"%PDF")
+    overlay_cache.put_overlay(_key(other.id, 1), b"%PDF-other")
+    
+    OverlayService.invalidate(schematic_file.id)
+    
+    assert overlay_cache.get_overlay(_key(schematic_file.id, component.id)) is None
+    assert overlay_cache.get_overlay(_key(other.id, 1)) == b"%PDF-other"
@@ -0,0 +1,99 @@
+"""Tests for ValidationService aggregate queries, checked against row-by-row counts."""
+import pytest
+
+from models import Component, Connection, WireLabel
+from services.validation_service import ValidationService
+
+
+@pytest.fixture
+def extracted(db, schematic_file):
+    """A file with components, connections and labels spread over three pages."""
+    file_id = schematic_file.id
+    db.add_all([
+        Component(schematic_file_id=file_id, mark="K1", pdf_page_index=0),
+        Component(schematic_file_id=file_id, mark="K2", pdf_page_index=0),
+        Component(schematic_file_id=file_id, mark="", pdf_page_index=0),
+        Component(schematic_file_id=file_id, mark="UNKNOWN", pdf_page_index=1),
+        Component(schematic_file_id=file_id, mark="M1", pdf_page_index=2),
+        Connection(schematic_file_id=file_id, pdf_page_index=0, from_component_mark="K1", to_component_mark="K2"),
+        Connection(schematic_file_id=file_id, pdf_page_index=0, from_component_mark="K1", to_component_mark="X9"),
+        Connection(schematic_file_id=file_id, pdf_page_index=1, from_component_mark="Y1", to_component_mark="Y2"),
+        Connection(schematic_file_id=file_id, pdf_page_index=1, from_component_mark="Z1", to_component_mark=None),
+        Connection(schematic_file_id=file_id, pdf_page_index=2, from_component_mark="", to_component_mark="M1"),
+        Connection(schematic_file_id=file_id, pdf_page_index=2, from_component_mark="Q1", to_component_mark="M1",
+                   is_external=True),
+        WireLabel(schematic_file_id=file_id, label="101", pdf_page_index=0),
+        WireLabel(schematic_file_id=file_id, label="", pdf_page_index=0),
+        WireLabel(schematic_file_id=file_id, label="102", pdf_page_index=2),
+    ])
+    db.commit()
+    return schematic_file
+
+
+def _naive_counts(db, file_id):
+    counts = {}
+    
+    def page(idx):
+        return counts.setdefault(idx, {})
+    
+    for component in db.query(Component).filter_by(schematic_file_id=file_id):
+        page_counts = page(component.pdf_page_index)
+        page_counts["components"] = page_counts.get("components", 0) + 1
+        missing = component.mark in (None, "", "UNKNOWN")
+        page_counts["missing_marks"] = page_counts.get("missing_marks", 0) + missing
+    for connection in db.query(Connection).filter_by(schematic_file_id=file_id):
+        page_counts = page(connection.pdf_page_index)
+        page_counts["connections"] = page_counts.get("connections", 0) + 1
+    for wire_label in db.query(WireLabel).filter_by(schematic_file_id=file_id):
+        page_counts = page(wire_label.pdf_page_index)
+        page_counts["wire_labels"] = page_counts.get("wire_labels", 0) + 1
+        page_counts["missing_labels"] = page_counts.get("missing_labels", 0) + (not wire_label.label)
+    return counts
+
+
+def _naive_orphans(db, file_id):
+    marks = {component.mark for component in db.query(Component).filter_by(schematic_file_id=file_id)}
+    orphans = 0
+    for connection in db.query(Connection).filter_by(schematic_file_id=file_id):
+        if connection.is_external:
+            continue
+        for mark in (connection.from_component_mark, connection.to_component_mark):
+            if mark and mark not in marks:
+                orphans += 1
+    return orphans
+
+
+def test_query_counts_match_row_counts(db, extracted):
+    service = ValidationService(db)
+    assert service._query_counts(extracted.id) == _naive_counts(db, extracted.id)
+
+
+def test_query_counts_for_one_page(db, extracted):
+    service = ValidationService(db)
+    assert service._query_counts(extracted.id, 1) == {1: _naive_counts(db, extracted.id)[1]}
+    assert service._query_counts(extracted.id, 9) == {}
+
+
+def test_page_counts_with_and_without_preload(db, extracted):
+    service = ValidationService(db)
+    direct = {idx: service._page_counts(extracted.id, idx) for idx in range(4)}
+    service._preload_counts(extracted.id)
+    assert {idx: service._page_counts(extracted.id, idx) for idx in range(4)} == direct
+    assert direct[3] == dict.fromkeys(
+        ("components", "missing_marks", "connections", "wire_labels", "missing_labels"), 0
+    )
+
+
+def test_orphaned_connections_match_row_check(db, extracted):
+    orphans = db.scalar(ValidationService._orphaned_connections_select(extracted.id))
+    assert orphans == _naive_orphans(db, extracted.id) == 4
+
+
+def test_orphaned_connections_without_connections(db, schematic_file):
+    assert db.scalar(ValidationService._orphaned_connections_select(schematic_file.id)) == 0
+
+
+def test_file_totals(db, extracted):
+    totals = ValidationService(db)._file_totals(extracted.id)
+    assert (totals.components, totals.connections, totals.wire_labels) == (5, 6, 3)
+    assert totals.orphans == _naive_orphans(db, extracted.id)